@@ -40,6 +40,7 @@ MIDDLEWARE = [
     "debug_toolbar.middleware.DebugToolbarMiddleware",
 
     'django.middleware.security.SecurityMiddleware',
+    "main.middlewares.page_cache_middleware",  # before the session
     'django.contrib.sessions.middleware.SessionMiddleware',  # user-related
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -217,3 +218,22 @@ CHANNEL_LAYERS = {
         }
     }
 }
+
+# Cache (the product listing pages, see 'main/caching.py')
+#   internal: the local-memory cache is per-process,
+#             use a shared one (memcached, redis ..) with several workers
+#             or a catalog change won't be seen by the other processes
+#             (nor the report versions & locks), `./manage.py check`
+#             warns about it once DEBUG is off (see 'main/checks.py').
+#   doc-site: https://docs.djangoproject.com/en/2.1/topics/cache/
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "booktime",
+    }
+}
+
+# Thumbnails (see 'main/thumbnails.py')
+#   The Pillow work runs in a pool of processes, off the request.
+#   0 -> no pool at all, generated right after the save (commit).
+THUMBNAIL_WORKERS = 2
@@ -10,6 +10,36 @@ let imageStyle = {
     display: "inline-block"
 };
 
+// The browser picks the rendition by itself (see 'main/renditions.py')
+const imageSizes = "(max-width: 640px) 100vw, 640px";
+
+function picture(image) {
+    const srcset = image.srcset || {};
+    const sources = [];
+
+    if (srcset.webp) {
+        sources.push(e("source", {
+            key: "webp",
+            type: "image/webp",
+            srcSet: srcset.webp,
+            sizes: imageSizes
+        }));
+    }
+
+    return e(
+        "picture", {},
+        sources,
+        e(
+            "img",
+            {
+                src: image.image,
+                srcSet: srcset.jpeg,
+                sizes: srcset.jpeg ? imageSizes : undefined
+            }
+        )
+    );
+}
+
 class ImageBox extends React.Component {
     constructor(props) {
         super(props);
@@ -44,10 +74,7 @@ class ImageBox extends React.Component {
             "div", {className: "gallery"},
             e(
                 "div", {className: "current-image"},
-                e(
-                    "img",
-                    {src: this.state.currentImage.image}
-                )
+                picture(this.state.currentImage)
             ),
             images
         )
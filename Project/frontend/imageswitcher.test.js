@@ -37,7 +37,7 @@ test("ImageBox switches images correctly", () => {
     );
 
     const currentImage = wrapper
-        .find(".current-image > img")
+        .find(".current-image img")
         .first()
         .prop("src");
 
@@ -48,9 +48,46 @@ test("ImageBox switches images correctly", () => {
         .simulate("click");
 
     const newImage = wrapper
-        .find(".current-image > img")
+        .find(".current-image img")
         .first()
         .prop("src");
 
     expect(currentImage).not.toEqual(newImage);
-});
\ No newline at end of file
+});
+
+test("ImageBox offers the renditions to the browser", () => {
+    let images = [
+        {
+            "image": "1.jpg",
+            "thumbnail": "1.thumb.jpg",
+            "srcset": {
+                "jpeg": "1-320.jpg 320w, 1-640.jpg 640w",
+                "webp": "1-320.webp 320w, 1-640.webp 640w"
+            }
+        },
+        {
+            "image": "2.jpg",
+            "thumbnail": "2.thumb.jpg"
+        }
+    ];
+
+    const wrapper = Enzyme.mount(
+        React.createElement(
+            ImageBox,
+            {images: images, imageStart: images[0]}
+        )
+    );
+
+    expect(
+        wrapper.find(".current-image source").prop("srcSet")
+    ).toEqual("1-320.webp 320w, 1-640.webp 640w");
+    expect(
+        wrapper.find(".current-image img").prop("srcSet")
+    ).toEqual("1-320.jpg 320w, 1-640.jpg 640w");
+
+    // No renditions (yet), the image itself
+    wrapper.find("div.image").at(1).find("img").simulate("click");
+
+    expect(wrapper.find(".current-image source").exists()).toBe(false);
+    expect(wrapper.find(".current-image img").prop("src")).toEqual("2.jpg");
+});
@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta
+from datetime import timedelta
 import logging
 import tempfile
 
@@ -15,12 +15,9 @@ from django.utils.html import format_html
 from django.template.loader import render_to_string
 from django.shortcuts import get_object_or_404, render
 
-from django.db.models.functions import TruncDay
-from django.db.models import Avg, Count, Min, Sum
-
 from weasyprint import HTML
 
-from . import models
+from . import caching, models, reports, search
 
 logger = logging.getLogger(__name__)
 
@@ -94,6 +91,18 @@ class ProductAdmin(admin.ModelAdmin):
         else:
             return { }
 
+    def get_search_results(self, request, queryset, search_term):
+        """
+        The `search_fields` only turns the search box on,
+        the search itself is the indexed one (no `icontains` scan).
+        -> (queryset, may_have_duplicates)
+        """
+
+        if not search_term.strip():
+            return queryset, False
+
+        return search.search_products(queryset, search_term), False
+
 
 class DispatchersProductAdmin(ProductAdmin):
     readonly_fields = ("description", "price", "tags", "active")
@@ -250,24 +259,37 @@ class BasketAdmin(admin.ModelAdmin):
     list_display = ("id", "user", "status", "count")
     list_editable = ("status",)
     list_filter = ("status",)
+    readonly_fields = ("item_count", "line_count")
     inlines = (BasketLineInline,)
 
+    def save_related(self, request, form, formsets, change):
+        """
+        The lines might have been changed by the inlines.
+        """
+
+        super().save_related(request, form, formsets, change)
+        form.instance.recount()
+
 
 class OrderLineInline(admin.TabularInline):
     model = models.OrderLine
     raw_id_fields = ("product",)
 
+    # A snapshot taken when the line is written (see 'main/signals.py')
+    readonly_fields = ("unit_price",)
+
 
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "status")
+    list_display = ("id", "user", "status", "total")
     list_editable = ("status",)
+    readonly_fields = ("subtotal", "total")
     list_filter = ("status", "shipping_country", "date_added")
 
     inlines = (OrderLineInline,)
 
     fieldsets = (
         (
-            "None", { "fields": ("user", "status") }
+            "None", { "fields": ("user", "status", "subtotal", "total") }
         ),
         (
             "Billing info",
@@ -305,18 +327,18 @@ class OrderAdmin(admin.ModelAdmin):
 
 class CentralOfficeOrderLineInline(admin.TabularInline):
     model = models.OrderLine
-    readonly_fields = ("product",)
+    readonly_fields = ("product", "quantity", "unit_price")
 
 
 class CentralOfficeOrderAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "status")
+    list_display = ("id", "user", "status", "total")
     list_editable = ("status",)
-    readonly_fields = ("user",)
+    readonly_fields = ("user", "subtotal", "total")
     list_filter = ("status", "shipping_country", "date_added")
     inlines = (CentralOfficeOrderLineInline,)
 
     fieldsets = (
-        (None, { "fields": ("user", "status") }),
+        (None, { "fields": ("user", "status", "subtotal", "total") }),
         (
             "Billing info",
             {
@@ -397,6 +419,29 @@ class PeriodSelectForm(forms.Form):
     )
 
 
+class SalesBreakdownForm(PeriodSelectForm):
+    BY = (
+        ("country", "Shipping country"),
+        ("product", "Product"),
+        ("status", "Line status"),
+        ("day", "Day"),
+    )
+    VALUES = (
+        ("amount", "Revenue"),
+        ("quantity", "Units"),
+        ("lines", "Lines"),
+    )
+
+    by = forms.ChoiceField(choices=BY)
+    value = forms.ChoiceField(choices=VALUES)
+    statuses = forms.TypedMultipleChoiceField(
+        choices=models.OrderLine.STATUSES,
+        coerce=int,
+        required=False,
+        help_text="All of them if none is selected",
+    )
+
+
 class ColoredAdminSite(admin.sites.AdminSite):
     def each_context(self, request):
         context = super().each_context(request)
@@ -412,6 +457,9 @@ class ColoredAdminSite(admin.sites.AdminSite):
 
 
 class ReportingColoredAdminSite(ColoredAdminSite):
+    # The length of the "Most bought products" list
+    TOP_PRODUCTS = 20
+
     def get_urls(self):
         urls = super().get_urls()
 
@@ -419,47 +467,53 @@ class ReportingColoredAdminSite(ColoredAdminSite):
             path(
                 "orders_per_day/",
                 self.admin_view(self.orders_per_day),
+                name="orders_per_day",
             ),
             path(
                 "most_bought_products/",
                 self.admin_view(self.most_bought_products),
                 name="most_bought_products",
             ),
+            path(
+                "revenue_per_day/",
+                self.admin_view(self.revenue_per_day),
+                name="revenue_per_day",
+            ),
+            path(
+                "sales_breakdown/",
+                self.admin_view(self.sales_breakdown),
+                name="sales_breakdown",
+            ),
         ]
 
         return my_urls + urls
 
     def orders_per_day(self, request):
         """
-        About the `datetime.now` issue (warning was raised)
-            Check this post
-                TITLE   RuntimeWarning: DateTimeField received a naive datetime
-                LINK    https://stackoverflow.com/a/45080605/6273859 (one of them)
+        Read from the daily rollup ('DailyOrderStat', see 'main/reports.py'),
+        no `GROUP BY` over the orders of the last 180 days anymore.
+
+        `labels` & `values` provide data for plotting purposes,
+        that is used by a JavaScript library (i.e. Chart.js),
+        along with the breakdowns by status & by shipping country.
+
+        Cached (see `cached_report`), `computed_at` tells how old it is,
+        the day is in the key (yesterday's result isn't today's one).
         """
 
-        starting_day = datetime.now(tz=timezone.utc) - timedelta(days=180)
-        order_data = (
-            models.Order.objects
-                .filter(date_added__gt=starting_day)
-                .annotate(day=TruncDay("date_added"))
-                .values("day")
-                .annotate(c=Count("id"))
+        data, computed_at = caching.cached_report(
+            "orders_per_day",
+            reports.orders_per_day,
+            days=180,
+            last=timezone.localdate(),
         )
 
-        # These two provide data for plotting purposes,
-        # that is used by a JavaScript library (i.e. Chart.js).
-        labels = [
-            x["day"].strftime("%Y-%d-%d")
-            for x in order_data
-        ]
-        values = [x["c"] for x in order_data]
-
         # Make the templates could use the data
         context = dict(
             self.each_context(request),
             title="Orders per day",
-            labels=labels,
-            values=values,
+            computed_at=computed_at,
+            **data
         )
 
         return TemplateResponse(
@@ -467,44 +521,123 @@ class ReportingColoredAdminSite(ColoredAdminSite):
         )
 
     def most_bought_products(self, request):
+        """
+        Read from the sales rollup ('DailyProductSales'),
+        the top `TOP_PRODUCTS` only, cached (see `cached_report`).
+        """
+
+        data = dict.fromkeys(("labels", "values", "revenues", "rows"))
+        computed_at = None
+
         if request.method == "POST":
             form = PeriodSelectForm(request.POST)
 
             if form.is_valid():
                 pd_days = form.cleaned_data["period"]
-                starting_day = datetime.now(tz=timezone.utc) - timedelta(days=pd_days)
 
-                data = (
-                    models.OrderLine.objects
-                        .filter(order__date_added__gt=starting_day)
-                        .values("product__name")
-                        .annotate(c=Count("id"))
+                # The last `pd_days` days, today included
+                today = timezone.localdate()
+                data, computed_at = caching.cached_report(
+                    "most_bought_products",
+                    reports.most_bought_products,
+                    first=today - timedelta(days=pd_days - 1),
+                    last=today,
+                    limit=self.TOP_PRODUCTS,
                 )
 
-                logger.info(
-                    "most_bought_products query: [%s]",
-                    data.query
-                )
+        else:
+            form = PeriodSelectForm()
+
+        # `labels`, `values` (units), `revenues` & `rows`, the best first
+        context = dict(
+            self.each_context(request),
+            title="Most bought products",
+            form=form,
+            computed_at=computed_at,
+            **data
+        )
+
+        return TemplateResponse(
+            request, "most_bought_products.html", context
+        )
+
+    def revenue_per_day(self, request):
+        """
+        Read from the sales rollup ('DailyProductSales') too,
+        the price of every line was captured at the checkout.
+        Cached as well (see `cached_report`).
+        """
+
+        data = dict.fromkeys(("labels", "values", "total"))
+        computed_at = None
+
+        if request.method == "POST":
+            form = PeriodSelectForm(request.POST)
+
+            if form.is_valid():
+                pd_days = form.cleaned_data["period"]
 
-                labels = [x["product__name"] for x in data]
-                values = [x["c"] for x in data]
+                # The last `pd_days` days, today included
+                today = timezone.localdate()
+                data, computed_at = caching.cached_report(
+                    "revenue_per_day",
+                    reports.revenue_per_day,
+                    first=today - timedelta(days=pd_days - 1),
+                    last=today,
+                )
 
         else:
             form = PeriodSelectForm()
 
-            labels = None
-            values = None
+        context = dict(
+            self.each_context(request),
+            title="Revenue per day",
+            form=form,
+            computed_at=computed_at,
+            **data
+        )
+
+        return TemplateResponse(
+            request, "revenue_per_day.html", context
+        )
+
+    def sales_breakdown(self, request):
+        """
+        Sliced by whatever the form says (country, product, status, day),
+        from the columnar facts ('main/analytics.py') of this process,
+        brought up to date first (by their watermark), no `GROUP BY` at all.
+        """
+
+        data = dict.fromkeys(("labels", "values", "rows"))
+
+        if request.method == "POST":
+            form = SalesBreakdownForm(request.POST)
+
+            if form.is_valid():
+                pd_days = form.cleaned_data["period"]
+
+                # The last `pd_days` days, today included
+                today = timezone.localdate()
+                data = reports.sales_breakdown(
+                    first=today - timedelta(days=pd_days - 1),
+                    last=today,
+                    by=form.cleaned_data["by"],
+                    value=form.cleaned_data["value"],
+                    statuses=form.cleaned_data["statuses"],
+                )
+
+        else:
+            form = SalesBreakdownForm()
 
         context = dict(
             self.each_context(request),
-            title="Most bought products",
+            title="Sales breakdown",
             form=form,
-            labels=labels,
-            values=values,
+            **data
         )
 
         return TemplateResponse(
-            request, "most_bought_products.html", context
+            request, "sales_breakdown.html", context
         )
 
     def index(self, request, extra_context = None):
@@ -517,6 +650,14 @@ class ReportingColoredAdminSite(ColoredAdminSite):
                 "name": "Most bought products",
                 "link": "most_bought_products/",
             },
+            {
+                "name": "Revenue per day",
+                "link": "revenue_per_day/",
+            },
+            {
+                "name": "Sales breakdown",
+                "link": "sales_breakdown/",
+            },
         ]
 
         if not extra_context:
@@ -547,7 +688,15 @@ class InvoiceMixin:
         return my_urls + urls
 
     def invoice_for_order(self, request, order_id):
-        order = get_object_or_404(models.Order, pk=order_id)
+        """
+        The totals come from the order row itself (`subtotal`, `total`),
+        the lines & their products with one more query.
+        """
+
+        order = get_object_or_404(
+            models.Order.objects.prefetch_related("lines__product"),
+            pk=order_id,
+        )
 
         if request.GET.get("format") == "pdf":
             html_string = render_to_string(
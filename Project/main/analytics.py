@@ -0,0 +1,347 @@
+import threading
+from decimal import Decimal
+from datetime import date, timedelta
+from itertools import islice
+
+import numpy as np
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import models
+
+# ********************-----**********************
+# ************** Columnar line facts ************
+# ********************-----**********************
+
+# || one row per 'OrderLine', one NumPy array per column (no objects at all)
+# || filter     ->  a boolean mask over the columns
+# || group by   ->  `np.bincount` (weights = the values summed)
+# || top N      ->  a sort of the (few) groups
+# Ad-hoc slices of the orders without a `GROUP BY` on the primary db,
+# the fixed reports keep reading their rollups ('DailyOrderStat' ..).
+
+EPOCH = date(1970, 1, 1)
+
+# name -> dtype, `day` is in days since 1970-01-01 (local date of the order),
+# `amount` in cents (quantity * unit_price), `country` a code (see `countries`)
+COLUMNS = (
+    ("order", np.int64),
+    ("product", np.int64),
+    ("day", np.int32),
+    ("status", np.int16),
+    ("order_status", np.int16),
+    ("country", np.int16),
+    ("quantity", np.int64),
+    ("amount", np.int64),
+)
+
+FIELDS = (
+    "order_id",
+    "product_id",
+    "day",
+    "status",
+    "order__status",
+    "order__shipping_country",
+    "quantity",
+    "unit_price",
+)
+
+CHUNK_SIZE = 50000
+
+# Ids per `IN (..)` (SQLite allows 999 parameters at most)
+IDS_PER_QUERY = 500
+
+
+def to_day(value):
+    return (value - EPOCH).days
+
+
+def from_day(value):
+    return EPOCH + timedelta(days=int(value))
+
+
+def empty_columns():
+    return { name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS }
+
+
+class LineFacts:
+    """
+    In-process (every worker has its own), loaded from the database
+    on first use, then refreshed by the `date_updated` watermark.
+
+    About the watermark
+        || the orders & lines updated since the last refresh (both indexed)
+        ||  -> every line of THOSE orders is dropped & read again
+        Re-read from `OVERLAP` before the watermark, a transaction may
+        commit a bit later than its `date_updated` (re-reading is harmless).
+
+    About the deletions
+        A deleted line moves the `date_updated` of its order (the signals),
+        a deleted order is forgotten by this process only (`forget`),
+        the other processes drop it at their next full load (`MAX_AGE`).
+
+    Usage
+    >> facts.top("product", "quantity", first=date(2026, 10, 1), limit=5)
+    [(3, 120), (7, 96), ..]
+    >> facts.group_by("country", "amount", status=[10, 20])
+    { "uk": Decimal("1520.00"), "fr": Decimal("310.50") }
+    """
+
+    OVERLAP = timedelta(minutes=5)
+    MAX_AGE = timedelta(hours=1)
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.columns = empty_columns()
+        self.countries = []
+        self.country_codes = { }
+        self.watermark = None
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self.columns["order"])
+
+    # -------------------- Loading ---------- ----------
+
+    def build(self):
+        """
+        Everything, in chunks of `CHUNK_SIZE` lines.
+        """
+
+        with self._lock:
+            started = timezone.now()
+
+            self.countries = []
+            self.country_codes = { }
+            self.columns = self.read(models.OrderLine.objects.all())
+            self.watermark = started
+            self.loaded_at = started
+
+    def refresh(self):
+        """
+        Two indexed queries (+ the lines of the changed orders, if any).
+        """
+
+        with self._lock:
+            started = timezone.now()
+
+            if self.watermark is None \
+                    or started - self.loaded_at > self.MAX_AGE:
+                self.build()
+                return
+
+            since = self.watermark - self.OVERLAP
+            changed = set(
+                models.Order.objects
+                    .filter(date_updated__gte=since)
+                    .values_list("id", flat=True)
+            )
+            changed.update(
+                models.OrderLine.objects
+                    .filter(date_updated__gte=since)
+                    .values_list("order_id", flat=True)
+            )
+
+            if changed:
+                self.replace(sorted(changed))
+
+            self.watermark = max(self.watermark, started)
+
+    def replace(self, order_ids):
+        """
+        The lines of those orders as they are now (none if they're gone).
+        """
+
+        with self._lock:
+            read = [
+                self.read(models.OrderLine.objects.filter(
+                    order_id__in=order_ids[i:i + IDS_PER_QUERY]
+                ))
+                for i in range(0, len(order_ids), IDS_PER_QUERY)
+            ]
+            keep = ~np.isin(self.columns["order"], order_ids)
+
+            self.columns = {
+                name: np.concatenate(
+                    [self.columns[name][keep]]
+                    + [columns[name] for columns in read]
+                )
+                for name, dtype in COLUMNS
+            }
+
+    def forget(self, order_id):
+        with self._lock:
+            keep = self.columns["order"] != order_id
+            self.columns = {
+                name: column[keep] for name, column in self.columns.items()
+            }
+
+    def read(self, lines):
+        """
+        A queryset of lines -> the columns, converted a chunk at a time
+        (one Python tuple per line only while its chunk is converted).
+        """
+
+        rows = lines \
+            .order_by() \
+            .annotate(day=TruncDate("order__date_added")) \
+            .values_list(*FIELDS) \
+            .iterator(chunk_size=CHUNK_SIZE)
+
+        chunks = []
+
+        while True:
+            chunk = list(islice(rows, CHUNK_SIZE))
+
+            if not chunk:
+                break
+
+            chunks.append(self.convert(chunk))
+
+        if not chunks:
+            return empty_columns()
+
+        return {
+            name: np.concatenate([chunk[name] for chunk in chunks])
+            for name, dtype in COLUMNS
+        }
+
+    def convert(self, chunk):
+        (
+            orders, products, days, statuses,
+            order_statuses, countries, quantities, prices,
+        ) = zip(*chunk)
+
+        quantity = np.array(quantities, dtype=np.int64)
+        cents = np.array(
+            [price or 0 for price in prices], dtype=np.float64
+        ) * 100
+
+        return {
+            "order": np.array(orders, dtype=np.int64),
+            "product": np.array(products, dtype=np.int64),
+            "day": np.array(days, dtype="datetime64[D]").astype(np.int32),
+            "status": np.array(statuses, dtype=np.int16),
+            "order_status": np.array(order_statuses, dtype=np.int16),
+            "country": np.array(
+                [self.country_code(country) for country in countries],
+                dtype=np.int16,
+            ),
+            "quantity": quantity,
+            "amount": np.rint(quantity * cents).astype(np.int64),
+        }
+
+    def country_code(self, country):
+        code = self.country_codes.get(country)
+
+        if code is None:
+            code = self.country_codes[country] = len(self.countries)
+            self.countries.append(country)
+
+        return code
+
+    # -------------------- Queries ---------- ----------
+
+    def mask(self, first=None, last=None, **filters):
+        """
+        The lines from `first` to `last` (both included, dates)
+        & matching every filter, a value or a list of values per column.
+        >> facts.mask(first=date(2026, 10, 1), status=[10, 20], country="uk")
+        """
+
+        columns = self.columns
+        selected = np.ones(len(self), dtype=bool)
+
+        if first is not None:
+            selected &= columns["day"] >= to_day(first)
+
+        if last is not None:
+            selected &= columns["day"] <= to_day(last)
+
+        for name, values in filters.items():
+            if name == "country":
+                values = [
+                    self.country_codes.get(country, -1)
+                    for country in np.atleast_1d(values)
+                ]
+
+            selected &= np.isin(columns[name], values)
+
+        return selected
+
+    def group_by(self, key, value="quantity", **filters):
+        """
+        { key: sum of `value` } over the selected lines,
+        `value` "lines" counts them instead.
+        """
+
+        keys, totals = self.grouped(key, value, **filters)
+
+        return dict(zip(
+            self.labels(key, keys), self.values(value, totals)
+        ))
+
+    def top(self, key, value="quantity", limit=10, **filters):
+        """
+        [(key, sum of `value`), ..] the most first (the smallest key first
+        on a tie), only the groups which are above zero.
+        """
+
+        keys, totals = self.grouped(key, value, **filters)
+        order = np.lexsort((keys, -totals))
+        order = order[totals[order] > 0][:limit]
+
+        return list(zip(
+            self.labels(key, keys[order]), self.values(value, totals[order])
+        ))
+
+    def grouped(self, key, value, **filters):
+        """
+        -> (the keys, sorted, the sum of `value` per key) as arrays
+
+        About the `bincount`
+            The keys are small ints (ids, days, codes), `key - lowest`
+            is the slot of the group -> ONE pass, no sorting at all.
+        """
+
+        with self._lock:
+            self.refresh()
+
+            selected = self.mask(**filters)
+            column = self.columns[key][selected]
+
+            if not len(column):
+                return column, np.zeros(0, dtype=np.int64)
+
+            lowest = column.min()
+            slots = column - lowest
+            lines = np.bincount(slots)
+
+            if value == "lines":
+                totals = lines
+            else:
+                totals = np.bincount(
+                    slots, weights=self.columns[value][selected]
+                )
+
+        present = np.flatnonzero(lines)
+
+        return present + lowest, totals[present].astype(np.int64)
+
+    def labels(self, key, keys):
+        if key == "day":
+            return [from_day(day) for day in keys]
+
+        if key == "country":
+            return [self.countries[code] for code in keys]
+
+        return keys.tolist()
+
+    def values(self, value, totals):
+        if value == "amount":
+            return [Decimal(int(cents)).scaleb(-2) for cents in totals]
+
+        return totals.tolist()
+
+
+facts = LineFacts()
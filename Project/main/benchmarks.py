@@ -0,0 +1,1076 @@
+import time
+import asyncio
+import logging
+import resource
+from io import BytesIO
+from decimal import Decimal
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+from channels.http import AsgiHandler
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from django.core.paginator import Paginator
+from django.db.models import (
+    Count, DecimalField, ExpressionWrapper, F, Q, Sum,
+)
+from django.db.models.functions import TruncDay
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from PIL import Image
+
+from . import bitmaps, caching, models, pagination, renditions
+from . import reports, search
+
+logger = logging.getLogger(__name__)
+
+SCENARIOS = {}
+
+
+class Rollback(Exception):
+    """
+    Raised at the end of every scenario,
+    so the fake data never stays in the database.
+    """
+
+
+def scenario(name):
+    """
+    Register a function as a benchmark scenario.
+
+    Usage
+    >> @scenario("checkout")
+    >> def checkout(sizes, repeat):
+    >>     yield "size", "queries", "ms"
+    >>     ...
+
+    The first row yielded is the header, the others are the results.
+    """
+
+    def decorator(func):
+        SCENARIOS[name] = func
+        return func
+
+    return decorator
+
+
+def measure(func, *args, **kwargs):
+    """
+    Returns (queries, milliseconds, result) of a single call.
+    """
+
+    with CaptureQueriesContext(connection) as ctx:
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = (time.perf_counter() - started) * 1000
+
+    return len(ctx.captured_queries), elapsed, result
+
+
+def run(name, sizes, repeat):
+    """
+    Run the scenario inside a transaction which is ALWAYS rolled back.
+    The rows are collected first, since the generator needs the data.
+    """
+
+    rows = []
+
+    try:
+        with transaction.atomic():
+            rows.extend(SCENARIOS[name](sizes, repeat))
+            raise Rollback()
+    except Rollback:
+        pass
+
+    return rows
+
+
+# ********************-----**********************
+# ******************* Helpers *******************
+# ********************-----**********************
+
+
+def make_products(count, prefix="bench"):
+    """
+    Re-read after `bulk_create`, since not every backend returns the ids.
+    """
+
+    models.Product.objects.bulk_create([
+        models.Product(
+            name="%s %d" % (prefix, i),
+            slug="%s-%d" % (prefix, i),
+            price=Decimal("1.00") + i % 100,
+        )
+        for i in range(count)
+    ])
+
+    return list(
+        models.Product.objects
+            .filter(slug__startswith=prefix + "-")
+            .order_by("id")
+    )
+
+
+def make_user(email="bench@booktime.domain"):
+    user, created = models.User.objects.get_or_create(email=email)
+    return user
+
+
+def make_address(user):
+    return models.Address.objects.create(
+        user=user,
+        name="bench",
+        address1="1 bench street",
+        zip_code="B3N CH",
+        city="London",
+        country="uk",
+    )
+
+
+def make_orders(user, count):
+    models.Order.objects.bulk_create([
+        models.Order(user=user) for i in range(count)
+    ])
+
+    return list(models.Order.objects.filter(user=user).order_by("id"))
+
+
+def make_dated_orders(user, start, stop, days=180):
+    """
+    The orders `start` .. `stop` of the user (the first ones exist already),
+    spread over the last `days` days, 3 statuses & 4 countries.
+    -> the new orders
+    """
+
+    countries = ("uk", "fr", "de", "us")
+    statuses = [status for status, name in models.Order.STATUSES]
+    today = timezone.now()
+
+    models.Order.objects.bulk_create(
+        [
+            models.Order(
+                user=user,
+                status=statuses[i % 3],
+                shipping_country=countries[i % 4],
+            )
+            for i in range(start, stop)
+        ],
+        batch_size=5000,
+    )
+
+    # `auto_now_add` can't be set through `bulk_create`
+    orders = list(models.Order.objects.filter(user=user).order_by("id"))
+    ids = [order.id for order in orders]
+
+    for day in range(days):
+        models.Order.objects \
+            .filter(id__in=ids[day::days]) \
+            .update(date_added=today - timedelta(days=day))
+
+    return orders[start:]
+
+
+def make_dated_lines(orders, products, start):
+    """
+    4 lines per order (1 .. 4 units), at the price of their product,
+    `start` is the index of the first order (the products rotate).
+    """
+
+    lines = []
+
+    for i, order in enumerate(orders, start=start):
+        for j in range(4):
+            product = products[(i * 4 + j) % len(products)]
+            lines.append(models.OrderLine(
+                order=order,
+                product=product,
+                quantity=1 + j,
+                unit_price=product.price,
+            ))
+
+    models.OrderLine.objects.bulk_create(lines, batch_size=5000)
+
+
+def make_basket(user, products, quantity=1):
+    basket = models.Basket.objects.create(user=user)
+
+    models.BasketLine.objects.bulk_create([
+        models.BasketLine(basket=basket, product=product, quantity=quantity)
+        for product in products
+    ])
+
+    return basket
+
+
+def make_upload(width):
+    """
+    A 4:3 JPEG `width` pixels wide, noisy enough to compress like a photo.
+    """
+
+    height = width * 3 // 4
+    image = Image.merge("RGB", [
+        Image.effect_noise((width, height), 40),
+        Image.linear_gradient("L").resize((width, height)),
+        Image.effect_noise((width, height), 20),
+    ])
+
+    output = BytesIO()
+    image.save(output, "JPEG", quality=90)
+
+    return output.getvalue()
+
+
+def full_decode_render(data, widths=renditions.WIDTHS):
+    """
+    The straightforward way (the old thumbnail code, once per width),
+    for comparison: the whole image decoded every time.
+    """
+
+    results = []
+
+    for width in renditions.target_widths(Image.open(BytesIO(data)).width):
+        image = Image.open(BytesIO(data)).convert("RGB")
+        image = image.resize(
+            (width, image.height * width // image.width), Image.LANCZOS
+        )
+
+        for kind in (renditions.JPEG, renditions.WEBP):
+            results.append((width, kind, renditions.encode(image, kind)))
+
+    return { "renditions": results }
+
+
+def profile_in_process(func, data):
+    """
+    Runs in a fresh worker process,
+    -> (peak RSS increase in MB, milliseconds, result)
+    `ru_maxrss` is in KB (Linux) & only ever grows, hence the difference.
+    """
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    result = func(data)
+    elapsed = (time.perf_counter() - started) * 1000
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return (after - before) / 1024, elapsed, result
+
+
+async def asgi_get(path, cookie=None):
+    """
+    One GET straight through the ASGI handler (no server, no socket),
+    returns the status code.
+
+    About `AsgiHandler`
+        It's what 'booktime/routing.py' hands the HTTP requests to,
+        the view itself runs in a worker thread (its own DB connection).
+    """
+
+    headers = [(b"host", b"localhost")]
+    if cookie:
+        headers.append((b"cookie", cookie.encode()))
+
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "root_path": "",
+        "query_string": b"",
+        "headers": headers,
+        "server": ("localhost", 80),
+        # Not an INTERNAL_IPS address (no debug toolbar)
+        "client": ("10.0.0.1", 1234),
+    }
+    messages = []
+
+    async def receive():
+        return { "type": "http.request", "body": b"", "more_body": False }
+
+    async def send(message):
+        messages.append(message)
+
+    await AsgiHandler(scope)(receive, send)
+
+    return messages[0]["status"]
+
+
+# ********************-----**********************
+# ****************** Scenarios ******************
+# ********************-----**********************
+
+
+@scenario("checkout")
+def checkout(sizes, repeat):
+    """
+    `Basket.create_order` against the number of units in the basket.
+    """
+
+    yield "units", "queries", "ms"
+
+    user = make_user()
+    address = make_address(user)
+    products = make_products(max(sizes))
+
+    for size in sizes:
+        timings = []
+
+        for i in range(repeat):
+            basket = make_basket(user, products[:size])
+            queries, elapsed, order = measure(
+                basket.create_order, address, address
+            )
+            timings.append(elapsed)
+
+        yield size, queries, min(timings)
+
+
+@scenario("orderline_storage")
+def orderline_storage(sizes, repeat):
+    """
+    Row count & `most_bought_products` latency against the number of orders,
+    one row per unit (the old layout) vs. one row per product (`quantity`).
+
+    Every order holds 5 products * 4 units.
+    """
+
+    yield "orders", "layout", "rows", "report_ms"
+
+    user = make_user()
+    products = make_products(5)
+
+    def report():
+        return list(
+            models.OrderLine.objects
+                .values("product__name")
+                .annotate(c=Sum("quantity"))
+        )
+
+    for size in sizes:
+        for layout in ("per-unit", "compact"):
+            models.Order.objects.filter(user=user).delete()
+            orders = make_orders(user, size)
+
+            if layout == "per-unit":
+                lines = [
+                    models.OrderLine(order=order, product=product)
+                    for order in orders
+                    for product in products
+                    for unit in range(4)
+                ]
+            else:
+                lines = [
+                    models.OrderLine(order=order, product=product, quantity=4)
+                    for order in orders
+                    for product in products
+                ]
+
+            models.OrderLine.objects.bulk_create(lines, batch_size=1000)
+
+            timings = [measure(report)[1] for i in range(repeat)]
+
+            yield size, layout, len(lines), min(timings)
+
+
+@scenario("basket_middleware")
+def basket_middleware(sizes, repeat):
+    """
+    Queries per request across the main URLs, for a session holding a basket.
+    The `basket` column counts the queries on the 'main_basket' table
+    (only the pages which actually show the basket should pay for it).
+
+    The `sizes` are the number of lines in the basket.
+    """
+
+    yield "lines", "url", "status", "queries", "basket"
+
+    products = make_products(max(sizes))
+    urls = [
+        reverse("main:home"),
+        reverse("main:about_us"),
+        reverse("main:products", args=("all",)),
+        reverse("main:product", args=(products[0].slug,)),
+        reverse("main:basket"),
+        reverse("main:basket_summary"),
+        "/api/orders/",
+        "/media/product-images/missing.jpg",
+        "/admin/login/",
+    ]
+
+    # Not an INTERNAL_IPS address (no debug toolbar)
+    client = Client(SERVER_NAME="localhost", REMOTE_ADDR="10.0.0.1")
+
+    for size in sizes:
+        basket = make_basket(None, products[:size])
+        basket.recount()
+
+        session = client.session
+        session["basket_id"] = basket.id
+        session.save()
+
+        for url in urls:
+            with override_settings(ALLOWED_HOSTS=["localhost"]), \
+                    CaptureQueriesContext(connection) as ctx:
+                response = client.get(url)
+
+            yield (
+                size,
+                url,
+                response.status_code,
+                len(ctx.captured_queries),
+                sum(
+                    'FROM "main_basket"' in query["sql"]
+                    for query in ctx.captured_queries
+                ),
+            )
+
+
+@scenario("basket_merge")
+def basket_merge(sizes, repeat):
+    """
+    `Basket.merge` (the login merge) against the size of the anonymous basket,
+    half of its products being in the logged-in basket already.
+    """
+
+    yield "lines", "queries", "ms"
+
+    products = make_products(max(sizes))
+
+    for size in sizes:
+        timings = []
+
+        for i in range(repeat):
+            loggedin = make_basket(None, products[:size // 2])
+            anonymous = make_basket(None, products[:size])
+            loggedin.recount()
+            anonymous.recount()
+
+            queries, elapsed, result = measure(loggedin.merge, anonymous)
+            timings.append(elapsed)
+
+        yield size, queries, min(timings)
+
+
+@scenario("product_listing")
+def product_listing(sizes, repeat):
+    """
+    One listing page (4 products) against its page number,
+    OFFSET pagination (+ the COUNT) vs. keyset pagination (a cursor).
+    >> ./manage.py benchmark product_listing --sizes 1 100 10000
+
+    There are (at least) `max(sizes)` pages of products.
+    """
+
+    yield "page", "mode", "queries", "ms"
+
+    per_page = 4
+    ordering = ("name", "id")
+    queryset = models.Product.objects.active().order_by(*ordering)
+
+    make_products(max(sizes) * per_page)
+    products = list(queryset.all())
+
+    def offset_page(number):
+        page = Paginator(queryset, per_page).page(number)
+        return list(page.object_list)
+
+    def keyset_page(cursor):
+        return pagination.paginate_keyset(
+            queryset, cursor, per_page, ordering
+        ).object_list
+
+    for size in sizes:
+        # The cursor the "Next" link of the previous page would carry
+        cursor = None
+        if size > 1:
+            cursor = pagination.encode_cursor(
+                "next", products[(size - 1) * per_page - 1], ordering
+            )
+
+        for mode, func, arg in (
+            ("offset", offset_page, size),
+            ("keyset", keyset_page, cursor),
+        ):
+            timings = []
+
+            for i in range(repeat):
+                queries, elapsed, rows = measure(func, arg)
+                timings.append(elapsed)
+
+            yield size, mode, queries, min(timings)
+
+
+@scenario("product_search")
+def product_search(sizes, repeat):
+    """
+    Searching one product by its name against the size of the catalog,
+    a plain `icontains` scan vs. the search index ('main/search.py').
+    >> ./manage.py benchmark product_search --sizes 1000 10000 100000
+
+    The catalog grows from one size to the next (sorted).
+    """
+
+    yield "products", "mode", "found", "ms"
+
+    queryset = models.Product.objects.active()
+    created = 0
+
+    def scan(terms):
+        condition = Q()
+        for word in terms.split():
+            condition &= Q(name__icontains=word)
+
+        return list(queryset.filter(condition).order_by("name", "id")[:10])
+
+    def indexed(terms):
+        return list(search.search_products(queryset, terms)[:10])
+
+    for size in sorted(sizes):
+        # `bulk_create` skips the signals, hence the explicit indexing
+        products = make_products(size - created, prefix="bench%d" % size)
+        search.index_products(product.id for product in products)
+        created = size
+
+        terms = products[-1].name
+
+        for mode, func in (("icontains", scan), ("index", indexed)):
+            timings = []
+
+            for i in range(repeat):
+                queries, elapsed, rows = measure(func, terms)
+                timings.append(elapsed)
+
+            yield size, mode, len(rows), min(timings)
+
+
+@scenario("tag_filter")
+def tag_filter(sizes, repeat):
+    """
+    "Products tagged A AND B" + the facet counts of every tag within them,
+    the ORM (JOINs on 'main_product_tags') vs. the tag bitmap index.
+    >> ./manage.py benchmark tag_filter --sizes 1000 10000 100000
+
+    10 tags, every product has 1 or 2 of them.
+    The catalog grows from one size to the next (sorted).
+    || orm-page       the first listing page (20), JOINs on the tags
+    || bitmap-page    same page, `narrow` (the ids of the bitmap, no JOIN)
+    """
+
+    yield "products", "mode", "found", "ms"
+
+    tags = [
+        models.ProductTag.objects.create(
+            name="bench %d" % i, slug="bench-tag-%d" % i
+        )
+        for i in range(10)
+    ]
+    Through = models.Product.tags.through
+    created = 0
+
+    def orm():
+        selection = models.Product.objects \
+            .active() \
+            .filter(tags=tags[1]) \
+            .filter(tags=tags[2])
+
+        ids = list(selection.values_list("id", flat=True))
+        facets = list(
+            models.ProductTag.objects
+                .filter(product__in=selection)
+                .annotate(c=Count("product"))
+                .values_list("slug", "c")
+        )
+
+        return ids, facets
+
+    def bitmap(index):
+        selection = index.select([tags[1].id, tags[2].id])
+        return index.ids(selection), index.facets(selection)
+
+    def orm_page():
+        products = models.Product.objects \
+            .active() \
+            .filter(tags=tags[1]) \
+            .filter(tags=tags[2])
+
+        return pagination.paginate_keyset(products, None, 20).object_list
+
+    def bitmap_page(index):
+        tag_ids = [tags[1].id, tags[2].id]
+        products = index.narrow(
+            models.Product.objects.active(), index.select(tag_ids)
+        )
+
+        return pagination.paginate_keyset(products, None, 20).object_list
+
+    for size in sorted(sizes):
+        products = make_products(size - created, prefix="bench%d" % size)
+        Through.objects.bulk_create(
+            [
+                Through(product_id=product.id, producttag_id=tags[tag].id)
+                for i, product in enumerate(products, start=created)
+                for tag in { i % 10, (i // 10) % 10 }
+            ],
+            # The backend's own (SQLite: 500 rows, a compound SELECT)
+            batch_size=None if connection.vendor == "sqlite" else 5000,
+        )
+        created = size
+
+        index = bitmaps.TagBitmapIndex()
+        queries, elapsed, result = measure(index.build)
+        yield size, "bitmap-build", len(index.ids(index.active)), elapsed
+
+        for mode, func, args in (("orm", orm, ()), ("bitmap", bitmap, (index,))):
+            timings = []
+
+            for i in range(repeat):
+                queries, elapsed, (ids, facets) = measure(func, *args)
+                timings.append(elapsed)
+
+            yield size, mode, len(ids), min(timings)
+
+        for mode, func, args in (
+            ("orm-page", orm_page, ()),
+            ("bitmap-page", bitmap_page, (index,)),
+        ):
+            timings = []
+
+            for i in range(repeat):
+                queries, elapsed, rows = measure(func, *args)
+                timings.append(elapsed)
+
+            yield size, mode, len(rows), min(timings)
+
+
+@scenario("page_cache")
+def page_cache(sizes, repeat):
+    """
+    Requests/sec of the storefront pages through the ASGI handler,
+    an anonymous visitor (full-page cache) vs. a visitor with a session
+    (the whole middleware & view stack, as before).
+    >> ./manage.py benchmark page_cache --sizes 200 1000
+
+    The `sizes` are the number of requests in a row.
+    Only pages which don't need the (rolled back) scenario data,
+    the requests being served by another DB connection.
+    """
+
+    yield "requests", "url", "visitor", "status", "req_per_s"
+
+    urls = [
+        reverse("main:home"),
+        reverse("main:about_us"),
+        reverse("main:products", args=("all",)),
+    ]
+    visitors = (
+        ("anonymous", None),
+        ("session", "%s=bench" % settings.SESSION_COOKIE_NAME),
+    )
+
+    async def burst(url, cookie, count):
+        for i in range(count):
+            status = await asgi_get(url, cookie)
+
+        return status
+
+    # Its own loop, `asyncio.run` would leave the thread without one
+    loop = asyncio.new_event_loop()
+
+    with override_settings(ALLOWED_HOSTS=["localhost"]):
+        for size in sizes:
+            for url in urls:
+                for visitor, cookie in visitors:
+                    # The first request fills the cache
+                    status = loop.run_until_complete(burst(url, cookie, 1))
+                    timings = []
+
+                    for i in range(repeat):
+                        started = time.perf_counter()
+                        loop.run_until_complete(burst(url, cookie, size))
+                        timings.append(time.perf_counter() - started)
+
+                    yield size, url, visitor, status, size / min(timings)
+
+    loop.close()
+
+
+@scenario("renditions")
+def rendition_pipeline(sizes, repeat):
+    """
+    One upload against its width (pixels), the full decode (per width)
+    vs. the rendition pipeline ('main/renditions.py', draft decoding).
+    >> ./manage.py benchmark renditions --sizes 1000 3000 6000
+
+    || peak_rss_mb     memory the rendering needed (a fresh process each time)
+    || *_640_kb        what a 640px wide (mobile) screen downloads,
+    ||                 the whole upload (`upload_kb`) before
+    """
+
+    yield (
+        "upload_px", "upload_kb", "mode",
+        "jpeg_640_kb", "webp_640_kb", "peak_rss_mb", "ms",
+    )
+
+    for size in sizes:
+        data = make_upload(size)
+
+        for mode, func in (
+            ("full-decode", full_decode_render),
+            ("draft", renditions.render),
+        ):
+            peaks, timings = [], []
+
+            for i in range(repeat):
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    peak, elapsed, result = pool.submit(
+                        profile_in_process, func, data
+                    ).result()
+
+                peaks.append(peak)
+                timings.append(elapsed)
+
+            served = {
+                kind: len(content) / 1024
+                for width, kind, content in result["renditions"]
+                if width == min(640, size)
+            }
+
+            yield (
+                size, len(data) / 1024, mode,
+                served[renditions.JPEG], served[renditions.WEBP],
+                max(peaks), min(timings),
+            )
+
+
+@scenario("orders_per_day")
+def orders_per_day(sizes, repeat):
+    """
+    The "Orders per day" report (180 days) against the number of orders,
+    the old `GROUP BY` over 'Order' vs. the daily rollup ('DailyOrderStat').
+    >> ./manage.py benchmark orders_per_day --sizes 1000 10000 100000
+
+    The orders are spread over 180 days, 3 statuses & 4 countries,
+    they grow from one size to the next (sorted, see `make_dated_orders`).
+    || rows        rows the report reads (orders vs. rollup rows)
+    || backfill    `./manage.py rollup_orders` (a one-off)
+    """
+
+    yield "orders", "mode", "rows", "ms"
+
+    user = make_user()
+    today = timezone.now()
+    created = 0
+
+    def group_by():
+        return list(
+            models.Order.objects
+                .filter(date_added__gt=today - timedelta(days=180))
+                .annotate(day=TruncDay("date_added"))
+                .values("day")
+                .annotate(c=Count("id"))
+        )
+
+    for size in sorted(sizes):
+        make_dated_orders(user, created, size)
+        created = max(created, size)
+
+        queries, elapsed, rows = measure(models.DailyOrderStat.objects.rebuild)
+        yield size, "backfill", rows, elapsed
+
+        for mode, func, count in (
+            ("group-by", group_by, models.Order.objects.count()),
+            ("rollup", reports.orders_per_day, rows),
+        ):
+            timings = [measure(func)[1] for i in range(repeat)]
+
+            yield size, mode, count, min(timings)
+
+
+@scenario("most_bought_products")
+def most_bought_products(sizes, repeat):
+    """
+    The top 20 products of the last 30 days against the number of orders,
+    the old `GROUP BY` over 'OrderLine' (+ sorting it) vs.
+    the sales rollup ('DailyProductSales').
+    >> ./manage.py benchmark most_bought_products --sizes 1000 10000 50000
+
+    Every order holds 4 of 200 products, over 180 days,
+    they grow from one size to the next (sorted).
+    """
+
+    yield "orders", "mode", "rows", "ms"
+
+    user = make_user()
+    products = make_products(200)
+    created = 0
+
+    def group_by(first):
+        return sorted(
+            models.OrderLine.objects
+                .filter(order__date_added__gte=first)
+                .values("product__name")
+                .annotate(c=Sum("quantity")),
+            key=lambda row: -row["c"],
+        )[:20]
+
+    for size in sorted(sizes):
+        orders = make_dated_orders(user, created, size)
+        make_dated_lines(orders, products, created)
+        created = max(created, size)
+
+        queries, elapsed, rows = measure(
+            models.DailyProductSales.objects.rebuild
+        )
+        yield size, "backfill", rows, elapsed
+
+        today = timezone.localdate()
+        first = today - timedelta(days=29)
+        since = timezone.now() - timedelta(days=30)
+
+        for mode, func, args, count in (
+            ("group-by", group_by, (since,), models.OrderLine.objects.count()),
+            ("rollup", reports.most_bought_products, (first, today, 20), rows),
+        ):
+            timings = [measure(func, *args)[1] for i in range(repeat)]
+
+            yield size, mode, count, min(timings)
+
+
+@scenario("revenue")
+def revenue(sizes, repeat):
+    """
+    Revenue (30 days) & the totals of ONE order against the number of orders,
+    joining the lines to today's product prices vs. the prices & totals
+    captured at the checkout ('DailyProductSales', `Order.total`).
+    >> ./manage.py benchmark revenue --sizes 1000 10000 50000
+
+    Every order holds 4 of 200 products, over 180 days (as above).
+    || report-*    the "Revenue per day" page
+    || invoice-*   the totals of the invoice
+    """
+
+    yield "orders", "mode", "rows", "ms"
+
+    user = make_user()
+    products = make_products(200)
+    created = 0
+
+    def join(since):
+        return list(
+            models.OrderLine.objects
+                .filter(order__date_added__gte=since)
+                .exclude(status=models.OrderLine.CANCELLED)
+                .annotate(day=TruncDay("order__date_added"))
+                .values("day")
+                .annotate(revenue=Sum(
+                    F("quantity") * F("product__price"),
+                    output_field=DecimalField(),
+                ))
+                .order_by("day")
+        )
+
+    def invoice_lines(order_id):
+        return models.OrderLine.objects \
+            .filter(order_id=order_id) \
+            .exclude(status=models.OrderLine.CANCELLED) \
+            .aggregate(total=Sum(
+                F("quantity") * F("product__price"),
+                output_field=DecimalField(),
+            ))["total"]
+
+    def invoice_row(order_id):
+        return models.Order.objects \
+            .filter(pk=order_id) \
+            .values_list("subtotal", "total") \
+            .get()
+
+    for size in sorted(sizes):
+        orders = make_dated_orders(user, created, size)
+        make_dated_lines(orders, products, created)
+        created = max(created, size)
+
+        models.Order.objects.filter(user=user).recount()
+        queries, elapsed, rows = measure(
+            models.DailyProductSales.objects.rebuild
+        )
+        yield size, "backfill", rows, elapsed
+
+        today = timezone.localdate()
+        first = today - timedelta(days=29)
+        since = timezone.now() - timedelta(days=30)
+        lines = models.OrderLine.objects.count()
+        order_id = orders[-1].id
+
+        for mode, func, args, count in (
+            ("report-join", join, (since,), lines),
+            ("report-rollup", reports.revenue_per_day, (first, today), rows),
+            ("invoice-lines", invoice_lines, (order_id,), 4),
+            ("invoice-row", invoice_row, (order_id,), 1),
+        ):
+            timings = [measure(func, *args)[1] for i in range(repeat)]
+
+            yield size, mode, count, min(timings)
+
+
+@scenario("analytics")
+def line_analytics(sizes, repeat):
+    """
+    Ad-hoc slices of the order lines, the ORM (`GROUP BY` on the db)
+    vs. the NumPy columns ('main/analytics.py'), against the number of lines.
+    >> ./manage.py benchmark analytics --sizes 100000 500000 1000000
+
+    `sizes` are orders (4 lines each, over 180 days, see `make_dated_lines`).
+    || build           the first (full) load of the columns
+    || refresh-idle    nothing changed since the watermark
+    || refresh-100     100 orders changed since the watermark
+    """
+
+    # NumPy is only needed by this scenario
+    from . import analytics
+
+    yield "lines", "mode", "query", "ms"
+
+    user = make_user()
+    products = make_products(200)
+    created = 0
+
+    today = timezone.localdate()
+    since = timezone.now() - timedelta(days=30)
+    open_lines = [models.OrderLine.NEW, models.OrderLine.PROCESSING]
+    amount = ExpressionWrapper(
+        F("quantity") * F("unit_price"), output_field=DecimalField()
+    )
+
+    orm = {
+        "top_products": lambda: list(
+            models.OrderLine.objects
+                .filter(order__date_added__gte=since)
+                .values("product")
+                .annotate(units=Sum("quantity"))
+                .order_by("-units", "product")[:20]
+        ),
+        "open_revenue_by_country": lambda: list(
+            models.OrderLine.objects
+                .filter(status__in=open_lines)
+                .values("order__shipping_country")
+                .annotate(revenue=Sum(amount))
+        ),
+        "uk_lines_per_day": lambda: list(
+            models.OrderLine.objects
+                .filter(order__shipping_country="uk")
+                .annotate(day=TruncDay("order__date_added"))
+                .values("day")
+                .annotate(c=Count("id"))
+        ),
+    }
+
+    for size in sorted(sizes):
+        orders = make_dated_orders(user, created, size)
+        make_dated_lines(orders, products, created)
+        created = max(created, size)
+        lines = models.OrderLine.objects.count()
+
+        # Fresh rows have no statistics, the watermark queries would
+        # scan the tables instead of using their `date_updated` index
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE main_order, main_orderline")
+
+        facts = analytics.LineFacts()
+        queries, elapsed, result = measure(facts.build)
+        yield lines, "build", "-", elapsed
+
+        # As if the rows had been written long ago
+        facts.watermark = timezone.now() + facts.OVERLAP
+        timings = [measure(facts.refresh)[1] for i in range(repeat)]
+        yield lines, "refresh-idle", "-", min(timings)
+
+        facts.watermark = timezone.now() + facts.OVERLAP
+        models.Order.objects \
+            .filter(id__in=[order.id for order in orders[:100]]) \
+            .update(date_updated=facts.watermark)
+        yield lines, "refresh-100", "-", measure(facts.refresh)[1]
+
+        # Each query refreshes first (nothing changed -> two tiny queries)
+        facts.watermark = timezone.now() + facts.OVERLAP
+
+        numpy = {
+            "top_products": lambda: facts.top(
+                "product", first=today - timedelta(days=29), limit=20
+            ),
+            "open_revenue_by_country": lambda: facts.group_by(
+                "country", "amount", status=open_lines
+            ),
+            "uk_lines_per_day": lambda: facts.group_by(
+                "day", "lines", country="uk"
+            ),
+        }
+
+        for name in orm:
+            for mode, func in (("orm", orm[name]), ("numpy", numpy[name])):
+                timings = [measure(func)[1] for i in range(repeat)]
+
+                yield lines, mode, name, min(timings)
+
+
+@scenario("report_cache")
+def report_cache(sizes, repeat):
+    """
+    The "Most bought products" page opened by N staff members right
+    after a write, against N, computed by every request vs. the cached,
+    versioned report (`cached_report`, one request computes it).
+    >> ./manage.py benchmark report_cache --sizes 1 10 50
+
+    || uncached       every request runs the report
+    || cached         the first request runs it, the others read the cache
+    || stale-served   a request while another worker holds the lock
+    """
+
+    yield "requests", "mode", "queries", "ms"
+
+    user = make_user()
+    products = make_products(200)
+    # Small on purpose, SQLite can't take bigger batches (the tests)
+    orders = make_dated_orders(user, 0, 100)
+    make_dated_lines(orders, products, 0)
+    models.DailyProductSales.objects.rebuild()
+
+    today = timezone.localdate()
+    params = { "first": today - timedelta(days=29), "last": today, "limit": 20 }
+    key = caching.report_key("bench_most_bought_products", params)
+
+    def uncached(count):
+        for i in range(count):
+            reports.most_bought_products(**params)
+
+    def cached(count):
+        for i in range(count):
+            caching.cached_report(
+                "bench_most_bought_products",
+                reports.most_bought_products,
+                **params
+            )
+
+    for size in sorted(sizes):
+        for mode, func in (("uncached", uncached), ("cached", cached)):
+            results = []
+
+            for i in range(repeat):
+                caching.bump_reports_version()
+                results.append(measure(func, size))
+
+            queries, elapsed, result = min(results, key=lambda row: row[1])
+            yield size, mode, queries, elapsed
+
+        caching.bump_reports_version()
+        cache.add(caching.REPORT_LOCK_KEY % key, "another-worker")
+        queries, elapsed, result = measure(cached, size)
+        cache.delete(caching.REPORT_LOCK_KEY % key)
+        yield size, "stale-served", queries, elapsed
+
+    cache.delete(key)
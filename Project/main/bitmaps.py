@@ -0,0 +1,289 @@
+import re
+import uuid
+import threading
+
+from django.db import connection
+from django.db.models import Q
+
+from . import models
+
+# ********************-----**********************
+# *************** Tag bitmap index **************
+# ********************-----**********************
+
+# || one bitmap (a plain Python `int`) per tag, bit N = product id N
+# || AND / OR of tags       ->  `&` / `|` of the bitmaps
+# || facet count of a tag   ->  popcount(selection & tag)
+# No JOIN through 'main_product_tags' at all once it's built.
+
+# A larger selection isn't sent as `id IN (..)` (see `narrow`),
+# SQLite allows 999 parameters & a huge list is slow to parse anyway
+MAX_IDS_IN_QUERY = 500
+
+# Above that, the ids go as ONE parameter (a string), unpacked by the db
+# || PostgreSQL   '{1,2,4}'   an `integer[]` (the type of the `id` column,
+# ||                          with a `bigint[]` every row scans the array)
+# || SQLite       '[1,2,4]'   a JSON array, `json_each` (JSON1, built-in)
+ID_LIST_SQL = {
+    "postgresql": ("main_product.id = ANY(%s::integer[])", "{%s}"),
+    "sqlite": ("main_product.id IN (SELECT value FROM json_each(%s))", "[%s]"),
+}
+
+
+def from_ids(ids):
+    """
+    Setting the bits in a `bytearray` first,
+    `bitmap |= 1 << id` copies the whole (huge) int every single time.
+    >> bin(from_ids([1, 2, 4]))
+    '0b10110'
+    """
+
+    ids = list(ids)
+
+    if not ids:
+        return 0
+
+    buffer = bytearray(max(ids) // 8 + 1)
+
+    for i in ids:
+        buffer[i >> 3] |= 1 << (i & 7)
+
+    return int.from_bytes(buffer, "little")
+
+
+# The set bits of every byte value, e.g. BYTE_BITS[0b101] == (0, 2)
+BYTE_BITS = [
+    tuple(bit for bit in range(8) if value >> bit & 1)
+    for value in range(256)
+]
+
+NON_ZERO_BYTE = re.compile(rb"[^\x00]")
+
+
+def popcount(bitmap):
+    return bin(bitmap).count("1")
+
+
+def iter_ids(bitmap):
+    """
+    The zero bytes are skipped by the regex (in C),
+    the ids are sparse over the whole id range.
+    >> list(iter_ids(0b10110))
+    [1, 2, 4]
+    """
+
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+
+    for match in NON_ZERO_BYTE.finditer(data):
+        offset = match.start() * 8
+
+        for bit in BYTE_BITS[data[match.start()]]:
+            yield offset + bit
+
+
+class TagBitmapIndex:
+    """
+    In-process (every worker has its own), built from the database
+    on first use, then kept up to date by the signals ('main/signals.py').
+
+    About the `token` (see 'CatalogRevision')
+        || a change through the signals moves the token in the database
+        || & applies itself here, IF this index was at the previous token
+        || otherwise (another process, a rollback ..) the tokens differ
+        ||  -> the index is rebuilt on its next use
+        It costs one tiny query per use (`ensure_fresh`).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.token = None
+        self.active = 0
+        self.tags = { }
+        self.slugs = { }
+        self.tag_info = { }
+
+    def build(self):
+        """
+        Three queries (the token, the tags, the products & their tags).
+        """
+
+        with self._lock:
+            self.token = models.CatalogRevision.current()
+            self.tags = { }
+            self.slugs = { }
+            self.tag_info = { }
+
+            for tag in models.ProductTag.objects.all():
+                self.set_tag(tag)
+
+            # The inactive products keep their tags (they may come back)
+            active = set()
+            tagged = { tag_id: [] for tag_id in self.tags }
+            rows = models.Product.objects \
+                .values_list("id", "active", "tags") \
+                .order_by()
+
+            for product_id, is_active, tag_id in rows.iterator():
+                if is_active:
+                    active.add(product_id)
+
+                if tag_id is not None:
+                    tagged[tag_id].append(product_id)
+
+            self.active = from_ids(active)
+            self.tags = {
+                tag_id: from_ids(ids) for tag_id, ids in tagged.items()
+            }
+
+    def ensure_fresh(self):
+        with self._lock:
+            if self.token is None \
+                    or self.token != models.CatalogRevision.current():
+                self.build()
+
+    def change(self, apply):
+        """
+        Called by the signals, `apply(self)` updates the bitmaps in place.
+        """
+
+        new = uuid.uuid4()
+
+        with self._lock:
+            moved = self.token is not None and models.CatalogRevision.objects \
+                .filter(pk=1, token=self.token) \
+                .update(token=new)
+
+            if moved:
+                apply(self)
+                self.token = new
+            else:
+                models.CatalogRevision.objects.update_or_create(
+                    pk=1, defaults={ "token": new }
+                )
+                self.token = None
+
+    def invalidate(self):
+        """
+        After a bulk change (no signals, e.g. 'import_data'),
+        every index (every process) is rebuilt on its next use.
+        """
+
+        with self._lock:
+            models.CatalogRevision.objects.update_or_create(
+                pk=1, defaults={ "token": uuid.uuid4() }
+            )
+            self.token = None
+
+    # -------------------- Queries ---------- ----------
+
+    def resolve(self, slugs):
+        """
+        Slugs -> tag ids, `KeyError` for an unknown slug.
+        """
+
+        return [self.slugs[slug] for slug in slugs]
+
+    def select(self, tag_ids, match="all"):
+        """
+        The active products having ALL (or ANY) of the tags.
+        """
+
+        if not tag_ids:
+            return self.active
+
+        bitmaps = [self.tags[tag_id] for tag_id in tag_ids]
+        selected = bitmaps[0]
+
+        for bitmap in bitmaps[1:]:
+            if match == "any":
+                selected |= bitmap
+            else:
+                selected &= bitmap
+
+        return selected & self.active
+
+    def ids(self, bitmap):
+        return list(iter_ids(bitmap))
+
+    def narrow(self, products, selection):
+        """
+        The `products` (a queryset) within the selection, for a listing page,
+        from the ids of the bitmap (no JOIN on 'main_product_tags' at all).
+        || up to `MAX_IDS_IN_QUERY`  ->  `id IN (%s, %s, ..)`
+        || more                      ->  ONE parameter (see `ID_LIST_SQL`)
+        || more, another backend     ->  `id IN (..) OR id IN (..)` chunks
+        Either way the page itself is sought by (name, id) & `LIMIT`ed,
+        the ids are sorted by id, not by name (no window to cut out of them).
+        """
+
+        ids = self.ids(selection)
+
+        if len(ids) <= MAX_IDS_IN_QUERY:
+            return products.filter(pk__in=ids)
+
+        if connection.vendor in ID_LIST_SQL:
+            sql, value = ID_LIST_SQL[connection.vendor]
+
+            return products.extra(
+                where=[sql], params=[value % ",".join(map(str, ids))]
+            )
+
+        condition = Q()
+        for start in range(0, len(ids), MAX_IDS_IN_QUERY):
+            condition |= Q(pk__in=ids[start:start + MAX_IDS_IN_QUERY])
+
+        return products.filter(condition)
+
+    def facets(self, bitmap):
+        """
+        [(slug, name, count), ..] of the active tags within the selection,
+        the empty ones are left out.
+        """
+
+        facets = []
+
+        for tag_id, (slug, name, active) in self.tag_info.items():
+            count = popcount(bitmap & self.tags[tag_id]) if active else 0
+
+            if count:
+                facets.append((slug, name, count))
+
+        return sorted(facets, key=lambda facet: facet[1])
+
+    # -------------------- Changes ---------- ----------
+    # (only through `change`, the token must move along)
+
+    def set_tag(self, tag):
+        for slug, tag_id in list(self.slugs.items()):
+            if tag_id == tag.id:
+                del self.slugs[slug]
+
+        self.slugs[tag.slug] = tag.id
+        self.tag_info[tag.id] = (tag.slug, tag.name, tag.active)
+        self.tags.setdefault(tag.id, 0)
+
+    def drop_tag(self, tag_id):
+        slug, name, active = self.tag_info.pop(tag_id, (None, None, None))
+        self.slugs.pop(slug, None)
+        self.tags.pop(tag_id, None)
+
+    def set_active(self, product_id, active):
+        if active:
+            self.active |= 1 << product_id
+        else:
+            self.active &= ~(1 << product_id)
+
+    def tag_products(self, tag_id, product_ids, add):
+        bits = from_ids(product_ids)
+        bitmap = self.tags.get(tag_id, 0)
+        self.tags[tag_id] = (bitmap | bits) if add else (bitmap & ~bits)
+
+    def clear_tag(self, tag_id):
+        self.tags[tag_id] = 0
+
+    def untag_product(self, product_id, tag_ids=None):
+        for tag_id in list(self.tags if tag_ids is None else tag_ids):
+            self.tag_products(tag_id, [product_id], add=False)
+
+
+tag_index = TagBitmapIndex()
@@ -0,0 +1,344 @@
+import time
+import uuid
+import hashlib
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+# ********************-----**********************
+# ************** Product listings ***************
+# ********************-----**********************
+
+CATALOG_VERSION_KEY = "catalog:version"
+LISTING_HITS_KEY = "catalog:listing:hits"
+LISTING_MISSES_KEY = "catalog:listing:misses"
+
+# The version does the invalidation, this is only a safety net
+LISTING_TIMEOUT = 60 * 60
+
+
+def catalog_version():
+    """
+    About the "version"
+        Every key of a listing page embeds the current catalog version.
+        || a product/tag changes -> the version is bumped
+        ||                       -> every old key is simply never read again
+        (no need to know WHICH pages contained the product)
+    """
+
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def _incr_catalog_version():
+    return _incr_version(CATALOG_VERSION_KEY)
+
+
+def get_version(key):
+    version = cache.get(key)
+
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+
+    return version
+
+
+def _incr_version(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Not in the cache (yet, or evicted), any fresh value will do
+        cache.add(key, 1, timeout=None)
+        return cache.incr(key)
+
+
+def bump_catalog_version():
+    """
+    Bumped right away AND once the transaction commits,
+    a page rendered in between (still seeing the old rows)
+    would be cached under the new version otherwise.
+    """
+
+    transaction.on_commit(_incr_catalog_version)
+
+    return _incr_catalog_version()
+
+
+def content_etag(*parts):
+    """
+    The validator of a cached fragment is simply a hash of what it shows,
+    computed once, when it's rendered.
+    """
+
+    content = "\x00".join(repr(part) for part in parts)
+
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def listing_key(tag, page):
+    """
+    >> listing_key("all", 2)
+    'catalog:listing:v7:all:2'
+    """
+
+    return "catalog:listing:v%d:%s:%s" % (catalog_version(), tag, page)
+
+
+def tags_token(tag, extra_tags, match):
+    """
+    >> tags_token("all", [], "all")
+    'all'
+    >> tags_token("all", ["web", "python"], "any")
+    'all-any-5f1e..'      (the same for ["python", "web"])
+    """
+
+    if not extra_tags:
+        return tag
+
+    tags = ",".join(sorted(extra_tags))
+
+    return "%s-%s-%s" % (tag, match, hashlib.sha1(tags.encode()).hexdigest())
+
+
+def cursor_token(cursor):
+    """
+    The cursor comes from the query string, so it's hashed
+    (a fixed length & no odd characters in the cache key).
+    """
+
+    if not cursor:
+        return "first"
+
+    return "cursor-" + hashlib.sha1(cursor.encode()).hexdigest()
+
+
+def count_listing(hit):
+    key = LISTING_HITS_KEY if hit else LISTING_MISSES_KEY
+
+    # `add` first, since `incr` fails on a missing key
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def listing_stats():
+    """
+    For monitoring, e.g.
+    >> {'hits': 120, 'misses': 8, 'version': 3}
+    """
+
+    values = cache.get_many([LISTING_HITS_KEY, LISTING_MISSES_KEY])
+
+    return {
+        "hits": values.get(LISTING_HITS_KEY, 0),
+        "misses": values.get(LISTING_MISSES_KEY, 0),
+        "version": catalog_version(),
+    }
+
+
+# ********************-----**********************
+# *************** Product details ***************
+# ********************-----**********************
+
+PRODUCT_KEY = "catalog:product:%d"
+PRODUCT_SLUG_KEY = "catalog:product-slug:%s"
+
+PRODUCT_TIMEOUT = 60 * 60
+
+
+def get_product_fragment(slug):
+    """
+    slug -> product id -> the rendered fragment (two cache reads).
+
+    The fragment keeps its slug, so a product which changed its slug
+    (the old slug still pointing to it) simply isn't a hit.
+    """
+
+    product_id = cache.get(PRODUCT_SLUG_KEY % slug)
+
+    if product_id is None:
+        return None
+
+    fragment = cache.get(PRODUCT_KEY % product_id)
+
+    if fragment is None or fragment["slug"] != slug:
+        return None
+
+    return fragment
+
+
+def set_product_fragment(fragment):
+    cache.set_many(
+        {
+            PRODUCT_SLUG_KEY % fragment["slug"]: fragment["id"],
+            PRODUCT_KEY % fragment["id"]: fragment,
+        },
+        PRODUCT_TIMEOUT,
+    )
+
+
+def _delete_products(keys):
+    cache.delete_many(keys)
+
+
+def forget_products(product_ids):
+    """
+    Deleted right away AND once the transaction commits
+    (same reason as `bump_catalog_version`).
+    """
+
+    keys = [PRODUCT_KEY % product_id for product_id in product_ids]
+
+    if keys:
+        transaction.on_commit(lambda: _delete_products(keys))
+        _delete_products(keys)
+
+
+# ********************-----**********************
+# ************** Anonymous pages ****************
+# ********************-----**********************
+
+PAGE_KEY = "page:v%d:%s"
+
+PAGE_TIMEOUT = 60 * 10
+
+
+def page_key(full_path):
+    """
+    >> page_key("/products/all/?cursor=..")
+    'page:v7:9d1f..'
+    """
+
+    digest = hashlib.sha1(full_path.encode()).hexdigest()
+
+    return PAGE_KEY % (catalog_version(), digest)
+
+
+def get_page(full_path):
+    return cache.get(page_key(full_path))
+
+
+def set_page(full_path, page):
+    cache.set(page_key(full_path), page, PAGE_TIMEOUT)
+
+
+# ********************-----**********************
+# **************** Admin reports ****************
+# ********************-----**********************
+
+REPORTS_VERSION_KEY = "reports:version"
+REPORT_KEY = "reports:%s:%s"
+REPORT_LOCK_KEY = "%s:lock"
+
+# The version does the invalidation (a stale result is still served
+# while it's computed again), this is only a safety net
+REPORT_TIMEOUT = 60 * 60 * 24
+
+# Longer than any report takes, a crashed worker can't keep it forever
+REPORT_LOCK_TIMEOUT = 60
+
+# How long a request with NO result at all waits for the worker computing it
+REPORT_WAIT = 10
+REPORT_POLL = 0.05
+
+
+def reports_version():
+    """
+    Same as `catalog_version`, bumped by the writes of 'Order' & 'OrderLine'.
+    """
+
+    return get_version(REPORTS_VERSION_KEY)
+
+
+def _incr_reports_version():
+    return _incr_version(REPORTS_VERSION_KEY)
+
+
+def bump_reports_version():
+    """
+    Right away AND once the transaction commits
+    (same reason as `bump_catalog_version`).
+    """
+
+    transaction.on_commit(_incr_reports_version)
+
+    return _incr_reports_version()
+
+
+def report_key(name, params):
+    """
+    >> report_key("most_bought_products", { "limit": 20, .. })
+    'reports:most_bought_products:3b0c..'
+    """
+
+    return REPORT_KEY % (name, content_etag(*sorted(params.items())))
+
+
+def cached_report(name, compute, **params):
+    """
+    -> (`compute(**params)`, when it was computed)
+
+    About the entry
+        Keyed by the name & the parameters, it holds the data version
+        it was computed at (NOT in the key, so the previous result is
+        still there when the version moves on).
+        || same version                      -> served as it is
+        || stale (or missing) & lock is free -> computed here, then stored
+        || stale & another worker has it    -> the stale result is served
+        || missing & another worker has it  -> wait for it (`REPORT_WAIT`)
+        Only one worker computes a report at a time (single flight),
+        whatever the number of staff members opening it.
+    """
+
+    key = report_key(name, params)
+    version = reports_version()
+    entry = cache.get(key)
+
+    if entry is not None and entry["version"] == version:
+        return entry["data"], entry["computed_at"]
+
+    lock = REPORT_LOCK_KEY % key
+    token = uuid.uuid4().hex
+
+    if cache.add(lock, token, REPORT_LOCK_TIMEOUT):
+        try:
+            return _compute_report(key, version, compute, params)
+        finally:
+            if cache.get(lock) == token:
+                cache.delete(lock)
+
+    if entry is not None:
+        return entry["data"], entry["computed_at"]
+
+    deadline = time.monotonic() + REPORT_WAIT
+
+    while time.monotonic() < deadline:
+        time.sleep(REPORT_POLL)
+        entry = cache.get(key)
+
+        if entry is not None:
+            return entry["data"], entry["computed_at"]
+
+    # The worker died (or it's very slow), computed here then
+    return _compute_report(key, version, compute, params)
+
+
+def _compute_report(key, version, compute, params):
+    """
+    Stored with the version read BEFORE computing,
+    a write in between makes it stale right away (as it should).
+    """
+
+    data = compute(**params)
+    computed_at = timezone.now()
+
+    cache.set(
+        key,
+        { "version": version, "data": data, "computed_at": computed_at },
+        REPORT_TIMEOUT,
+    )
+
+    return data, computed_at
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# ********************-----**********************
+# **************** System checks ****************
+# ********************-----**********************
+
+# Each process has its own (nothing shared between the workers)
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    The versions (catalog, reports) & the report locks live in the cache
+    (see 'main/caching.py'), with a per-process cache
+    || a change bumps the version of ONE worker only
+    || -> the others keep serving their old pages & reports
+    || every worker computes the same report at once (one lock each)
+    Fine while developing (one process), not once DEBUG is off.
+    """
+
+    backend = settings.CACHES.get("default", { }).get("BACKEND")
+
+    if settings.DEBUG or backend not in PROCESS_LOCAL_CACHES:
+        return []
+
+    return [
+        Warning(
+            "The default cache (%s) isn't shared between processes." % backend,
+            hint="Use a shared cache (memcached, redis ..) in CACHES, "
+                 "the cache versions & the report locks are kept in it.",
+            id="main.W001",
+        )
+    ]
@@ -70,7 +70,7 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
         #   2. If not (user), simply return the user (as a CLIENT)
         if user.is_employee:
             order.last_spoken_to = user
-            order.save()
+            order.save(update_fields=["last_spoken_to"])
 
             return ChatConsumer.EMPLOYEE
 
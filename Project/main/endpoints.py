@@ -1,6 +1,8 @@
-from rest_framework import serializers, viewsets
+from rest_framework import permissions, serializers, viewsets
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
 
-from . import models
+from . import caching, models
 
 
 class OrderLineSerializer(serializers.HyperlinkedModelSerializer):
@@ -14,8 +16,8 @@ class OrderLineSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = models.OrderLine
-        fields = ("id", "order", "product", "status")
-        read_only_fields = ("id", "order", "product")
+        fields = ("id", "order", "product", "quantity", "status")
+        read_only_fields = ("id", "order", "product", "quantity")
 
 
 class PaidOrderLineViewSet(viewsets.ModelViewSet):
@@ -54,3 +56,15 @@ class PaidOrderViewSet(viewsets.ModelViewSet):
         .filter(status=models.Order.PAID) \
         .order_by("-date_added")
     serializer_class = OrderSerializer
+
+
+@api_view(["GET"])
+@permission_classes([permissions.IsAdminUser])
+def listing_cache_stats(request):
+    """
+    Hit/miss counters of the product listing cache (staff only).
+    >> GET /api/cache-stats/
+    >> {"hits": 120, "misses": 8, "version": 3}
+    """
+
+    return Response(caching.listing_stats())
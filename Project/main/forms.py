@@ -157,11 +157,18 @@ class AddressSelectionForm(forms.Form):
     Widgets for selecting addresses.
     || 1. This is dynamic
     || 2. The user can only pick his own addrs.
+    || 3. A hidden idempotency key (against double-submits)
     """
 
     billing_address = forms.ModelChoiceField(queryset=None)
     shipping_address = forms.ModelChoiceField(queryset=None)
 
+    # Generated when the page is rendered (see `AddressSelectionView`),
+    # so submitting the same page twice is recognized as ONE checkout.
+    idempotency_key = forms.UUIDField(
+        required=False, widget=forms.HiddenInput
+    )
+
     def __init__(self, user, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main import benchmarks
+
+
+class Command(BaseCommand):
+    help = "Benchmark BookTime hot paths (query count & latency)"
+
+    def add_arguments(self, parser):
+        """
+        Every scenario lives in 'main/benchmarks.py'.
+        The data is created inside a transaction & rolled back afterwards.
+        """
+
+        parser.add_argument("scenario", type=str)
+        parser.add_argument(
+            "--sizes", type=int, nargs="+", default=[1, 10, 50, 100]
+        )
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        """
+        How to use this management command?
+        >> ./manage.py benchmark checkout --sizes 1 10 50 --repeat 5
+        """
+
+        name = options["scenario"]
+
+        if name not in benchmarks.SCENARIOS:
+            raise CommandError(
+                "Unknown scenario '%s' (choose from: %s)"
+                % (name, ", ".join(sorted(benchmarks.SCENARIOS)))
+            )
+
+        rows = benchmarks.run(name, options["sizes"], options["repeat"])
+
+        for row in rows:
+            self.stdout.write(
+                "\t".join(
+                    "%.2f" % value if isinstance(value, float) else str(value)
+                    for value in row
+                )
+            )
@@ -1,12 +1,134 @@
 import csv
+import time
+import hashlib
 import os.path
+from decimal import Decimal
 from collections import Counter
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 
-from django.core.files.images import ImageFile
-from django.core.management.base import BaseCommand
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from django.template.defaultfilters import slugify
+from django.utils import timezone
 
-from main import models
+from main import bitmaps, caching, models, search, thumbnails
+
+
+# Seconds between two progress lines
+PROGRESS_INTERVAL = 5
+
+# Bytes read at a time while hashing an image
+HASH_CHUNK_SIZE = 64 * 1024
+
+# What a `--delta` import wrote (see `import_delta_batch`)
+WRITTEN_COUNTS = (
+    "products_created", "products_updated", "images_created", "images_updated",
+)
+
+
+def read_rows(path, offset=0):
+    """
+    Streams the CSV rows (dicts), one at a time,
+    -> (row, the byte offset right AFTER the row) ..
+
+    About the offset
+        The file is read in binary, line by line,
+        & `csv.reader` only pulls the lines it needs for the next row
+        (a quoted value may span several lines), so the offset is exact.
+        The header is always read first, then it seeks to `offset`.
+    """
+
+    with open(path, "rb") as fi:
+        header = next(csv.reader([fi.readline().decode("utf-8-sig")]))
+
+        if offset:
+            fi.seek(offset)
+
+        position = fi.tell()
+
+        def lines():
+            nonlocal position
+
+            for line in iter(fi.readline, b""):
+                position += len(line)
+                yield line.decode("utf-8")
+
+        for values in csv.reader(lines()):
+            if values:
+                yield dict(zip(header, values)), position
+
+
+def tag_names(row):
+    """
+    Parse multiple tags if there is
+    that means the "delim" depends on the data (may not '|')
+    """
+
+    return [name for name in row["tags"].split("|") if name]
+
+
+def row_hash(row):
+    """
+    sha1 of what a row writes to its product (the tags in any order),
+    the image has a hash of its own (`file_hash`).
+    """
+
+    values = [
+        row["name"],
+        row["description"],
+        str(Decimal(row["price"])),
+        "|".join(sorted(tag_names(row))),
+    ]
+
+    return hashlib.sha1("\x1f".join(values).encode("utf-8")).hexdigest()
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+
+    with open(path, "rb") as fi:
+        for chunk in iter(lambda: fi.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def batches(rows, size):
+    rows = iter(rows)
+
+    while True:
+        batch = list(islice(rows, size))
+
+        if not batch:
+            return
+
+        yield batch
+
+
+class Progress:
+    """
+    >> Imported 120000 rows (2950 rows/sec)
+    At most one line every `PROGRESS_INTERVAL` seconds.
+    """
+
+    def __init__(self, out, row):
+        self.out = out
+        self.first_row = row
+        self.started = self.reported = time.monotonic()
+
+    def update(self, row):
+        now = time.monotonic()
+
+        if now - self.reported < PROGRESS_INTERVAL:
+            return
+
+        self.reported = now
+        self.out.write(
+            "Imported %d rows (%d rows/sec)"
+            % (row, (row - self.first_row) / (now - self.started))
+        )
 
 
 class Command(BaseCommand):
@@ -18,66 +140,129 @@ class Command(BaseCommand):
         The test files should be put in the right place before testing.
         """
 
-        parser.add_argument("csvfile", type=open)
+        parser.add_argument("csvfile", type=str)
         parser.add_argument("image_basedir", type=str)
+        parser.add_argument(
+            "--resume", action="store_true",
+            help="Start after the last committed batch of a previous run",
+        )
+        parser.add_argument(
+            "--delta", action="store_true",
+            help="Products by slug, only write the rows that changed",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=4,
+            help="Threads copying the images & processes making thumbnails",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="CSV rows written per transaction",
+        )
 
     def handle(self, *args, **options):
         """ The logic code will be put in here.
-        
+
         How to use this management command?
         >> ./manage.py import_data YOUR_CSV_FILE_PATH YOUR_IMAGES_FILE_PATH
-        """
+        >> ./manage.py import_data ... --workers 8 --batch-size 1000
+        >> ./manage.py import_data ... --resume
+        >> ./manage.py import_data ... --delta
 
-        self.stdout.write("Importing products")
+        About the streaming
+            The file is never loaded as a whole, ONE batch at a time,
+            committed together with its checkpoint ('ImportCheckpoint':
+            byte offset & row number). After a failure (row 900k ..),
+            `--resume` seeks right after the last committed batch.
 
-        # Load the data
-        c = Counter()
-        reader = csv.DictReader(options.pop("csvfile"))
+        About the pipeline (per batch of rows)
+            || 1. tags         a dict (name -> tag), only the new ones inserted
+            || 2. products     ONE query for the existing ones,
+            ||                 `bulk_create` / `bulk_update` for the rest
+            || 3. tags <-> products   `bulk_create` on the M2M table
+            || 4. images       copied by a pool of threads (file I/O),
+            ||                 then `bulk_create`
+            || 5. thumbnails   queued to the worker processes
+            ||                 ('main/thumbnails.py'), once committed
+            So the number of queries depends on the batches, not the rows.
 
-        for row in reader:
+        About `--delta` (e.g. a nightly full-feed sync)
+            || products      by SLUG (not name & price), a row is skipped
+            ||               if its hash ('Product.import_hash') is the same
+            || tags          only for the rows written, set to the row's ones
+            || images        by the hash of the FILE ('source_hash'),
+            ||               the same file -> nothing at all,
+            ||               another file  -> the imported image is replaced
+            ||               (a new one only if the product has none)
+            So an unchanged feed costs reads only, no writes, no new files,
+            no thumbnails. A change made in the admin stays until
+            the row of the feed changes.
+            >> Products unchanged=2 updated=1 created=0
 
-            # Generate data :: Product
-            product, created = models.Product.objects.get_or_create(
-                name=row["name"], price=row["price"]
-            )
+        About the signals
+            The bulk queries send none, so their job is done here instead
+            (search index, cached pages, tag bitmaps, thumbnails).
+        """
 
-            product.description = row["description"]
-            product.slug = slugify(row["name"])
+        self.stdout.write("Importing products")
 
-            # Parse multiple tags if there is
-            # that means the "delim" depends on the data (may not '|')
-            for import_tag in row["tags"].split("|"):
+        self.delta = options["delta"]
+        self.workers = max(1, options["workers"])
+        self.image_basedir = options["image_basedir"]
+        self.tags = {
+            tag.name: tag for tag in models.ProductTag.objects.all()
+        }
 
-                # Generate data :: ProductTag
-                tag, tag_created = models.ProductTag.objects.get_or_create(
-                    name=import_tag
-                )
+        # `THUMBNAIL_WORKERS = 0` -> no pool (right after every batch)
+        if thumbnails.worker.processes:
+            thumbnails.worker.start(processes=self.workers)
 
-                product.tags.add(tag)
+        # Load the data
+        c = Counter()
+        path = os.path.abspath(options["csvfile"])
+        checkpoint, created = models.ImportCheckpoint.objects.get_or_create(
+            source=path
+        )
 
-                c["tags"] += 1
-                if tag_created:
-                    c["tag_created"] += 1
+        if not options["resume"]:
+            checkpoint.offset, checkpoint.row = 0, 0
+            checkpoint.finished = False
+            checkpoint.save()
+        elif checkpoint.offset > os.path.getsize(path):
+            raise CommandError(
+                "%s is shorter than its checkpoint (a new file?), "
+                "import it without --resume" % path
+            )
 
-            with open(
-                os.path.join(options["image_basedir"], row["image_filename"]),
-                "rb"
-            ) as fi:
+        progress = Progress(self.stderr, checkpoint.row)
+        committed = (checkpoint.row, checkpoint.offset)
+        rows = read_rows(path, checkpoint.offset)
 
-                # Generate data :: ProductImage
-                image = models.ProductImage(
-                    product=product,
-                    image=ImageFile(fi, name=row["image_filename"])
-                )
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for batch in batches(rows, max(1, options["batch_size"])):
+                    with transaction.atomic():
+                        self.import_batch([row for row, end in batch], pool, c)
 
-                image.save()
-                c["images"] += 1
+                        checkpoint.offset = batch[-1][1]
+                        checkpoint.row += len(batch)
+                        checkpoint.save()
 
-            product.save()
-            c["products"] += 1
+                    committed = (checkpoint.row, checkpoint.offset)
+                    progress.update(checkpoint.row)
+        except Exception:
+            self.stderr.write(
+                "Stopped after row %d (byte %d), run it again with --resume"
+                % committed
+            )
+            raise
 
-            if created:
-                c["products_created"] += 1
+        checkpoint.finished = True
+        checkpoint.save()
+
+        # An unchanged `--delta` feed leaves the caches & the tag index alone
+        if not self.delta or any(c[key] for key in WRITTEN_COUNTS):
+            caching.bump_catalog_version()
+            bitmaps.tag_index.invalidate()
 
         self.stdout.write(
             "Products processed=%d (created=%d)"
@@ -92,3 +277,320 @@ class Command(BaseCommand):
         self.stdout.write(
             "Images processed=%d" % (c["images"])
         )
+
+        if self.delta:
+            for kind in ("Products", "Images"):
+                key = kind.lower()
+                self.stdout.write(
+                    "%s unchanged=%d updated=%d created=%d" % (
+                        kind, c[key + "_unchanged"], c[key + "_updated"],
+                        c[key + "_created"],
+                    )
+                )
+
+        # The thumbnails are queued (see 'main/thumbnails.py'),
+        # the command must not exit before the worker is done with them
+        thumbnails.worker.join()
+
+    def import_batch(self, rows, pool, c):
+        if self.delta:
+            return self.import_delta_batch(rows, pool, c)
+
+        # The images are copied meanwhile (nothing to do with the DB)
+        copies = pool.map(self.copy_image, [
+            row["image_filename"] for row in rows
+        ])
+
+        names = [tag_names(row) for row in rows]
+        self.create_tags({ name for tags in names for name in tags }, c)
+
+        products = self.save_products(rows, c)
+        product_ids = [product.id for product in products]
+
+        self.add_tags(zip(products, names))
+        c["tags"] += sum(len(tags) for tags in names)
+
+        image_ids = self.save_images(products, list(copies))
+        c["images"] += len(rows)
+
+        search.index_products(set(product_ids))
+        caching.forget_products(set(product_ids))
+
+        self.queue_thumbnails(image_ids)
+
+    def import_delta_batch(self, rows, pool, c):
+        """
+        The last row of a slug wins (within the batch),
+        the counts are per product.
+        """
+
+        # Hashed meanwhile, most of them won't be copied at all
+        hashes = pool.map(file_hash, [
+            self.image_path(row["image_filename"]) for row in rows
+        ])
+        latest = {
+            slugify(row["name"]): (row, image_hash)
+            for row, image_hash in zip(rows, hashes)
+        }
+        c["products"] += len(rows)
+        c["images"] += len(rows)
+
+        existing = self.products_by_slug(latest)
+        new, changed = [], []
+
+        for slug, (row, image_hash) in latest.items():
+            digest = row_hash(row)
+            product = existing.get(slug)
+
+            if product is None:
+                product = models.Product(slug=slug)
+                new.append(product)
+            elif product.import_hash == digest:
+                continue
+            else:
+                changed.append(product)
+
+            product.name = row["name"]
+            product.description = row["description"]
+            product.price = Decimal(row["price"])
+            product.import_hash = digest
+
+        c["products_created"] += len(new)
+        c["products_updated"] += len(changed)
+        c["products_unchanged"] += len(latest) - len(new) - len(changed)
+
+        if changed:
+            now = timezone.now()
+
+            for product in changed:
+                product.date_updated = now
+
+            models.Product.objects.bulk_update(changed, [
+                "name", "description", "price", "import_hash", "date_updated",
+            ])
+
+        if new:
+            models.Product.objects.bulk_create(new)
+            existing = self.products_by_slug(latest)
+
+        written = { product.slug for product in new + changed }
+        names = { slug: tag_names(latest[slug][0]) for slug in written }
+        self.create_tags(
+            { name for tags in names.values() for name in tags }, c
+        )
+
+        # The feed is the reference, so the tags are SET (not added)
+        written_ids = [existing[slug].id for slug in written]
+        models.Product.tags.through.objects \
+            .filter(product_id__in=written_ids) \
+            .delete()
+        self.add_tags((existing[slug], tags) for slug, tags in names.items())
+
+        image_ids, image_product_ids = self.sync_images(
+            {
+                existing[slug]: (row["image_filename"], image_hash)
+                for slug, (row, image_hash) in latest.items()
+            },
+            pool, c,
+        )
+
+        search.index_products(set(written_ids))
+        caching.forget_products(set(written_ids) | image_product_ids)
+
+        self.queue_thumbnails(image_ids)
+
+    def sync_images(self, files, pool, c):
+        """
+        files       { product: (filename, hash) }
+        -> (the ids of the images to make thumbnails of,
+            the ids of their products)
+        """
+
+        images = { }
+
+        for image in models.ProductImage.objects \
+                .filter(product__in=list(files)) \
+                .order_by("id"):
+            images.setdefault(image.product_id, []).append(image)
+
+        new, replaced = { }, { }
+
+        for product, (filename, image_hash) in files.items():
+            current = images.get(product.id, [])
+
+            if any(image.source_hash == image_hash for image in current):
+                continue
+
+            imported = [image for image in current if image.source_hash]
+
+            if imported:
+                replaced[product] = imported[0]
+            else:
+                new[product] = None
+
+        c["images_created"] += len(new)
+        c["images_updated"] += len(replaced)
+        c["images_unchanged"] += len(files) - len(new) - len(replaced)
+
+        products = list(new) + list(replaced)
+        copies = dict(zip(products, pool.map(self.copy_image, [
+            files[product][0] for product in products
+        ])))
+
+        for product, image in replaced.items():
+            image.image, image.source_hash = copies[product]
+            image.thumbnail = None
+
+        if replaced:
+            models.ProductImage.objects.bulk_update(
+                replaced.values(), ["image", "source_hash", "thumbnail"]
+            )
+
+        image_ids = [image.id for image in replaced.values()]
+        image_ids += self.save_images(list(new), [
+            copies[product] for product in new
+        ])
+
+        return image_ids, { product.id for product in products }
+
+    def add_tags(self, product_tags):
+        Through = models.Product.tags.through
+        Through.objects.bulk_create(
+            [
+                Through(
+                    product_id=product.id, producttag_id=self.tags[name].id
+                )
+                for product, names in product_tags
+                for name in names
+            ],
+            ignore_conflicts=True,
+        )
+
+    def queue_thumbnails(self, image_ids):
+        transaction.on_commit(lambda: [
+            thumbnails.worker.submit(image_id) for image_id in image_ids
+        ])
+
+    def create_tags(self, names, c):
+        new = [
+            models.ProductTag(name=name, slug=slugify(name))
+            for name in sorted(names) if name not in self.tags
+        ]
+
+        if new:
+            models.ProductTag.objects.bulk_create(new)
+
+            # Not every backend returns the ids, hence the re-read
+            for tag in models.ProductTag.objects.filter(
+                name__in=[tag.name for tag in new]
+            ):
+                self.tags.setdefault(tag.name, tag)
+
+            c["tag_created"] += len(new)
+
+    def save_products(self, rows, c):
+        """
+        Same as the old `get_or_create(name=.., price=..)` for every row,
+        the last row wins for the description & the slug.
+        -> the product of every row (in order)
+        """
+
+        keys = [(row["name"], Decimal(row["price"])) for row in rows]
+        names = { name for name, price in keys }
+
+        existing = self.products_by_key(names)
+        new = { }
+
+        for key, row in zip(keys, rows):
+            product = existing.get(key) or new.get(key)
+
+            if product is None:
+                product = new[key] = models.Product(name=key[0], price=key[1])
+                c["products_created"] += 1
+
+            product.description = row["description"]
+            product.slug = slugify(row["name"])
+            product.import_hash = row_hash(row)
+            c["products"] += 1
+
+        changed = [existing[key] for key in set(keys) if key in existing]
+
+        if changed:
+            now = timezone.now()
+
+            for product in changed:
+                product.date_updated = now
+
+            models.Product.objects.bulk_update(
+                changed, ["description", "slug", "import_hash", "date_updated"]
+            )
+
+        if new:
+            models.Product.objects.bulk_create(new.values())
+            existing = self.products_by_key(names)
+
+        return [existing[key] for key in keys]
+
+    def products_by_key(self, names):
+        """
+        (name, price) -> the FIRST such product (the lowest id)
+        """
+
+        products = { }
+
+        for product in models.Product.objects \
+                .filter(name__in=names) \
+                .order_by("id"):
+            products.setdefault((product.name, product.price), product)
+
+        return products
+
+    def products_by_slug(self, slugs):
+        """
+        slug -> the FIRST such product (the lowest id)
+        """
+
+        products = { }
+
+        for product in models.Product.objects \
+                .filter(slug__in=list(slugs)) \
+                .order_by("id"):
+            products.setdefault(product.slug, product)
+
+        return products
+
+    def image_path(self, filename):
+        return os.path.join(self.image_basedir, filename)
+
+    def copy_image(self, filename):
+        """
+        Runs in the thread pool,
+        -> (the name in the storage (the same as saving a 'ProductImage'),
+            the hash of the file)
+        """
+
+        field = models.ProductImage._meta.get_field("image")
+        path = self.image_path(filename)
+
+        with open(path, "rb") as fi:
+            name = field.storage.save(
+                field.generate_filename(None, filename), File(fi)
+            )
+
+        return name, file_hash(path)
+
+    def save_images(self, products, copies):
+        names = [name for name, image_hash in copies]
+
+        models.ProductImage.objects.bulk_create([
+            models.ProductImage(
+                product=product, image=name, source_hash=image_hash
+            )
+            for product, (name, image_hash) in zip(products, copies)
+        ])
+
+        return list(
+            models.ProductImage.objects
+                .filter(image__in=names)
+                .values_list("id", flat=True)
+        )
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from main import models
+
+
+class Command(BaseCommand):
+    help = "Recompute the item/line counters of BookTime baskets"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--open-only",
+            action="store_true",
+            help="Only the baskets which are still open",
+        )
+
+    def handle(self, *args, **options):
+        """
+        How to use this management command?
+        >> ./manage.py recount_baskets [--open-only]
+
+        It's ONE `UPDATE` statement, no matter how many baskets there are.
+        """
+
+        baskets = models.Basket.objects.all()
+
+        if options["open_only"]:
+            baskets = baskets.filter(status=models.Basket.OPEN)
+
+        self.stdout.write(
+            "Baskets recounted=%d" % baskets.recount()
+        )
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from main import caching, models
+
+
+class Command(BaseCommand):
+    help = "Recompute the outstanding-lines counter of BookTime orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--mark-done",
+            action="store_true",
+            help="Also mark the orders with no outstanding lines as done",
+        )
+
+    def handle(self, *args, **options):
+        """
+        How to use this management command?
+        >> ./manage.py recount_orders [--mark-done]
+
+        It's ONE `UPDATE` statement, no matter how many orders there are.
+        (plus one more with `--mark-done`)
+
+        Do note that an order with no lines at all is marked as done too.
+        """
+
+        orders = models.Order.objects.all()
+
+        self.stdout.write("Orders recounted=%d" % orders.recount())
+
+        if options["mark_done"]:
+            self.stdout.write(
+                "Orders marked as done=%d" % orders.mark_done_if_finished()
+            )
+
+        # `UPDATE`s send no signals, the cached reports are stale now
+        caching.bump_reports_version()
@@ -0,0 +1,42 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main import caching, models
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily rollups of BookTime (orders & product sales)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            help="Only the last N days (every day by default)",
+        )
+
+    def handle(self, *args, **options):
+        """
+        How to use this management command?
+        >> ./manage.py rollup_orders [--days 7]
+
+        It's ONE `GROUP BY` per rollup over the orders (order lines)
+        of those days (+ the writes), for a backfill,
+        or after a bulk change which sent no signals.
+        The signals & the checkout keep them up to date otherwise.
+        """
+
+        first = None
+
+        if options["days"]:
+            first = timezone.localdate() - timedelta(days=options["days"] - 1)
+
+        rows = models.DailyOrderStat.objects.rebuild(first)
+        self.stdout.write("Daily order rows written=%d" % rows)
+
+        rows = models.DailyProductSales.objects.rebuild(first)
+        self.stdout.write("Daily product sales rows written=%d" % rows)
+
+        # The reports read the rollups, the cached ones are stale now
+        caching.bump_reports_version()
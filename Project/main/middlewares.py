@@ -1,4 +1,38 @@
-from . import models
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import parse_http_date_safe
+
+from . import caching, models
+
+# The storefront pages, the same for every anonymous visitor
+CACHED_PAGES = ("home", "about_us", "products", "product")
+
+
+def get_basket(request):
+    """
+    The basket is loaded the FIRST time it's used, then cached on the request.
+
+    A basket that doesn't exist anymore (deleted, merged on login ..)
+    gives `None` & the stale id is dropped from the session.
+    """
+
+    if not hasattr(request, "_cached_basket"):
+        basket_id = request.session.get("basket_id")
+        basket = None
+
+        if basket_id is not None:
+            basket = models.Basket.objects.filter(id=basket_id).first()
+
+            if basket is None:
+                del request.session["basket_id"]
+
+        request._cached_basket = basket
+
+    return request._cached_basket
 
 
 def basket_middleware(get_response):
@@ -9,18 +43,140 @@ def basket_middleware(get_response):
               get it and assign it to the current page (request.basket).
         -- 2. The 'request.basket' will be eventually be used
               by the methods in 'views.py' (which is the 'add_to_basket')
+
+        About the `SimpleLazyObject`
+            Same trick as `request.user` (AuthenticationMiddleware).
+            Requests that never touch `request.basket` (media, API, admin ..)
+            don't pay for the query at all.
         """
 
-        if 'basket_id' in request.session:
-            basket_id = request.session["basket_id"]
-            basket = models.Basket.objects.get(id=basket_id)
+        request.basket = SimpleLazyObject(lambda: get_basket(request))
+
+        response = get_response(request)
+
+        return response
+
+    return middleware
+
+
+def is_cacheable_request(request):
+    """
+    || GET / HEAD only
+    || NO session & NO messages cookie (an anonymous visitor, no basket)
+    || one of the `CACHED_PAGES`
+    """
+
+    if request.method not in ("GET", "HEAD"):
+        return False
+
+    if settings.SESSION_COOKIE_NAME in request.COOKIES \
+            or CookieStorage.cookie_name in request.COOKIES:
+        return False
+
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return False
+
+    return match.namespace == "main" and match.url_name in CACHED_PAGES
+
+
+def is_cacheable_response(response):
+    cache_control = response.get("Cache-Control", "")
+
+    return response.status_code == 200 \
+        and not response.streaming \
+        and not response.cookies \
+        and "private" not in cache_control \
+        and "no-store" not in cache_control
 
-            request.basket = basket
-        else:
-            request.basket = None
+
+# Never replayed from the cache, they belong to the response being built
+UNCACHED_HEADERS = ("content-length", "content-type", "set-cookie", "vary")
+
+
+def stored_headers(response):
+    """
+    What the inner middlewares & the view set (X-Frame-Options,
+    Cache-Control ..), replayed on every hit.
+    """
+
+    return [
+        (name, value) for name, value in response.items()
+        if name.lower() not in UNCACHED_HEADERS
+    ]
+
+
+def cached_response(request, page):
+    """
+    The stored page (or a 304 if the browser has it already),
+    with the headers of the original response.
+    """
+
+    response = get_conditional_response(
+        request,
+        etag=page["etag"],
+        last_modified=parse_http_date_safe(page["last_modified"] or ""),
+    )
+
+    if response is None:
+        response = HttpResponse(
+            page["content"], content_type=page["content_type"]
+        )
+
+    for name, value in page.get("headers", ()):
+        response[name] = value
+
+    for header in ("etag", "last_modified"):
+        if page[header]:
+            response[header.replace("_", "-").title()] = page[header]
+
+    response["Vary"] = "Cookie"
+    response["X-Page-Cache"] = "hit"
+
+    return response
+
+
+def page_cache_middleware(get_response):
+    def middleware(request):
+        """
+        A full-page cache for the anonymous visitors.
+
+        About the position (right after the `SecurityMiddleware`)
+            A hit is answered BEFORE the session, the user & the basket
+            are even looked at, so it costs no database query at all.
+
+        About the basket
+            It's not in the page anymore, the widget asks for it
+            by itself ('basket/summary/', see `basket_summary`).
+            Anyone with a session cookie goes through the views as before.
+
+        About the invalidation
+            The key embeds the catalog version (see 'main/caching.py'),
+            a product, tag or image change makes every cached page stale.
+        """
+
+        if not is_cacheable_request(request):
+            return get_response(request)
+
+        full_path = request.get_full_path()
+        page = caching.get_page(full_path)
+
+        if page is not None:
+            return cached_response(request, page)
 
         response = get_response(request)
 
+        if request.method == "GET" and is_cacheable_response(response):
+            caching.set_page(full_path, {
+                "content": response.content,
+                "content_type": response["Content-Type"],
+                "etag": response.get("ETag"),
+                "last_modified": response.get("Last-Modified"),
+                "headers": stored_headers(response),
+            })
+            response["X-Page-Cache"] = "miss"
+
         return response
 
-    return middleware
\ No newline at end of file
+    return middleware
@@ -0,0 +1,68 @@
+# Generated by Django 2.2.28 on 2026-10-16 22:40
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def fold_duplicate_lines(apps, schema_editor):
+    """
+    Rows for the same (order, product, status) become ONE row
+    carrying the number of units as its `quantity`.
+    """
+
+    OrderLine = apps.get_model("main", "OrderLine")
+
+    groups = (
+        OrderLine.objects
+            .values("order", "product", "status")
+            .annotate(keep=Min("id"), units=Count("id"))
+            .filter(units__gt=1)
+    )
+
+    for group in groups.iterator():
+        OrderLine.objects \
+            .filter(pk=group["keep"]) \
+            .update(quantity=group["units"])
+
+        OrderLine.objects \
+            .filter(
+                order=group["order"],
+                product=group["product"],
+                status=group["status"],
+            ) \
+            .exclude(pk=group["keep"]) \
+            .delete()
+
+
+def unfold_lines(apps, schema_editor):
+    OrderLine = apps.get_model("main", "OrderLine")
+
+    for line in OrderLine.objects.filter(quantity__gt=1).iterator():
+        OrderLine.objects.bulk_create([
+            OrderLine(
+                order_id=line.order_id,
+                product_id=line.product_id,
+                status=line.status,
+            )
+            for i in range(line.quantity - 1)
+        ])
+
+        line.quantity = 1
+        line.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_order_basket_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderline',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.RunPython(fold_duplicate_lines, unfold_lines),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 2.2.28 on 2026-10-16 22:42
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def count_basket_lines(apps, schema_editor):
+    """
+    Same as `BasketQuerySet.recount` (not available on historical models).
+    """
+
+    Basket = apps.get_model("main", "Basket")
+    BasketLine = apps.get_model("main", "BasketLine")
+
+    lines = (
+        BasketLine.objects
+            .filter(basket=OuterRef("pk"))
+            .order_by()
+            .values("basket")
+    )
+
+    Basket.objects.update(
+        item_count=Coalesce(
+            Subquery(lines.annotate(s=Sum("quantity")).values("s")), 0
+        ),
+        line_count=Coalesce(
+            Subquery(lines.annotate(c=Count("id")).values("c")), 0
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_orderline_quantity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basket',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='basket',
+            name='line_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_basket_lines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 2.2.28 on 2026-10-16 22:46
+
+from django.db import migrations
+from django.db.models import Count, F, Min, Sum
+
+
+def fold_duplicate_lines(apps, schema_editor):
+    """
+    The old login merge could leave two lines for the same product,
+    those have to become ONE line before the unique constraint is added.
+    """
+
+    Basket = apps.get_model("main", "Basket")
+    BasketLine = apps.get_model("main", "BasketLine")
+
+    groups = (
+        BasketLine.objects
+            .values("basket", "product")
+            .annotate(keep=Min("id"), lines=Count("id"), units=Sum("quantity"))
+            .filter(lines__gt=1)
+    )
+
+    for group in groups.iterator():
+        BasketLine.objects \
+            .filter(pk=group["keep"]) \
+            .update(quantity=group["units"])
+
+        BasketLine.objects \
+            .filter(basket=group["basket"], product=group["product"]) \
+            .exclude(pk=group["keep"]) \
+            .delete()
+
+        Basket.objects \
+            .filter(pk=group["basket"]) \
+            .update(line_count=F("line_count") - (group["lines"] - 1))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_basket_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(fold_duplicate_lines, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='basketline',
+            unique_together={('basket', 'product')},
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 2.2.28 on 2026-10-16 22:50
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+SENT = 30
+
+
+def count_outstanding_lines(apps, schema_editor):
+    """
+    Same as `OrderQuerySet.recount` (not available on historical models).
+    """
+
+    Order = apps.get_model("main", "Order")
+    OrderLine = apps.get_model("main", "OrderLine")
+
+    lines = (
+        OrderLine.objects
+            .filter(order=OuterRef("pk"), status__lt=SENT)
+            .order_by()
+            .values("order")
+            .annotate(c=Count("id"))
+            .values("c")
+    )
+
+    Order.objects.update(outstanding_lines=Coalesce(Subquery(lines), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_basketline_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='outstanding_lines',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(
+            count_outstanding_lines, migrations.RunPython.noop
+        ),
+    ]
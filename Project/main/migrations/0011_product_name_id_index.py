@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-16 22:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_order_outstanding_lines'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='main_product_name_id_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-16 22:56
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+from main import search
+
+
+def create_search_index(apps, schema_editor):
+    """
+    A GIN index on PostgreSQL, an FTS5 table on SQLite,
+    then every product is indexed once (raw SQL, no model involved).
+    """
+
+    search.create_index(schema_editor)
+    search.index_products()
+
+
+def drop_search_index(apps, schema_editor):
+    search.drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_product_name_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-16 23:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_catalog_revision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductImageRendition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('width', models.PositiveIntegerField()),
+                ('format', models.CharField(choices=[('jpeg', 'JPEG'), ('webp', 'WebP')], max_length=4)),
+                ('file', models.ImageField(upload_to='product-renditions')),
+                ('size', models.PositiveIntegerField(help_text='In bytes')),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='main.ProductImage')),
+            ],
+            options={
+                'ordering': ('format', 'width'),
+                'unique_together': {('image', 'width', 'format')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-16 23:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_product_image_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255, unique=True)),
+                ('offset', models.BigIntegerField(default=0, help_text='In bytes')),
+                ('row', models.BigIntegerField(default=0)),
+                ('finished', models.BooleanField(default=False)),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
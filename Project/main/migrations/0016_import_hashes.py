@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-16 23:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_import_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='import_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='source_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+    ]
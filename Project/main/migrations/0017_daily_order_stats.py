@@ -0,0 +1,56 @@
+# Generated by Django 2.2.28 on 2026-10-16 23:46
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def rollup_orders(apps, schema_editor):
+    """
+    Same as `DailyOrderStatQuerySet.rebuild` (not available on historical models).
+    """
+
+    Order = apps.get_model("main", "Order")
+    DailyOrderStat = apps.get_model("main", "DailyOrderStat")
+
+    rows = (
+        Order.objects
+            .order_by()
+            .annotate(day=TruncDate("date_added"))
+            .values("day", "status", "shipping_country")
+            .annotate(c=Count("id"))
+    )
+
+    DailyOrderStat.objects.bulk_create([
+        DailyOrderStat(
+            day=row["day"],
+            status=row["status"],
+            shipping_country=row["shipping_country"],
+            orders=row["c"],
+        )
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_import_hashes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOrderStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.IntegerField(choices=[(10, 'New'), (20, 'Paid'), (30, 'Done')])),
+                ('shipping_country', models.CharField(max_length=3)),
+                ('orders', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('day', 'status', 'shipping_country')},
+            },
+        ),
+        migrations.RunPython(rollup_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 2.2.28 on 2026-10-16 23:52
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def rollup_sales(apps, schema_editor):
+    """
+    Same as `DailyProductSalesQuerySet.rebuild` (not available on historical models).
+    """
+
+    OrderLine = apps.get_model("main", "OrderLine")
+    DailyProductSales = apps.get_model("main", "DailyProductSales")
+
+    rows = (
+        OrderLine.objects
+            .order_by()
+            .annotate(day=TruncDate("order__date_added"))
+            .values("day", "product")
+            .annotate(
+                units=Sum("quantity"),
+                revenue=Sum(
+                    F("quantity") * F("product__price"),
+                    output_field=models.DecimalField(),
+                ),
+            )
+    )
+
+    DailyProductSales.objects.bulk_create([
+        DailyProductSales(
+            day=row["day"],
+            product_id=row["product"],
+            units=row["units"],
+            revenue=row["revenue"],
+        )
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_daily_order_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.Product')),
+            ],
+            options={
+                'verbose_name_plural': 'daily product sales',
+                'unique_together': {('day', 'product')},
+            },
+        ),
+        migrations.RunPython(rollup_sales, migrations.RunPython.noop),
+    ]
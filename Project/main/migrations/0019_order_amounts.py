@@ -0,0 +1,74 @@
+# Generated by Django 2.2.28 on 2026-10-16 23:58
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def snapshot_amounts(apps, schema_editor):
+    """
+    The existing lines get the CURRENT price of their product
+    (the price they were sold at is lost), then the orders are recounted,
+    same as `OrderQuerySet.recount` (not available on historical models).
+    """
+
+    Product = apps.get_model("main", "Product")
+    Order = apps.get_model("main", "Order")
+    OrderLine = apps.get_model("main", "OrderLine")
+
+    OrderLine.objects.filter(unit_price__isnull=True).update(
+        unit_price=Subquery(
+            Product.objects.filter(pk=OuterRef("product")).values("price")[:1]
+        )
+    )
+
+    lines = OrderLine.objects \
+        .filter(order=OuterRef("pk")) \
+        .order_by() \
+        .values("order")
+
+    def amount(lines):
+        return Coalesce(
+            Subquery(
+                lines
+                    .annotate(s=Sum(
+                        F("quantity") * F("unit_price"),
+                        output_field=models.DecimalField(),
+                    ))
+                    .values("s"),
+                output_field=models.DecimalField(),
+            ),
+            Value(0),
+        )
+
+    # 40 == OrderLine.CANCELLED
+    Order.objects.update(
+        subtotal=amount(lines),
+        total=amount(lines.exclude(status=40)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_daily_product_sales'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderline',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=6, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.RunPython(snapshot_amounts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+from django.db import migrations, models
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+
+
+def rollup_sales(apps, schema_editor):
+    """
+    Rebuilt at the line prices (`unit_price`, 0019) & without the cancelled
+    lines, same as `DailyProductSalesQuerySet.rebuild`
+    (not available on historical models).
+    """
+
+    OrderLine = apps.get_model("main", "OrderLine")
+    DailyProductSales = apps.get_model("main", "DailyProductSales")
+
+    # 40 == OrderLine.CANCELLED
+    rows = (
+        OrderLine.objects
+            .exclude(status=40)
+            .order_by()
+            .annotate(day=TruncDate("order__date_added"))
+            .values("day", "product")
+            .annotate(
+                units=Sum("quantity"),
+                revenue=Sum(
+                    F("quantity") * F("unit_price"),
+                    output_field=models.DecimalField(),
+                ),
+            )
+    )
+
+    DailyProductSales.objects.all().delete()
+    DailyProductSales.objects.bulk_create([
+        DailyProductSales(
+            day=row["day"],
+            product_id=row["product"],
+            units=row["units"],
+            revenue=row["revenue"] or 0,
+        )
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0020_line_date_updated'),
+    ]
+
+    operations = [
+        migrations.RunPython(rollup_sales, migrations.RunPython.noop),
+    ]
@@ -1,12 +1,19 @@
+import uuid
 import logging
+from collections import Counter
+from datetime import datetime, time, timedelta
 
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Now, TruncDate
+from django.utils import timezone
 from django.contrib.auth.models import (
     AbstractUser,
     BaseUserManager,
 )
 
 from django.core.validators import MinValueValidator
+from django.contrib.postgres.search import SearchVectorField
 
 from . import exceptions
 
@@ -51,12 +58,44 @@ class Product(models.Model):
 
     tags = models.ManyToManyField(ProductTag, blank=True)
 
+    # name + tag names + description, kept up to date by 'main/search.py'
+    # (only filled on PostgreSQL, SQLite uses an FTS5 table instead)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # sha1 of its CSV row, 'import_data --delta' skips the same row
+    import_hash = models.CharField(max_length=40, blank=True, editable=False)
+
     objects = ActiveManager()
 
+    class Meta:
+        # The keyset pagination of the listing seeks on (name, id)
+        indexes = [
+            models.Index(fields=["name", "id"], name="main_product_name_id_idx"),
+        ]
+
     def __str__(self):
         return self.name
 
 
+class CatalogRevision(models.Model):
+    """
+    A single row, its `token` changes (in the same transaction)
+    with every change the tag index ('main/bitmaps.py') cares about.
+
+    Q & A
+        Why in the database (not the cache)?
+        || it's rolled back with the change itself,
+        || so a rolled-back change can never look "applied" to a process.
+    """
+
+    token = models.UUIDField(default=uuid.uuid4)
+
+    @classmethod
+    def current(cls):
+        revision, created = cls.objects.get_or_create(pk=1)
+        return revision.token
+
+
 class ProductImage(models.Model):
     """
     The field `image` requires an extra package.
@@ -68,10 +107,91 @@ class ProductImage(models.Model):
     image = models.ImageField(upload_to="product-images")
     thumbnail = models.ImageField(upload_to="product-thumbnails", null=True)
 
+    # sha1 of the imported file ('import_data'), empty for an upload
+    source_hash = models.CharField(max_length=40, blank=True, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remember the image as loaded,
+        so the signals only queue a thumbnail when it really changed.
+        """
+
+        instance = super().from_db(db, field_names, values)
+
+        if "image" in field_names:
+            instance._loaded_image = values[field_names.index("image")]
+
+        return instance
+
+    def srcsets(self):
+        """
+        The `srcset` of every format (see 'main/renditions.py'),
+        e.g. { "jpeg": "/media/..-320.jpg 320w, /media/..-640.jpg 640w" }
+        """
+
+        srcsets = { }
+
+        for rendition in self.renditions.all():
+            srcsets.setdefault(rendition.format, []).append(
+                "%s %dw" % (rendition.file.url, rendition.width)
+            )
+
+        return {
+            kind: ", ".join(candidates)
+            for kind, candidates in srcsets.items()
+        }
+
     def __str__(self):
         return self.product.name
 
 
+class ProductImageRendition(models.Model):
+    """
+    One width & format of a 'ProductImage', written by the worker
+    (see 'main/thumbnails.py'), never by hand.
+    """
+
+    JPEG = "jpeg"
+    WEBP = "webp"
+    FORMATS = ((JPEG, "JPEG"), (WEBP, "WebP"))
+
+    image = models.ForeignKey(
+        ProductImage, on_delete=models.CASCADE, related_name="renditions"
+    )
+    width = models.PositiveIntegerField()
+    format = models.CharField(max_length=4, choices=FORMATS)
+    file = models.ImageField(upload_to="product-renditions")
+    size = models.PositiveIntegerField(help_text="In bytes")
+
+    class Meta:
+        unique_together = ("image", "width", "format")
+        ordering = ("format", "width")
+
+    def __str__(self):
+        return "%s (%dw %s)" % (self.image, self.width, self.format)
+
+
+class ImportCheckpoint(models.Model):
+    """
+    How far 'import_data' got in a CSV file (see `--resume`).
+
+    Q & A
+        Why in the database (not a file)?
+        || it's written in the SAME transaction as the rows of the batch,
+        || so the checkpoint & the data can never disagree after a crash.
+    """
+
+    source = models.CharField(max_length=255, unique=True)
+    offset = models.BigIntegerField(default=0, help_text="In bytes")
+    row = models.BigIntegerField(default=0)
+    finished = models.BooleanField(default=False)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "%s (row %d)" % (self.source, self.row)
+
+
 class UserManager(BaseUserManager):
     """
     Q & A
@@ -180,6 +300,34 @@ class Address(models.Model):
         ])
 
 
+class BasketQuerySet(models.QuerySet):
+    def recount(self):
+        """
+        Recompute `item_count` & `line_count` from the 'BasketLine' rows,
+        for every basket in the queryset with ONE `UPDATE` statement.
+
+        e.g.
+            Basket.objects.recount()                # the whole table
+            Basket.objects.filter(pk=1).recount()   # a single basket
+        """
+
+        lines = (
+            BasketLine.objects
+                .filter(basket=OuterRef("pk"))
+                .order_by()
+                .values("basket")
+        )
+
+        return self.update(
+            item_count=Coalesce(
+                Subquery(lines.annotate(s=Sum("quantity")).values("s")), 0
+            ),
+            line_count=Coalesce(
+                Subquery(lines.annotate(c=Count("id")).values("c")), 0
+            ),
+        )
+
+
 class Basket(models.Model):
     """
     A review of 'Basket' & 'BasketLine' model (which is very needed)
@@ -194,6 +342,13 @@ class Basket(models.Model):
         || basket       basket_id   # link to 'Basket' model  (multiple to ONE in `Basket`)
         || product      product_id  # along with `quantity`   (each prod got its own records)
         || quantity     quantity    # along with `product_id` (each qutt got its own records)
+
+    About `item_count` & `line_count`
+        Denormalized counters (sum of quantities & number of lines),
+        so `count()` & `is_empty()` don't need to query the lines at all.
+        Whoever changes the lines has to keep them right:
+        || `add_more`   F() increments  (e.g. `add_products`)
+        || `recount`    recompute from the lines (formset saves, merges, repairs)
     """
 
     OPEN = 10
@@ -205,34 +360,187 @@ class Basket(models.Model):
     )
     status = models.IntegerField(choices=STATUSES, default=OPEN)
 
+    item_count = models.PositiveIntegerField(default=0)
+    line_count = models.PositiveIntegerField(default=0)
+
+    objects = BasketQuerySet.as_manager()
+
     def is_empty(self):
-        return self.basketline_set.all().count() == 0
+        return self.line_count == 0
 
     def count(self):
-        return sum(i.quantity for i in self.basketline_set.all())
+        return self.item_count
+
+    def add_more(self, items, lines = 0):
+        """
+        Atomic increments, done by the database (no read-modify-write).
+        """
 
-    def create_order(self, billing_address, shipping_address):
+        Basket.objects.filter(pk=self.pk).update(
+            item_count=F("item_count") + items,
+            line_count=F("line_count") + lines,
+        )
+
+        self.item_count += items
+        self.line_count += lines
+
+    def add_products(self, quantities):
+        """
+        {product_id: quantity}, the products have to exist (checked by the caller).
+        """
+
+        with transaction.atomic():
+            new_lines = BasketLine.objects.add_products(self, quantities)
+            self.add_more(sum(quantities.values()), lines=new_lines)
+
+        return new_lines
+
+    def merge(self, other):
+        """
+        Move every line of the `other` basket into this one, then delete it.
+        The same product in both baskets ends up as ONE line (quantities summed).
+
+        It's a handful of statements, no matter how big the other basket is.
         """
-        #TODO break down this method
+
+        with transaction.atomic():
+            BasketLine.objects.copy_lines(other, self)
+            other.delete()
+
+            self.recount()
+
+    def recount(self):
+        Basket.objects.filter(pk=self.pk).recount()
+        self.refresh_from_db(fields=["item_count", "line_count"])
+
+    def create_order(self, billing_address, shipping_address,
+                     idempotency_key = None):
+        """
+        The checkout itself, broken down into three steps
+        || 1. `_order_data`     snapshot the addresses  ( -> 'Order' fields )
+        || 2. `_order_lines`    build every 'OrderLine' in memory (one query),
+        ||                      the prices included ( -> the order totals)
+        || 3. `bulk_create`     write all the lines with ONE insert
+
+        (+ the sales of the day, see 'DailyProductSales')
+
+        Everything runs inside `transaction.atomic()`,
+        including the basket status flip (OPEN -> SUBMITTED).
+        A crash halfway won't leave a partial order behind (all or nothing).
+
+        About the `select_for_update`
+            The basket row is locked first, so double-submits & parallel tabs
+            are queued up behind each other. Whoever comes second sees
+            the basket as SUBMITTED & simply gets the existing order back.
+
+        About the `idempotency_key`
+            A key already used by this user (e.g. the checkout form posted
+            again, from a NEW basket) gets that order back too,
+            this basket is left as it is (OPEN).
         """
 
         # Being logged in is required
-        if not self.user:
+        if not self.user_id:
             raise exceptions.BasketException(
                 "Cannot create order without user!"
             )
 
+        with transaction.atomic():
+            locked = Basket.objects.select_for_update().get(pk=self.pk)
+
+            if locked.status == Basket.SUBMITTED:
+                self.status = locked.status
+                return self._submitted_order()
+
+            if idempotency_key is not None:
+                order = Order.objects.filter(
+                    user_id=self.user_id, idempotency_key=idempotency_key
+                ).first()
+
+                if order is not None:
+                    logger.info(
+                        "Idempotency key already used, returning order id=%2d",
+                        order.id,
+                    )
+                    return order
+
+            logger.info(
+                "Creating order for basket_id=%2d"
+                ", shipping_address_id=%2d, billing_address_id=%2d",
+                self.id,
+                shipping_address.id,
+                billing_address.id,
+            )
+
+            order_lines = self._order_lines()
+            subtotal = sum(line.amount for line in order_lines)
+
+            # `bulk_create` skips the signals, so the counters are set here
+            order = Order.objects.create(
+                basket=self,
+                idempotency_key=idempotency_key,
+                outstanding_lines=len(order_lines),
+                subtotal=subtotal,
+                total=subtotal,
+                **self._order_data(billing_address, shipping_address)
+            )
+
+            for line in order_lines:
+                line.order = order
+
+            OrderLine.objects.bulk_create(order_lines)
+
+            # No signals either, the sales rollup ('DailyProductSales')
+            sales = { }
+
+            for line in order_lines:
+                units, revenue = sales.get(line.product_id, (0, 0))
+                sold, earned = OrderLine.sales(
+                    line.quantity, line.unit_price, line.status
+                )
+                sales[line.product_id] = (units + sold, revenue + earned)
+
+            DailyProductSales.objects.add_sales(order.added_on, sales)
+
+            # Checkout (Basket => Submitted)
+            self.status = Basket.SUBMITTED
+            self.save(update_fields=["status"])
+
+        logger.info(
+            "Created order with id=%2d and lines_count=%2d",
+            order.id,
+            len(order_lines),
+        )
+
+        return order
+
+    def _submitted_order(self):
+        """
+        The order created by an earlier checkout of this very basket.
+        """
+
+        try:
+            order = Order.objects.get(basket=self)
+        except Order.DoesNotExist:
+            raise exceptions.BasketException(
+                "Basket was submitted without an order!"
+            )
+
         logger.info(
-            "Creating order for basket_id=%2d"
-            ", shipping_address_id=%2d, billing_address_id=%2d",
+            "Basket id=%2d already checked out, returning order id=%2d",
             self.id,
-            shipping_address.id,
-            billing_address.id,
+            order.id,
         )
 
-        # Assigning values to the fields of 'Order' model
-        #   what I'm really interested is the latter, `VARIABLE.ATTRIBUTE`.
-        order_data = {
+        return order
+
+    def _order_data(self, billing_address, shipping_address):
+        """
+        Assigning values to the fields of 'Order' model
+          what I'm really interested is the latter, `VARIABLE.ATTRIBUTE`.
+        """
+
+        return {
             "user": self.user,
             "billing_name": billing_address.name,
             "billing_address1": billing_address.address1,
@@ -248,51 +556,101 @@ class Basket(models.Model):
             "shipping_country": shipping_address.country,
         }
 
-        # Nonetheless, the 'order' was created at this line
-        order = Order.objects.create(**order_data)
+    def _order_lines(self):
+        """
+        One 'OrderLine' per basket line, carrying the quantity
+        e.g. (=> 3 lines, 4 units)
+          2* prod-one
+          1* prod-two
+          1* prod-three
+
+        Only the `product_id` & the price are needed here,
+        so there's no need to load the 'Product' rows at all.
+        (the `order` is assigned by the caller, once it exists)
+        """
 
-        c = 0
+        lines = self.basketline_set \
+            .order_by("id") \
+            .values_list("product_id", "quantity", "product__price")
 
-        # All records of the `BasketLine' table
-        for line in self.basketline_set.all():
+        return [
+            OrderLine(
+                product_id=product_id,
+                quantity=quantity,
+                unit_price=price,
+            )
+            for product_id, quantity, price in lines
+        ]
 
-            for item in range(line.quantity):
 
-                # This line produces these
-                # || order   info : {user, billing_info, shipping_info}
-                # || product info : {product(id) -- looping outside by 'quantity'}
-                order_line_data = {
-                    "order": order,
-                    "product": line.product,
-                }
+class BasketLineQuerySet(models.QuerySet):
+    UPSERT_SQL = (
+        "INSERT INTO {table} (basket_id, product_id, quantity) {rows}"
+        " ON CONFLICT (basket_id, product_id) DO UPDATE"
+        " SET quantity = {table}.quantity + EXCLUDED.quantity"
+    )
 
-                # Creating `OrderLine` inst by {
-                #   essential-ones          product-name/id  (quantity: outside loop)
-                #   not-so-essential-ones   user, shipping/billing info
-                # }
-                order_line = OrderLine.objects.create(
-                    **order_line_data
-                )
+    def add_products(self, basket, quantities):
+        """
+        Add {product_id: quantity} to the basket with ONE statement (an upsert),
+        no matter how many products there are.
+        || new product          ->  INSERT
+        || already in basket    ->  quantity = quantity + N  (done by the DB)
 
-                # Produces total num
-                # e.g. (=> 4)
-                #   2* prod-one
-                #   1* prod-one
-                #   1* prod-one-another-basket
-                c += 1
+        The `ON CONFLICT` relies on the unique (basket, product) pair,
+        and it's understood by both PostgreSQL & SQLite (3.24+).
 
-        logger.info(
-            "Created order with id=%2d and lines_count=%2d",
-            order.id,
-            c,
+        Returns the number of NEW lines (for the basket counters).
+        """
+
+        product_ids = sorted(quantities)
+        rows = "VALUES " + ", ".join(["(%s, %s, %s)"] * len(product_ids))
+        params = [
+            value
+            for product_id in product_ids
+            for value in (basket.pk, product_id, quantities[product_id])
+        ]
+
+        if connection.vendor == "postgresql":
+            return self._upsert(rows, params, returning=True)
+
+        existing = self.filter(
+            basket=basket, product_id__in=product_ids
+        ).count()
+
+        self._upsert(rows, params)
+
+        return len(product_ids) - existing
+
+    def copy_lines(self, source, basket):
+        """
+        Same as `add_products`, but the rows come from another basket
+        (`INSERT .. SELECT`), so nothing is loaded into Python at all.
+        """
+
+        self._upsert(
+            "SELECT %s, product_id, quantity FROM {table} WHERE basket_id = %s",
+            [basket.pk, source.pk],
         )
 
-        # Checkout (Basket => Submitted)
-        self.status = Basket.SUBMITTED
+    def _upsert(self, rows, params, returning = False):
+        """
+        `returning` (PostgreSQL only) gives back how many rows were inserted,
+        `xmax = 0` is only true for the rows which didn't exist before.
+        """
+
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        sql = self.UPSERT_SQL.format(
+            table=table, rows=rows.format(table=table)
+        )
 
-        self.save()
+        with connection.cursor() as cursor:
+            if not returning:
+                cursor.execute(sql, params)
+                return None
 
-        return order
+            cursor.execute(sql + " RETURNING (xmax = 0)", params)
+            return sum(inserted for inserted, in cursor.fetchall())
 
 
 class BasketLine(models.Model):
@@ -304,6 +662,114 @@ class BasketLine(models.Model):
         validators=[MinValueValidator(1)]
     )
 
+    objects = BasketLineQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ("basket", "product")
+
+
+class OrderQuerySet(models.QuerySet):
+    def recount(self):
+        """
+        Recompute `outstanding_lines` (lines NOT sent/cancelled yet),
+        the `subtotal` & the `total`
+        for every order in the queryset with ONE `UPDATE` statement.
+        """
+
+        lines = OrderLine.objects \
+            .filter(order=OuterRef("pk")) \
+            .order_by() \
+            .values("order")
+        outstanding = lines \
+            .filter(status__lt=OrderLine.SENT) \
+            .annotate(c=Count("id")) \
+            .values("c")
+
+        def amount(lines):
+            return Coalesce(
+                Subquery(
+                    lines
+                        .annotate(s=Sum(
+                            F("quantity") * F("unit_price"),
+                            output_field=models.DecimalField(),
+                        ))
+                        .values("s"),
+                    output_field=models.DecimalField(),
+                ),
+                Value(0),
+            )
+
+        return self.update(
+            outstanding_lines=Coalesce(Subquery(outstanding), 0),
+            subtotal=amount(lines),
+            total=amount(lines.exclude(status=OrderLine.CANCELLED)),
+        )
+
+    def add_amounts(self, subtotal, total):
+        """
+        Atomic increments, the same as `add_outstanding`.
+        """
+
+        return self.update(
+            subtotal=F("subtotal") + subtotal,
+            total=F("total") + total,
+            date_updated=Now(),
+        )
+
+    def add_outstanding(self, delta):
+        """
+        Atomic increments (no read-modify-write of the whole 'Order' row).
+        A counter which is already zero is never pushed below it.
+        """
+
+        if delta < 0:
+            self = self.filter(outstanding_lines__gte=-delta)
+
+        return self.update(
+            outstanding_lines=F("outstanding_lines") + delta,
+            date_updated=Now(),
+        )
+
+    def mark_done_if_finished(self):
+        """
+        Only the orders having NO outstanding lines left are flipped to DONE.
+        Returns how many were flipped.
+
+        An `UPDATE` sends no signal, so the daily rollup ('DailyOrderStat')
+        is moved along here, the orders are locked first
+        (their status can't change between the two).
+        """
+
+        finished = self \
+            .filter(outstanding_lines=0) \
+            .exclude(status=Order.DONE)
+
+        with transaction.atomic():
+            orders = list(
+                finished
+                    .select_for_update()
+                    .only("id", *Order.ROLLUP_FIELDS)
+                    .order_by("id")
+            )
+
+            if not orders:
+                return 0
+
+            flipped = Order.objects \
+                .filter(pk__in=[order.pk for order in orders]) \
+                .update(status=Order.DONE, date_updated=Now())
+
+            changes = Counter()
+
+            for order in orders:
+                changes[order.rollup_key()] -= 1
+                order.status = Order.DONE
+                changes[order.rollup_key()] += 1
+
+            DailyOrderStat.objects.add(changes)
+
+        return flipped
+
 
 class Order(models.Model):
     """
@@ -342,7 +808,8 @@ class Order(models.Model):
 
     # -------------------- Part Three ---------- ----------
 
-    date_updated = models.DateTimeField(auto_now=True)
+    # Indexed, the watermark of 'main/analytics.py'
+    date_updated = models.DateTimeField(auto_now=True, db_index=True)
     date_added = models.DateTimeField(auto_now_add=True)
 
     # -------------------- Part Four ---------- ----------
@@ -354,6 +821,115 @@ class Order(models.Model):
         on_delete=models.SET_NULL,
     )
 
+    # -------------------- Part Five ---------- ----------
+
+    # Which basket was checked out (at most ONE order per basket)
+    basket = models.OneToOneField(
+        Basket,
+        null=True,
+        blank=True,
+        related_name="order",
+        on_delete=models.SET_NULL,
+    )
+
+    # Sent along with the checkout form, the same key (of the same user)
+    # = the same order, see `Meta`
+    idempotency_key = models.UUIDField(null=True, blank=True, editable=False)
+
+    # -------------------- Part Six ---------- ----------
+
+    # Lines still NEW/PROCESSING, the order is DONE once it drops to zero
+    outstanding_lines = models.PositiveIntegerField(default=0, editable=False)
+
+    # Sum of the lines (quantity * unit_price), the cancelled ones
+    # are left out of the `total`, kept up to date like the counter above
+    subtotal = models.DecimalField(
+        max_digits=10, decimal_places=2, default=0, editable=False
+    )
+    total = models.DecimalField(
+        max_digits=10, decimal_places=2, default=0, editable=False
+    )
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        # Looked up per user (`Basket.create_order`), two users sending
+        # the same key get two orders, the NULLs (no key) never clash
+        unique_together = ("user", "idempotency_key")
+
+    # What the daily rollup ('DailyOrderStat') is keyed by
+    ROLLUP_FIELDS = ("date_added", "status", "shipping_country")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remember where the order is counted in the daily rollup,
+        so the signals can move it when the status (or country) changes.
+        """
+
+        instance = super().from_db(db, field_names, values)
+
+        if all(name in field_names for name in cls.ROLLUP_FIELDS):
+            instance._loaded_rollup_key = instance.rollup_key()
+
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        """
+        The values copied over don't go through `from_db`.
+        """
+
+        super().refresh_from_db(using=using, fields=fields)
+
+        deferred = self.get_deferred_fields()
+
+        if not any(name in deferred for name in self.ROLLUP_FIELDS):
+            self._loaded_rollup_key = self.rollup_key()
+
+    def save(self, *args, **kwargs):
+        """
+        About the lock
+            Same as 'OrderLine.save', the stored row is locked & its rollup
+            key read again first, a stale instance (another request moved
+            the order meanwhile) would move it from where it no longer is.
+        """
+
+        if self._state.adding or self.pk is None:
+            return super().save(*args, **kwargs)
+
+        with transaction.atomic():
+            stored = Order.objects \
+                .select_for_update() \
+                .filter(pk=self.pk) \
+                .only(*self.ROLLUP_FIELDS) \
+                .first()
+
+            if stored is not None:
+                self._loaded_rollup_key = stored._loaded_rollup_key
+
+            return super().save(*args, **kwargs)
+
+    @property
+    def added_on(self):
+        """
+        The day it was added, in the current time zone (same as `TruncDate`),
+        a naive datetime is taken as in it already (like Django does).
+        """
+
+        date_added = self.date_added
+
+        if timezone.is_naive(date_added):
+            date_added = timezone.make_aware(date_added)
+
+        return timezone.localdate(date_added)
+
+    def rollup_key(self):
+        """
+        -> (day, status, shipping_country)
+        """
+
+        return (self.added_on, self.status, self.shipping_country)
+
     def __str__(self):
         return "[Order] #" + repr(self.id)
 
@@ -366,6 +942,10 @@ class OrderLine(models.Model):
             || NEW  --  order.lines.all()
         Explanation
             1. We're doing "reverse related obj lookup" (which produces 'orderline').
+
+    About `quantity`
+        One row per product (NOT one row per unit bought),
+        so reports have to `Sum("quantity")` instead of counting the rows.
     """
 
     NEW = 10
@@ -385,8 +965,360 @@ class OrderLine(models.Model):
         Product,
         on_delete=models.PROTECT
     )
+    quantity = models.PositiveIntegerField(
+        default=1,
+        validators=[MinValueValidator(1)]
+    )
+
+    # The price of the product when it was ordered (a snapshot),
+    # NULL only for the lines written in bulk without it
+    unit_price = models.DecimalField(
+        max_digits=6, decimal_places=2, null=True, blank=True
+    )
 
     status = models.IntegerField(choices=STATUSES, default=NEW)
 
+    # Same as the order's, a line may change on its own (e.g. its status)
+    date_updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    @classmethod
+    def amounts(cls, quantity, unit_price, status):
+        """
+        -> (its part of the order subtotal, of the order total)
+        A cancelled line isn't paid for.
+        """
+
+        amount = quantity * (unit_price or 0)
+
+        return amount, (0 if status == cls.CANCELLED else amount)
+
+    @classmethod
+    def sales(cls, quantity, unit_price, status):
+        """
+        -> (units, revenue) it adds to the sales rollup ('DailyProductSales'),
+        from the `total` side, a cancelled line sold nothing at all.
+        """
+
+        total = cls.amounts(quantity, unit_price, status)[1]
+
+        return (0 if status == cls.CANCELLED else quantity), total
+
+    @property
+    def amount(self):
+        return self.amounts(self.quantity, self.unit_price, self.status)[0]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remember the status (& the quantity, the price, the product) as loaded,
+        so the signals can tell whether a save really changed it.
+        """
+
+        instance = super().from_db(db, field_names, values)
+
+        if "status" in field_names:
+            instance._loaded_status = values[field_names.index("status")]
+
+        if "quantity" in field_names:
+            instance._loaded_quantity = values[field_names.index("quantity")]
+
+        if "unit_price" in field_names:
+            instance._loaded_unit_price = \
+                values[field_names.index("unit_price")]
+
+        if "product_id" in field_names:
+            instance._loaded_product_id = \
+                values[field_names.index("product_id")]
+
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        About the lock
+            The loaded values may be stale (another request saved the line
+            meanwhile), so the stored row is locked (`SELECT .. FOR UPDATE`)
+            & read again first, the signals run in the same transaction.
+            || two concurrent NEW -> SENT saves of the same line
+            || -> the second one waits, then sees SENT (nothing to count)
+        """
+
+        if self._state.adding or self.pk is None:
+            return super().save(*args, **kwargs)
+
+        with transaction.atomic():
+            stored = OrderLine.objects \
+                .select_for_update() \
+                .filter(pk=self.pk) \
+                .values_list("status", "quantity", "unit_price", "product") \
+                .first()
+
+            if stored is not None:
+                (
+                    self._loaded_status,
+                    self._loaded_quantity,
+                    self._loaded_unit_price,
+                    self._loaded_product_id,
+                ) = stored
+
+            return super().save(*args, **kwargs)
+
+    @classmethod
+    def is_outstanding(cls, status):
+        return status < cls.SENT
+
+    def __str__(self):
+        return "[OrderLine] #" + repr(self.id)
+
+
+class RollupQuerySet(models.QuerySet):
+    """
+    A rollup table, the `KEY` columns (unique together) -> the `COUNTERS`,
+    which are only ever added to, with ONE statement (an upsert)
+    like 'BasketLine' (a missing row is inserted).
+    """
+
+    KEY = ()
+    COUNTERS = ()
+
+    UPSERT_SQL = (
+        "INSERT INTO {table} ({columns}) {rows}"
+        " ON CONFLICT ({key}) DO UPDATE SET {counters}"
+    )
+
+    def between(self, source, date_field, first=None, last=None):
+        """
+        The `source` rows (by their `date_field`) & the rollup rows (by day)
+        from `first` to `last`, both included, to rebuild those days.
+        """
+
+        def start_of(day):
+            return timezone.make_aware(datetime.combine(day, time.min))
+
+        rollup = self.all()
+
+        if first is not None:
+            source = source.filter(**{
+                date_field + "__gte": start_of(first)
+            })
+            rollup = rollup.filter(day__gte=first)
+
+        if last is not None:
+            source = source.filter(**{
+                date_field + "__lt": start_of(last + timedelta(days=1))
+            })
+            rollup = rollup.filter(day__lte=last)
+
+        return source, rollup
+
+    def add(self, changes):
+        """
+        { key: delta } -- a key is a tuple of the `KEY` values,
+        a delta is a number (ONE counter) or a tuple (all of them).
+        """
+
+        changes = {
+            key: delta if isinstance(delta, tuple) else (delta,)
+            for key, delta in changes.items()
+        }
+        keys = sorted(key for key, delta in changes.items() if any(delta))
+
+        if not keys:
+            return
+
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        columns = self.KEY + self.COUNTERS
+        fields = [self.model._meta.get_field(name) for name in columns]
+
+        sql = self.UPSERT_SQL.format(
+            table=table,
+            columns=", ".join(quote(field.column) for field in fields),
+            rows="VALUES " + ", ".join(
+                ["(%s)" % ", ".join(["%s"] * len(columns))] * len(keys)
+            ),
+            key=", ".join(
+                quote(field.column) for field in fields[:len(self.KEY)]
+            ),
+            counters=", ".join(
+                "{column} = {table}.{column} + EXCLUDED.{column}".format(
+                    table=table, column=quote(field.column)
+                )
+                for field in fields[len(self.KEY):]
+            ),
+        )
+        params = [
+            field.get_db_prep_save(value, connection)
+            for key in keys
+            for field, value in zip(fields, key + changes[key])
+        ]
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+class DailyOrderStatQuerySet(RollupQuerySet):
+    KEY = ("day", "status", "shipping_country")
+    COUNTERS = ("orders",)
+
+    def rebuild(self, first=None, last=None):
+        """
+        Recount the days from `first` to `last` (both included,
+        every day by default) from the 'Order' rows of those days only.
+        -> the number of rollup rows written
+        """
+
+        orders, stats = self.between(
+            Order.objects.order_by(), "date_added", first, last
+        )
+        rows = orders \
+            .annotate(day=TruncDate("date_added")) \
+            .values("day", "status", "shipping_country") \
+            .annotate(c=Count("id"))
+
+        with transaction.atomic():
+            stats.delete()
+            created = self.bulk_create([
+                self.model(
+                    day=row["day"],
+                    status=row["status"],
+                    shipping_country=row["shipping_country"],
+                    orders=row["c"],
+                )
+                for row in rows
+            ])
+
+        return len(created)
+
+
+class DailyOrderStat(models.Model):
+    """
+    The orders per (day, status, shipping country), a rollup of 'Order'
+    kept up to date by the signals, so the reports read a few rows
+    per day instead of every order ('main/reports.py').
+    || a new order             -> +1
+    || a new status / country  -> -1 (where it was), +1 (where it is)
+    || a deleted order         -> -1
+
+    Q & A
+        What about `bulk_create` / `update` (no signals)?
+        || `OrderQuerySet.mark_done_if_finished` moves the rows itself,
+        || anything else -> `./manage.py rollup_orders` recounts them.
+        Why an `IntegerField` (not a positive one)?
+        || a -1 must never break a save, even for an order never counted.
+    """
+
+    day = models.DateField()
+    status = models.IntegerField(choices=Order.STATUSES)
+    shipping_country = models.CharField(max_length=3)
+    orders = models.IntegerField(default=0)
+
+    objects = DailyOrderStatQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ("day", "status", "shipping_country")
+
+    def __str__(self):
+        return "%s %s %s: %d" % (
+            self.day, self.get_status_display(), self.shipping_country,
+            self.orders,
+        )
+
+
+class DailyProductSalesQuerySet(RollupQuerySet):
+    KEY = ("day", "product")
+    COUNTERS = ("units", "revenue")
+
+    def add_sales(self, day, sales):
+        """
+        { product_id: (units, revenue) } sold on `day`
+        (negative -> taken back).
+        """
+
+        self.add({
+            (day, product_id): delta for product_id, delta in sales.items()
+        })
+
+    def rebuild(self, first=None, last=None):
+        """
+        Same as `DailyOrderStatQuerySet.rebuild`, from 'OrderLine'
+        (the cancelled lines left out, see `OrderLine.sales`).
+        """
+
+        lines, sales = self.between(
+            OrderLine.objects.exclude(status=OrderLine.CANCELLED).order_by(),
+            "order__date_added",
+            first,
+            last,
+        )
+        rows = lines \
+            .annotate(day=TruncDate("order__date_added")) \
+            .values("day", "product") \
+            .annotate(
+                units=Sum("quantity"),
+                revenue=Coalesce(
+                    Sum(
+                        F("quantity") * F("unit_price"),
+                        output_field=models.DecimalField(),
+                    ),
+                    Value(0),
+                ),
+            )
+
+        with transaction.atomic():
+            sales.delete()
+            created = self.bulk_create([
+                self.model(
+                    day=row["day"],
+                    product_id=row["product"],
+                    units=row["units"],
+                    revenue=row["revenue"],
+                )
+                for row in rows
+            ])
+
+        return len(created)
+
+    def top(self, first, last, limit=10, by="units"):
+        """
+        The best selling products from `first` to `last` (both included),
+        the most first (`by` "units" or "revenue").
+        >> DailyProductSales.objects.top(date(2019, 1, 1), date.today(), 5)
+        [{ "product": 3, "product__name": "..", "units": 12,
+           "revenue": Decimal("120.00") }, ..]
+
+        A few rows per product & day, whatever the number of orders.
+        """
+
+        return list(
+            self
+                .filter(day__gte=first, day__lte=last)
+                .values("product", "product__name")
+                .annotate(units=Sum("units"), revenue=Sum("revenue"))
+                .filter(units__gt=0)
+                .order_by("-" + by, "product__name")[:limit]
+        )
+
+
+class DailyProductSales(models.Model):
+    """
+    The units & revenue per (day, product), a rollup of 'OrderLine'
+    || the checkout                -> `add_sales` (`bulk_create`, no signals)
+    || a line saved on its own     -> the signals (admin, API ..)
+    || anything else               -> `./manage.py rollup_orders`
+
+    The revenue is at the price of the line ('OrderLine.unit_price').
+    """
+
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    objects = DailyProductSalesQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ("day", "product")
+        verbose_name_plural = "daily product sales"
+
     def __str__(self):
-        return "[OrderLine] #" + repr(self.id)
\ No newline at end of file
+        return "%s %s: %d" % (self.day, self.product_id, self.units)
@@ -0,0 +1,183 @@
+import json
+import base64
+import binascii
+
+from django.db import models
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+# What the database takes for an integer (a `bigint`)
+INTEGER_RANGE = range(-2 ** 63, 2 ** 63)
+
+
+def encode_cursor(direction, row, ordering):
+    """
+    About the "cursor"
+        It's simply the sort key of the row to seek from (+ the direction),
+        encoded so that nobody relies on what's inside.
+        >> encode_cursor("next", product, ("name", "id"))
+        'WyJuZXh0IiwgWyJUaGUgYm9vayIsIDQyXV0'
+    """
+
+    values = [getattr(row, field) for field in ordering]
+    raw = json.dumps([direction, values]).encode()
+
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def cursor_types(model, ordering):
+    """
+    The JSON type each value of the cursor must have
+    >> cursor_types(Product, ("name", "id"))
+    (str, int)
+    """
+
+    integers = (models.AutoField, models.IntegerField)
+
+    return tuple(
+        int if isinstance(model._meta.get_field(field), integers) else str
+        for field in ordering
+    )
+
+
+def decode_cursor(cursor, types):
+    """
+    Anything but the values `encode_cursor` would write -> `InvalidCursor`
+    (the cursor comes from the query string, it's never trusted).
+    """
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        direction, values = json.loads(raw.decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+    if direction not in ("next", "previous") \
+            or not isinstance(values, list) \
+            or len(values) != len(types):
+        raise InvalidCursor(cursor)
+
+    # `type(..) is`, a `bool` is an `int` for `isinstance`
+    for value, expected in zip(values, types):
+        if type(value) is not expected:
+            raise InvalidCursor(cursor)
+
+        # Or the database itself fails (an `OverflowError`, a NUL on PostgreSQL)
+        if expected is int and value not in INTEGER_RANGE:
+            raise InvalidCursor(cursor)
+
+        if expected is str and "\x00" in value:
+            raise InvalidCursor(cursor)
+
+    return direction, values
+
+
+def seek(ordering, values, direction):
+    """
+    The "row value" comparison, written with `Q` objects
+    (e.g. ordering=("name", "id"), direction="next")
+    >> name >= 'x' AND (name > 'x' OR (name = 'x' AND id > 7))
+
+    The leading `name >= 'x'` is redundant,
+    but that's what lets the database seek with the (name, id) index
+    instead of filtering every row.
+    """
+
+    lookup = "gt" if direction == "next" else "lt"
+    condition = Q()
+
+    for i, field in enumerate(ordering):
+        equal = {f: v for f, v in zip(ordering[:i], values[:i])}
+        condition |= Q(**equal, **{"%s__%s" % (field, lookup): values[i]})
+
+    bound = Q(**{"%s__%se" % (ordering[0], lookup): values[0]})
+
+    return bound & condition
+
+
+class KeysetPage:
+    """
+    Quacks like a `Page` (`object_list`, `has_next` ..),
+    except there's NO page number & NO total count at all.
+    """
+
+    def __init__(self, object_list, has_next, has_previous, ordering):
+        self.object_list = object_list
+        self.ordering = ordering
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def next_cursor(self):
+        if self.has_next() and self.object_list:
+            return encode_cursor("next", self.object_list[-1], self.ordering)
+
+    def previous_cursor(self):
+        if self.has_previous() and self.object_list:
+            return encode_cursor(
+                "previous", self.object_list[0], self.ordering
+            )
+
+
+def paginate_keyset(queryset, cursor, per_page, ordering=("name", "id")):
+    """
+    Keyset (or "seek") pagination
+    || OFFSET   -> the database still walks through every skipped row
+    || keyset   -> `WHERE (name, id) > (..)  ORDER BY name, id  LIMIT ..`
+    ||             same cost for page 1 & page 10,000 (with an index)
+
+    The `ordering` must be unique (hence the `id` at the end).
+    ONE query per page, one extra row tells whether there's more.
+
+    About an empty page
+        The rows around the cursor may be gone since (deactivated ..),
+        nothing to seek from anymore -> the first page instead (one more query).
+    """
+
+    first_page = queryset
+
+    if cursor:
+        direction, values = decode_cursor(
+            cursor, cursor_types(queryset.model, ordering)
+        )
+    else:
+        direction, values = "next", None
+
+    if direction == "previous":
+        queryset = queryset.order_by(*("-" + field for field in ordering))
+    else:
+        queryset = queryset.order_by(*ordering)
+
+    if values is not None:
+        queryset = queryset.filter(seek(ordering, values, direction))
+
+    rows = list(queryset[:per_page + 1])
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if not rows and cursor:
+        return paginate_keyset(first_page, None, per_page, ordering)
+
+    if direction == "previous":
+        rows.reverse()
+        return KeysetPage(rows, bool(cursor), more, ordering)
+
+    return KeysetPage(rows, more, bool(cursor), ordering)
@@ -0,0 +1,133 @@
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# ********************-----**********************
+# ************** Image renditions ***************
+# ********************-----**********************
+
+# || several widths      -> the browser picks one (`srcset`)
+# || WebP + JPEG         -> WebP where it's supported (`<picture>`)
+# || the 300x300 JPEG    -> the `thumbnail` of the gallery, as before
+#
+# Runs in a worker PROCESS (see 'main/thumbnails.py'),
+# so it only deals with bytes, no Django at all.
+
+WIDTHS = (320, 640, 1280)
+THUMBNAIL_SIZE = (300, 300)
+
+JPEG = "jpeg"
+WEBP = "webp"
+
+# The EXIF tag, its values 5-8 mean a quarter turn (width <-> height)
+ORIENTATION = 0x0112
+QUARTER_TURNS = (5, 6, 7, 8)
+
+# No `exif` / `icc_profile` passed -> Pillow writes no metadata at all
+SAVE_OPTIONS = {
+    JPEG: { "format": "JPEG", "quality": 82, "optimize": True,
+            "progressive": True },
+    WEBP: { "format": "WEBP", "quality": 80, "method": 4 },
+}
+
+
+def target_widths(width, widths=WIDTHS):
+    """
+    Never upscaled, a small image gets ONE rendition (its own width).
+    >> target_widths(1000)
+    [640, 320]
+    >> target_widths(200)
+    [200]
+    """
+
+    return sorted({ min(w, width) for w in widths }, reverse=True)
+
+
+def displayed_size(image):
+    """
+    (width, height) as shown, once the EXIF orientation is applied
+    (a phone photo is often stored sideways, with orientation 6).
+    """
+
+    if image.getexif().get(ORIENTATION) in QUARTER_TURNS:
+        return image.height, image.width
+
+    return image.size
+
+
+def open_reduced(data, width):
+    """
+    Decode no more pixels than the largest rendition needs.
+    || JPEG      `draft`   the decoder itself scales by 1/2, 1/4 or 1/8
+    ||                     (a 6000px upload is never decoded in full)
+    || others    `reduce`  a cheap box reduction right after decoding
+    || then      `exif_transpose`  upright, the metadata is dropped later
+    ||                             (see `SAVE_OPTIONS`), the orientation too
+
+    `width` is the width as shown (the stored one for a quarter turn).
+    """
+
+    image = Image.open(BytesIO(data))
+    shown_width, shown_height = displayed_size(image)
+    height = max(1, shown_height * width // shown_width)
+
+    # The stored image is still sideways (if it is)
+    size = (width, height)
+    if image.size != (shown_width, shown_height):
+        size = (height, width)
+
+    image.draft("RGB", size)
+
+    factor = image.width // size[0]
+    if factor >= 2:
+        image = image.reduce(factor)
+
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    return image
+
+
+def encode(image, kind):
+    output = BytesIO()
+    image.save(output, **SAVE_OPTIONS[kind])
+
+    return output.getvalue()
+
+
+def render(data, widths=WIDTHS):
+    """
+    bytes (the uploaded image) ->
+    >> {
+    >>     "thumbnail": b"..",
+    >>     "renditions": [(1280, "jpeg", b".."), (1280, "webp", b".."), ..],
+    >> }
+
+    Every width is resized from the previous (larger) one,
+    so there's only ever ONE reduced copy of the image in memory.
+    """
+
+    with Image.open(BytesIO(data)) as probe:
+        original_width = displayed_size(probe)[0]
+
+    targets = target_widths(original_width, widths)
+    image = open_reduced(data, targets[0])
+    renditions = []
+
+    for width in targets:
+        height = max(1, image.height * width // image.width)
+
+        if image.width != width:
+            image = image.resize((width, height), Image.LANCZOS)
+
+        renditions.append((width, JPEG, encode(image, JPEG)))
+        renditions.append((width, WEBP, encode(image, WEBP)))
+
+    image.thumbnail(THUMBNAIL_SIZE)
+
+    output = BytesIO()
+    image.save(output, "JPEG")
+
+    return { "thumbnail": output.getvalue(), "renditions": renditions }
@@ -0,0 +1,169 @@
+from datetime import timedelta
+from collections import Counter, defaultdict
+
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import models
+
+# ********************-----**********************
+# ******************* Reports *******************
+# ********************-----**********************
+
+# || read from the rollups ('DailyOrderStat'), never from 'Order' itself
+# || so the cost depends on the days shown, not on the number of orders
+
+
+def orders_per_day(days=180, last=None):
+    """
+    The orders of the `days` days up to `last` (today by default),
+    per day, status & shipping country, ONE query (a few rows per day).
+    >> {
+    >>     "labels": ["2026-10-01", "2026-10-03", ..],    # days with orders
+    >>     "values": [12, 4, ..],                         # all the statuses
+    >>     "by_status": [("New", [2, 1, ..]), ("Paid", [..]), ("Done", [..])],
+    >>     "by_country": [("uk", 10), ("fr", 6), ..],     # the most first
+    >> }
+    """
+
+    if last is None:
+        last = timezone.localdate()
+
+    since = last - timedelta(days=days)
+    rows = models.DailyOrderStat.objects \
+        .filter(day__gt=since, day__lte=last) \
+        .values_list("day", "status", "shipping_country", "orders")
+
+    per_day = defaultdict(Counter)
+    by_country = Counter()
+
+    for day, status, country, orders in rows:
+        per_day[day][status] += orders
+        by_country[country] += orders
+
+    days = sorted(
+        day for day, statuses in per_day.items() if sum(statuses.values())
+    )
+
+    return {
+        "labels": [day.strftime("%Y-%m-%d") for day in days],
+        "values": [sum(per_day[day].values()) for day in days],
+        "by_status": [
+            (name, [per_day[day][status] for day in days])
+            for status, name in models.Order.STATUSES
+        ],
+        "by_country": sorted(
+            [(country, orders) for country, orders in by_country.items()
+             if orders],
+            key=lambda item: (-item[1], item[0]),
+        ),
+    }
+
+
+def most_bought_products(first, last, limit=10):
+    """
+    The top `limit` products from `first` to `last` (both included),
+    the most units first, from the sales rollup ('DailyProductSales').
+    >> {
+    >>     "labels": ["A", "B", ..],
+    >>     "values": [6, 3, ..],                          # units
+    >>     "revenues": [60.0, 15.0, ..],
+    >>     "rows": [("A", 6, Decimal("60.00")), ..],     # for a table
+    >> }
+    """
+
+    top = models.DailyProductSales.objects.top(first, last, limit)
+
+    return {
+        "labels": [row["product__name"] for row in top],
+        "values": [row["units"] for row in top],
+        "revenues": [float(row["revenue"]) for row in top],
+        "rows": [
+            (row["product__name"], row["units"], row["revenue"])
+            for row in top
+        ],
+    }
+
+
+def revenue_per_day(first, last):
+    """
+    The revenue from `first` to `last` (both included), per day,
+    from the sales rollup ('DailyProductSales', at the line prices)
+    -> a `GROUP BY` over a few rows per day, never over the lines.
+    >> {
+    >>     "labels": ["2026-10-01", "2026-10-03", ..],    # days with sales
+    >>     "values": [120.0, 15.5, ..],
+    >>     "total": Decimal("135.50"),
+    >> }
+    """
+
+    rows = models.DailyProductSales.objects \
+        .filter(day__gte=first, day__lte=last) \
+        .values("day") \
+        .annotate(revenue=Sum("revenue")) \
+        .filter(revenue__gt=0) \
+        .order_by("day") \
+        .values_list("day", "revenue")
+
+    rows = list(rows)
+
+    return {
+        "labels": [day.strftime("%Y-%m-%d") for day, revenue in rows],
+        "values": [float(revenue) for day, revenue in rows],
+        "total": sum(revenue for day, revenue in rows),
+    }
+
+
+def sales_breakdown(first, last, by="country", value="amount",
+                    statuses=None, limit=20):
+    """
+    Any slice of the order lines from `first` to `last` (both included),
+    answered by the columnar facts ('main/analytics.py'), NOT by a rollup
+    -> a new slice is a new form choice, not a new `GROUP BY` on the db.
+    || by        "country", "product", "status" or "day"
+    || value     "quantity" (units), "amount" (revenue) or "lines"
+    || statuses  only the lines in those statuses (all of them if empty)
+    The top `limit` groups first (by day, every day in order).
+    >> {
+    >>     "labels": ["uk", "fr", ..],
+    >>     "values": [120.5, 31.0, ..],
+    >>     "rows": [("uk", Decimal("120.50")), ..],   # for a table
+    >> }
+    """
+
+    # NumPy, only in the processes showing this report
+    from . import analytics
+
+    filters = { "first": first, "last": last }
+    if statuses:
+        filters["status"] = list(statuses)
+
+    if by == "day":
+        groups = sorted(
+            analytics.facts.group_by("day", value, **filters).items()
+        )
+    else:
+        groups = analytics.facts.top(by, value, limit=limit, **filters)
+
+    if by == "product":
+        names = dict(
+            models.Product.objects
+                .filter(pk__in=[key for key, total in groups])
+                .values_list("pk", "name")
+        )
+        labels = [names.get(key, "#%d" % key) for key, total in groups]
+    elif by == "status":
+        names = dict(models.OrderLine.STATUSES)
+        labels = [names.get(key, key) for key, total in groups]
+    elif by == "day":
+        labels = [key.strftime("%Y-%m-%d") for key, total in groups]
+    else:
+        labels = [key for key, total in groups]
+
+    totals = [total for key, total in groups]
+
+    return {
+        "labels": labels,
+        "values": [float(total) for total in totals],
+        "rows": list(zip(labels, totals)),
+    }
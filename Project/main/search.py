@@ -0,0 +1,191 @@
+import re
+
+from django.db import connection
+from django.db.models import F, Q
+from django.contrib.postgres.search import SearchQuery, SearchRank
+
+# ********************-----**********************
+# *************** Product search ****************
+# ********************-----**********************
+
+# || PostgreSQL  `main_product.search_vector` (tsvector) + a GIN index
+# || SQLite      `main_product_fts`, an FTS5 table (rowid = product id)
+# || others      `icontains` on the name (no index, local use only)
+#
+# Both are written by the signals ('main/signals.py') through `index_products`,
+# the weights being: name > tag names > description.
+
+CONFIG = "english"
+FTS_TABLE = "main_product_fts"
+
+# The tag names of a product, as one string
+TAG_NAMES_SQL = """
+    SELECT {agg}
+      FROM main_producttag t
+      JOIN main_product_tags pt ON pt.producttag_id = t.id
+     WHERE pt.product_id = p.id
+"""
+
+PG_INDEX_SQL = """
+    UPDATE main_product p
+       SET search_vector =
+           setweight(to_tsvector('{config}', p.name), 'A') ||
+           setweight(to_tsvector('{config}', coalesce(({tags}), '')), 'B') ||
+           setweight(to_tsvector('{config}', p.description), 'C')
+"""
+
+FTS_INDEX_SQL = """
+    INSERT INTO {fts} (rowid, name, tags, description)
+    SELECT p.id, p.name, coalesce(({tags}), ''), p.description
+      FROM main_product p
+"""
+
+
+def create_index(schema_editor):
+    """
+    Called by the migrations, it depends on the database.
+    """
+
+    vendor = schema_editor.connection.vendor
+
+    if vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE INDEX main_product_search_gin "
+            "ON main_product USING gin (search_vector)"
+        )
+    elif vendor == "sqlite":
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE %s USING fts5(name, tags, description)"
+            % FTS_TABLE
+        )
+
+
+def drop_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS main_product_search_gin")
+    elif vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS %s" % FTS_TABLE)
+
+
+def index_products(product_ids=None):
+    """
+    (Re)compute the search data of some products (all of them with `None`),
+    with ONE statement on PostgreSQL, two on SQLite (delete + insert).
+    """
+
+    if product_ids is not None:
+        product_ids = list(product_ids)
+
+        if not product_ids:
+            return
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            sql = PG_INDEX_SQL.format(
+                config=CONFIG,
+                tags=TAG_NAMES_SQL.format(agg="string_agg(t.name, ' ')"),
+            )
+
+            if product_ids is None:
+                cursor.execute(sql)
+            else:
+                cursor.execute(sql + " WHERE p.id = ANY(%s)", [product_ids])
+
+        elif connection.vendor == "sqlite":
+            sql = FTS_INDEX_SQL.format(
+                fts=FTS_TABLE,
+                tags=TAG_NAMES_SQL.format(agg="group_concat(t.name, ' ')"),
+            )
+
+            if product_ids is None:
+                cursor.execute("DELETE FROM %s" % FTS_TABLE)
+                cursor.execute(sql)
+            else:
+                marks = ", ".join(["%s"] * len(product_ids))
+                cursor.execute(
+                    "DELETE FROM %s WHERE rowid IN (%s)" % (FTS_TABLE, marks),
+                    product_ids,
+                )
+                cursor.execute(
+                    sql + " WHERE p.id IN (%s)" % marks, product_ids
+                )
+
+
+def unindex_products(product_ids):
+    """
+    Only the FTS5 table needs it, the tsvector goes away with its row.
+    """
+
+    product_ids = list(product_ids)
+
+    if connection.vendor == "sqlite" and product_ids:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM %s WHERE rowid IN (%s)"
+                % (FTS_TABLE, ", ".join(["%s"] * len(product_ids))),
+                product_ids,
+            )
+
+
+def fts_query(terms):
+    """
+    Every word is quoted, so the FTS5 syntax (AND, NEAR, *, ..)
+    typed by the user is searched as plain words.
+    >> fts_query('django "2" NEAR')
+    '"django" "2" "near"'
+    """
+
+    words = re.findall(r"\w+", terms.lower())
+
+    return " ".join('"%s"' % word for word in words)
+
+
+def search_products(queryset, terms):
+    """
+    The products of `queryset` matching EVERY word of `terms`,
+    annotated with `rank` & ordered by relevance (the best first).
+
+    Usage
+    >> search_products(Product.objects.active(), "django channels")
+    """
+
+    if connection.vendor == "postgresql":
+        query = SearchQuery(terms, config=CONFIG)
+
+        return queryset \
+            .filter(search_vector=query) \
+            .annotate(rank=SearchRank(F("search_vector"), query)) \
+            .order_by("-rank", "name", "id")
+
+    if connection.vendor == "sqlite":
+        match = fts_query(terms)
+
+        if not match:
+            return queryset.none()
+
+        # A join on the FTS5 table (`extra`, the ORM can't express it),
+        # SQLite doesn't cope with the same MATCH in several subqueries.
+        # `bm25` is "the lower, the better", the weights follow the columns
+        return queryset \
+            .extra(
+                tables=[FTS_TABLE],
+                where=[
+                    "{fts}.rowid = main_product.id".format(fts=FTS_TABLE),
+                    "{fts} MATCH %s".format(fts=FTS_TABLE),
+                ],
+                params=[match],
+                select={
+                    "rank": "-bm25({fts}, 10.0, 5.0, 1.0)".format(
+                        fts=FTS_TABLE
+                    ),
+                },
+            ) \
+            .order_by("-rank", "name", "id")
+
+    condition = Q()
+    for word in terms.split():
+        condition &= Q(name__icontains=word)
+
+    return queryset.filter(condition).order_by("name", "id")
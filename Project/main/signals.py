@@ -1,49 +1,66 @@
+import sys
 import logging
-from io import BytesIO
 
-from django.core.files.base import ContentFile
-from django.db.models.signals import pre_save, post_save
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
 from django.dispatch import receiver
+from django.utils import timezone
 from django.contrib.auth.signals import user_logged_in
 
-from PIL import Image
-
+from . import bitmaps, caching, search, thumbnails
 from .models import ProductImage, Basket
-from .models import OrderLine, Order
-
-THUMBNAIL_SIZE = (300, 300)
+from .models import OrderLine, Order, DailyOrderStat, DailyProductSales
+from .models import Product, ProductTag
 
 logger = logging.getLogger(__name__)
 
 
 @receiver(pre_save, sender=ProductImage)
-def generate_thumbnail(sender, instance, **kwargs):
+def reset_thumbnail(sender, instance, raw=False, **kwargs):
     """
-    For the sake of simplicity,
-    I used the examples from the official documentation.
-        https://pillow.readthedocs.io/en/stable/reference/Image.html#create-thumbnails
-    
-        OLD     image_inst = image_inst.convert("RGB")
-                image_inst.thumbnail(THUMBNAIL_SIZE, Image.ANTIALIAS)
-                
-        NEW     image_inst.thumbnail(THUMBNAIL_SIZE)
+    NO image processing here anymore (see 'main/thumbnails.py'),
+    only deciding whether a thumbnail is needed
+    || a new image (upload, or another file) -> the old thumbnail goes away
+    || no thumbnail yet                      -> one is queued
+    || anything else (other fields)          -> nothing to do
     """
 
-    logger.info("Generating thumbnail for product %2d", instance.product.id)
+    if raw:
+        return
 
-    image_inst = Image.open(instance.image)
-    image_inst.thumbnail(THUMBNAIL_SIZE)
+    image = instance.image
+    changed = not getattr(image, "_committed", True) \
+        or image.name != getattr(instance, "_loaded_image", None)
 
-    temp_thumb = BytesIO()
-    image_inst.save(temp_thumb, "JPEG")
+    if changed:
+        instance.thumbnail = None
 
-    temp_thumb.seek(0)
+    instance._thumbnail_needed = bool(image) and not instance.thumbnail
 
-    instance.thumbnail.save(
-        instance.image.name, ContentFile(temp_thumb.read()), save=False
-    )
 
-    temp_thumb.close()
+@receiver(post_save, sender=ProductImage)
+def queue_thumbnail(sender, instance, raw=False, **kwargs):
+    """
+    Queued once the transaction commits,
+    the worker (another connection) wouldn't see the row before.
+    The page shows a placeholder meanwhile.
+    """
+
+    instance._loaded_image = instance.image.name
+
+    if raw or not getattr(instance, "_thumbnail_needed", False):
+        return
+
+    logger.info("Queueing thumbnail for product %2d", instance.product_id)
+
+    image_id = instance.pk
+    transaction.on_commit(lambda: thumbnails.worker.submit(image_id))
 
 
 @receiver(user_logged_in)
@@ -54,8 +71,8 @@ def merge_baskets_if_found(sender, user, request, **kwargs):
 
     About the 'merge' here
         It means that 'merging products in the basket to the current user'.
-
-    I havn't cleaned up my mind about this method (merging baskets).
+        || 1. The user got an open basket already -> `Basket.merge` (set-based)
+        || 2. The user doesn't                    -> it's his basket from now on
     """
 
     # See if there's a basket being stored before
@@ -63,61 +80,496 @@ def merge_baskets_if_found(sender, user, request, **kwargs):
 
     # This big chunk of code won't run unless it gets stuff in the `request` object
     if anonymous_basket:
-        try:
-            # Assign the current user to a new 'basket' object
-            loggedin_basket = Basket.objects.get(
-                user=user, status=Basket.OPEN
-            )
-
-            # About the `basketline_set`
-            #   It was called 'reverse related object lookup'.
-            #   Simply put, from [fk.being_fked](fked) to [being_fked.fk_set](fk_set)
-            for line in anonymous_basket.basketline_set.all():
-
-                # Merging the basket with the current user's
-                line.basket = loggedin_basket
-                line.save()
+        loggedin_basket = (
+            Basket.objects
+                .filter(user=user, status=Basket.OPEN)
+                .exclude(pk=anonymous_basket.pk)
+                .order_by("-id")
+                .first()
+        )
 
-            # Delete the one in the ?cache
-            anonymous_basket.delete()
+        if loggedin_basket:
+            loggedin_basket.merge(anonymous_basket)
 
             # Assign the basket for 'views, templates' to use
             request.basket = loggedin_basket
+            request.session["basket_id"] = loggedin_basket.id
 
             logger.info(
                 "Merged basket to id %d", loggedin_basket.id
             )
 
-        except Basket.DoesNotExist:
+        else:
 
-            # Assign a blank basket to the user?
+            # Assign the user to the (anonymous) basket
             anonymous_basket.user = user
-            anonymous_basket.save()
+            anonymous_basket.save(update_fields=["user"])
 
             logger.info(
                 "Assigned user to basket id %d", anonymous_basket.id
             )
 
 
+@receiver(pre_save, sender=OrderLine)
+def snapshot_unit_price(sender, instance, raw=False, **kwargs):
+    """
+    A line saved on its own (admin, API ..) without a price
+    gets the price of its product, as it is right now,
+    & so does a line moved to another product (the old price was ITS price).
+    """
+
+    if raw:
+        return
+
+    loaded_product_id = getattr(
+        instance, "_loaded_product_id", instance.product_id
+    )
+
+    if instance.unit_price is not None \
+            and loaded_product_id == instance.product_id:
+        return
+
+    instance.unit_price = Product.objects \
+        .filter(pk=instance.product_id) \
+        .values_list("price", flat=True) \
+        .first()
+
+
+def line_amounts(quantity, unit_price, status):
+    """
+    -> (units sold, revenue, subtotal, total) of a line
+    (see `OrderLine.sales` & `OrderLine.amounts`).
+    """
+
+    return OrderLine.sales(quantity, unit_price, status) \
+        + OrderLine.amounts(quantity, unit_price, status)
+
+
+def loaded_amounts(instance):
+    """
+    `line_amounts` of the line BEFORE this save,
+    None if it wasn't loaded from the db (nothing to compare with).
+    """
+
+    try:
+        return line_amounts(
+            instance._loaded_quantity,
+            instance._loaded_unit_price,
+            instance._loaded_status,
+        )
+    except AttributeError:
+        return None
+
+
+@receiver(post_save, sender=OrderLine)
+def orderline_to_amounts(sender, instance, created, raw=False, **kwargs):
+    """
+    A line saved on its own moves the `subtotal` & `total` of its order
+    and the sales rollup ('DailyProductSales') by what it gained or lost,
+    ONE `UPDATE` + ONE upsert, nothing when neither changed.
+    (the checkout uses `bulk_create`, it sets all of them itself)
+    The rollup follows the `total`, a cancelled line leaves it.
+
+    Connected BEFORE `orderline_to_order_status`,
+    which moves the `_loaded_status` on.
+    """
+
+    if raw:
+        return
+
+    loaded = (0, 0, 0, 0) if created else loaded_amounts(instance)
+    new = line_amounts(instance.quantity, instance.unit_price, instance.status)
+    loaded_product_id = getattr(
+        instance, "_loaded_product_id", instance.product_id
+    )
+
+    instance._loaded_quantity = instance.quantity
+    instance._loaded_unit_price = instance.unit_price
+    instance._loaded_product_id = instance.product_id
+
+    if loaded == new and loaded_product_id == instance.product_id:
+        return
+
+    orders = Order.objects.filter(pk=instance.order_id)
+    day = instance.order.added_on
+
+    with transaction.atomic():
+        if loaded is None:
+            orders.recount()
+            DailyProductSales.objects.rebuild(day, day)
+            return
+
+        units, revenue, subtotal, total = (
+            now - then for now, then in zip(new, loaded)
+        )
+        orders.add_amounts(subtotal, total)
+
+        # Moved to another product -> out of the old one, into the new one
+        if loaded_product_id != instance.product_id:
+            DailyProductSales.objects.add_sales(day, {
+                loaded_product_id: (-loaded[0], -loaded[1]),
+                instance.product_id: (new[0], new[1]),
+            })
+        elif units or revenue:
+            DailyProductSales.objects.add_sales(
+                day, { instance.product_id: (units, revenue) }
+            )
+
+
+@receiver(post_save, sender=OrderLine)
+def orderline_to_order_status(sender, instance, created, raw=False, **kwargs):
+    """
+    The order keeps a counter of its NEW/PROCESSING lines (`outstanding_lines`),
+    so there's no need to scan all of its lines on every save anymore.
+    || 1. a line leaving  NEW/PROCESSING (e.g. 'SENT')  -> counter - 1
+    || 2. a line going back to NEW/PROCESSING          -> counter + 1
+    || 3. the counter hits zero                        -> the order is DONE
+
+    About the `_loaded_status`
+        Set by `OrderLine.from_db`, that's the status BEFORE this save.
+        A line which wasn't loaded from the db (no status to compare with)
+        gets its order recounted instead (one `UPDATE` anyway).
+
+    The `quantity` doesn't matter here,
+    all the units of a line share the status of the line.
+    """
+
+    if raw:
+        return
+
+    now = OrderLine.is_outstanding(instance.status)
+
+    if created:
+        delta = int(now)
+    elif hasattr(instance, "_loaded_status"):
+        delta = int(now) - int(OrderLine.is_outstanding(instance._loaded_status))
+    else:
+        delta = None
+
+    instance._loaded_status = instance.status
+
+    orders = Order.objects.filter(pk=instance.order_id)
+
+    if delta == 0 and not created:
+        return
+
+    with transaction.atomic():
+        if delta is None:
+            orders.recount()
+        elif delta:
+            orders.add_outstanding(delta)
+
+        if not now and orders.mark_done_if_finished():
+
+            # If all 'sent', tell us that it was all 'sent'.
+            logger.info(
+                "All lines for order [%2d] have been processed. "
+                "Marking as done.",
+                instance.order_id
+            )
+
+
+@receiver(post_delete, sender=OrderLine)
+def orderline_deleted(sender, instance, **kwargs):
+    """
+    A deleted NEW/PROCESSING line isn't outstanding anymore,
+    & its amounts go back out of the order and of the sales rollup.
+    (a cascade deletes the lines BEFORE their order, so it's still there)
+    """
+
+    status = getattr(instance, "_loaded_status", instance.status)
+    units, revenue, subtotal, total = loaded_amounts(instance) or \
+        line_amounts(instance.quantity, instance.unit_price, instance.status)
+
+    order = Order.objects.filter(pk=instance.order_id).first()
+
+    if order is None:
+        return
+
+    orders = Order.objects.filter(pk=order.pk)
+
+    if OrderLine.is_outstanding(status):
+        orders.add_outstanding(-1)
+
+    orders.add_amounts(-subtotal, -total)
+    product_id = getattr(instance, "_loaded_product_id", instance.product_id)
+    DailyProductSales.objects.add_sales(
+        order.added_on, { product_id: (-units, -revenue) }
+    )
+
+
+@receiver(post_save, sender=Order)
+def order_to_daily_stats(sender, instance, created, raw=False, **kwargs):
+    """
+    Moves the order within the daily rollup ('DailyOrderStat'),
+    ONE upsert, & nothing at all when the status & country didn't change.
+
+    About the `_loaded_rollup_key`
+        Set by `Order.from_db`, that's where it was counted BEFORE this save.
+        An order which wasn't loaded from the db (nothing to compare with)
+        gets its day recounted instead.
+    """
+
+    if raw:
+        return
+
+    key = instance.rollup_key()
+    loaded = getattr(instance, "_loaded_rollup_key", None)
+    instance._loaded_rollup_key = key
+
+    if created:
+        DailyOrderStat.objects.add({ key: 1 })
+    elif loaded is None:
+        DailyOrderStat.objects.rebuild(key[0], key[0])
+    elif loaded != key:
+        DailyOrderStat.objects.add({ loaded: -1, key: 1 })
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    key = getattr(instance, "_loaded_rollup_key", None) \
+        or instance.rollup_key()
+
+    DailyOrderStat.objects.add({ key: -1 })
+
+
+@receiver(post_delete, sender=Order)
+def forget_order_facts(sender, instance, **kwargs):
+    """
+    The watermark can't see a row which is gone (see 'main/analytics.py').
+
+    About `sys.modules`
+        Only a process which queried the facts has them loaded (& NumPy),
+        not imported yet -> nothing to forget, NumPy isn't needed at all.
+    """
+
+    analytics = sys.modules.get(__package__ + ".analytics")
+
+    if analytics is not None:
+        analytics.facts.forget(instance.pk)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
 @receiver(post_save, sender=OrderLine)
-def orderline_to_order_status(sender, instance, **kwargs):
+@receiver(post_delete, sender=OrderLine)
+def invalidate_reports(sender, raw=False, **kwargs):
+    """
+    Any change to the orders bumps the reports version,
+    every cached admin report is stale at once (see `cached_report`).
+    The checkout writes its lines with `bulk_create`, but it saves
+    the 'Order' itself in the same transaction.
+    """
+
+    if raw:
+        return
+
+    caching.bump_reports_version()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductTag)
+@receiver(post_delete, sender=ProductTag)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(m2m_changed, sender=Product.tags.through)
+def invalidate_product_listings(sender, **kwargs):
     """
-    Quite a complex `if` statement!
-    || In short, it produces <NOT [any NEW/PROCESSING]> exists
-    || that is, all the "order lines" have been exec_ed (aka. 'SENT').
+    Any change to the catalog bumps its version,
+    so every cached listing page (`ProductListView`)
+    & every cached anonymous page ('page_cache_middleware') is stale at once.
+
+    About the `m2m_changed`
+        Adding/removing tags doesn't save the 'Product' itself,
+        only the 'pre_*' actions are skipped (nothing changed yet).
     """
 
-    if not instance.order.lines \
-        .filter(status__lt=OrderLine.SENT) \
-        .exists():
+    action = kwargs.get("action")
+
+    if kwargs.get("raw") or (action and action.startswith("pre_")):
+        return
+
+    caching.bump_catalog_version()
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+@receiver(pre_delete, sender=ProductTag)
+def remember_tagged_products(sender, instance, **kwargs):
+    """
+    A `tag.product_set.clear()` (or deleting the tag) gives no product ids,
+    so they're kept on the tag BEFORE the rows go away.
+    (registered first, the receivers below rely on it)
+    """
 
-        # If all 'sent', tell us that it was all 'sent'.
-        logger.info(
-            "All lines for order [%2d] have been processed. Marking as done.",
-            instance.order.id
+    if sender is ProductTag or (
+        kwargs["reverse"] and kwargs["action"] == "pre_clear"
+    ):
+        instance._tagged_product_ids = list(
+            instance.product_set.values_list("id", flat=True)
         )
 
-        # Mark the order as finished, done!
-        instance.order.status = Order.DONE
 
-        instance.order.save()
+def tagged_product_ids(instance, action, reverse, pk_set):
+    """
+    The products touched by a `Product.tags` change.
+
+    About the `reverse`
+        || product.tags.add(tag)        -> `instance` is the product
+        || tag.product_set.add(product) -> `instance` is the tag,
+                                           `pk_set` the products
+        A `clear` has no `pk_set` at all, hence `remember_tagged_products`.
+    """
+
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return []
+
+    if not reverse:
+        return [instance.pk]
+
+    if action == "post_clear":
+        return getattr(instance, "_tagged_product_ids", [])
+
+    return list(pk_set)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    search.index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.unindex_products([instance.pk])
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def index_product_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    The tag names are part of the search data.
+    """
+
+    search.index_products(
+        tagged_product_ids(instance, action, reverse, pk_set)
+    )
+
+
+@receiver(post_save, sender=ProductTag)
+def index_tagged_products(sender, instance, created, **kwargs):
+    if not created:
+        search.index_products(
+            instance.product_set.values_list("id", flat=True)
+        )
+
+
+@receiver(post_delete, sender=ProductTag)
+def reindex_untagged_products(sender, instance, **kwargs):
+    search.index_products(getattr(instance, "_tagged_product_ids", []))
+
+
+@receiver(post_save, sender=Product)
+def update_tag_index_product(sender, instance, **kwargs):
+    bitmaps.tag_index.change(
+        lambda index: index.set_active(instance.pk, instance.active)
+    )
+
+
+@receiver(post_delete, sender=Product)
+def update_tag_index_deleted_product(sender, instance, **kwargs):
+    """
+    The rows of 'main_product_tags' go away WITHOUT any `m2m_changed`.
+    """
+
+    def apply(index):
+        index.set_active(instance.pk, False)
+        index.untag_product(instance.pk)
+
+    bitmaps.tag_index.change(apply)
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def update_tag_index_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Same `reverse` story as `index_product_tags`,
+    but a 'clear' doesn't need the ids here (the bitmaps know them).
+    """
+
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    add = action == "post_add"
+
+    def apply(index):
+        if not reverse and action == "post_clear":
+            index.untag_product(instance.pk)
+        elif not reverse:
+            for tag_id in pk_set:
+                index.tag_products(tag_id, [instance.pk], add)
+        elif action == "post_clear":
+            index.clear_tag(instance.pk)
+        else:
+            index.tag_products(instance.pk, pk_set, add)
+
+    bitmaps.tag_index.change(apply)
+
+
+@receiver(post_save, sender=ProductTag)
+def update_tag_index_tag(sender, instance, **kwargs):
+    bitmaps.tag_index.change(lambda index: index.set_tag(instance))
+
+
+@receiver(post_delete, sender=ProductTag)
+def update_tag_index_deleted_tag(sender, instance, **kwargs):
+    bitmaps.tag_index.change(lambda index: index.drop_tag(instance.pk))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def forget_product_page(sender, instance, **kwargs):
+    caching.forget_products([instance.pk])
+
+
+def touch_products(product_ids):
+    """
+    An image or a tag is part of the product page,
+    so its `date_updated` (the Last-Modified of the page) moves too.
+    (an `UPDATE`, no signal & no `post_save` loop)
+    """
+
+    product_ids = list(product_ids)
+
+    if product_ids:
+        Product.objects \
+            .filter(pk__in=product_ids) \
+            .update(date_updated=timezone.now())
+
+    caching.forget_products(product_ids)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def forget_product_images(sender, instance, **kwargs):
+    touch_products([instance.product_id])
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def forget_product_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    touch_products(tagged_product_ids(instance, action, reverse, pk_set))
+
+
+@receiver(post_save, sender=ProductTag)
+@receiver(post_delete, sender=ProductTag)
+def forget_tagged_product_pages(sender, instance, **kwargs):
+    """
+    The name of the tag is on the page of its products.
+    """
+
+    if kwargs.get("created"):
+        return
+
+    if kwargs["signal"] is post_delete:
+        product_ids = getattr(instance, "_tagged_product_ids", [])
+    else:
+        product_ids = instance.product_set.values_list("id", flat=True)
+
+    touch_products(product_ids)
@@ -93,7 +93,7 @@
 /*! no static exports found */
 /***/ (function(module, exports, __webpack_require__) {
 
-eval("// import React from \"react\";\n// import ReactDOM from \"react-dom\";\nconst React = __webpack_require__(/*! react */ \"./node_modules/react/index.js\");\nconst ReactDOM = __webpack_require__(/*! react-dom */ \"./node_modules/react-dom/index.js\");\n\nconst e = React.createElement;\n\nlet imageStyle = {\n    margin: \"10px\",\n    display: \"inline-block\"\n};\n\nclass ImageBox extends React.Component {\n    constructor(props) {\n        super(props);\n\n        this.state = {\n            currentImage: this.props.imageStart\n        }\n    }\n\n    click(image) {\n        this.setState({\n            currentImage: image\n        });\n    }\n\n    render() {\n        const images = this.props.images.map((i) =>\n            e(\n                \"div\", {style: imageStyle, className: \"image\", key: i.image},\n                e(\n                    \"img\",\n                    {\n                        onClick: this.click.bind(this, i),\n                        width: \"100\",\n                        src: i.thumbnail\n                    }\n                )\n            )\n        );\n\n        return e(\n            \"div\", {className: \"gallery\"},\n            e(\n                \"div\", {className: \"current-image\"},\n                e(\n                    \"img\",\n                    {src: this.state.currentImage.image}\n                )\n            ),\n            images\n        )\n    }\n}\n\nwindow.React = React;\nwindow.ReactDOM = ReactDOM;\nwindow.ImageBox = ImageBox;\n\nmodule.exports = ImageBox;\n// export default ImageBox;\n\n//# sourceURL=webpack:///./frontend/imageswitcher.js?");
+eval("// import React from \"react\";\n// import ReactDOM from \"react-dom\";\nconst React = __webpack_require__(/*! react */ \"./node_modules/react/index.js\");\nconst ReactDOM = __webpack_require__(/*! react-dom */ \"./node_modules/react-dom/index.js\");\n\nconst e = React.createElement;\n\nlet imageStyle = {\n    margin: \"10px\",\n    display: \"inline-block\"\n};\n\n// The browser picks the rendition by itself (see 'main/renditions.py')\nconst imageSizes = \"(max-width: 640px) 100vw, 640px\";\n\nfunction picture(image) {\n    const srcset = image.srcset || {};\n    const sources = [];\n\n    if (srcset.webp) {\n        sources.push(e(\"source\", {\n            key: \"webp\",\n            type: \"image/webp\",\n            srcSet: srcset.webp,\n            sizes: imageSizes\n        }));\n    }\n\n    return e(\n        \"picture\", {},\n        sources,\n        e(\n            \"img\",\n            {\n                src: image.image,\n                srcSet: srcset.jpeg,\n                sizes: srcset.jpeg ? imageSizes : undefined\n            }\n        )\n    );\n}\n\nclass ImageBox extends React.Component {\n    constructor(props) {\n        super(props);\n\n        this.state = {\n            currentImage: this.props.imageStart\n        }\n    }\n\n    click(image) {\n        this.setState({\n            currentImage: image\n        });\n    }\n\n    render() {\n        const images = this.props.images.map((i) =>\n            e(\n                \"div\", {style: imageStyle, className: \"image\", key: i.image},\n                e(\n                    \"img\",\n                    {\n                        onClick: this.click.bind(this, i),\n                        width: \"100\",\n                        src: i.thumbnail\n                    }\n                )\n            )\n        );\n\n        return e(\n            \"div\", {className: \"gallery\"},\n            e(\n                \"div\", {className: \"current-image\"},\n                picture(this.state.currentImage)\n            ),\n            images\n        )\n    }\n}\n\nwindow.React = React;\nwindow.ReactDOM = ReactDOM;\nwindow.ImageBox = ImageBox;\n\nmodule.exports = ImageBox;\n// export default ImageBox;\n\n//# sourceURL=webpack:///./frontend/imageswitcher.js?");
 
 /***/ }),
 
@@ -1,15 +1,28 @@
+import threading
+import time
 from decimal import Decimal
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest.mock import patch
 
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
+from main import admin
+from main import analytics
+from main import caching
 from main import factories
 from main import models
 
 
 class TestAdminViews(TestCase):
+    def setUp(self):
+        # The cached reports aren't rolled back along with the database
+        cache.clear()
+
     def test_most_bought_products(self):
         products = [
             factories.ProductFactory(name="A", active=True),
@@ -56,6 +69,325 @@ class TestAdminViews(TestCase):
 
         self.assertEqual(data, { "B": 3, "C": 2, "A": 6 })
 
+    def test_most_bought_products_sums_quantities(self):
+        products = [
+            factories.ProductFactory(name="A", active=True),
+            factories.ProductFactory(name="B", active=True),
+        ]
+
+        orders = factories.OrderFactory.create_batch(2)
+
+        factories.OrderLineFactory(
+            order=orders[0], product=products[0], quantity=4  # A: 4
+        )
+        factories.OrderLineFactory(
+            order=orders[1], product=products[0], quantity=2  # A: 4+2
+        )
+        factories.OrderLineFactory(
+            order=orders[1], product=products[1], quantity=3  # B: 3
+        )
+
+        user_one = models.User.objects.create_superuser(
+            "user_one", "whatislove"
+        )
+        self.client.force_login(user_one)
+
+        response = self.client.post(
+            reverse("admin:most_bought_products"),
+            { "period": "30" },
+        )
+        self.assertEqual(response.status_code, 200)
+
+        data = dict(zip(
+            response.context["labels"],
+            response.context["values"],
+        ))
+
+        self.assertEqual(data, { "A": 6, "B": 3 })
+
+    def test_most_bought_products_is_a_sorted_top_list(self):
+        products = [
+            factories.ProductFactory(name=name, price=Decimal("2.00"))
+            for name in "ABCD"
+        ]
+        order = factories.OrderFactory()
+
+        for product, quantity in zip(products, (1, 4, 2, 3)):
+            factories.OrderLineFactory(
+                order=order, product=product, quantity=quantity
+            )
+
+        # Sold long ago, out of the period
+        models.DailyProductSales.objects.add_sales(
+            timezone.localdate() - timedelta(days=60),
+            { products[0].id: (9, Decimal("18.00")) },
+        )
+
+        user_one = models.User.objects.create_superuser(
+            "user_one", "whatislove"
+        )
+        self.client.force_login(user_one)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                reverse("admin:most_bought_products"), { "period": "30" }
+            )
+
+        # Not a single query on the orders (or their lines)
+        self.assertFalse([
+            query for query in ctx.captured_queries
+            if '"main_order' in query["sql"]
+        ])
+        self.assertEqual(response.context["labels"], ["B", "D", "C", "A"])
+        self.assertEqual(response.context["values"], [4, 3, 2, 1])
+        self.assertEqual(response.context["revenues"], [8.0, 6.0, 4.0, 2.0])
+
+        with patch.object(admin.ReportingColoredAdminSite, "TOP_PRODUCTS", 2):
+            response = self.client.post(
+                reverse("admin:most_bought_products"), { "period": "90" }
+            )
+
+        self.assertEqual(response.context["labels"], ["A", "B"])
+        self.assertEqual(response.context["values"], [10, 4])
+
+    def test_revenue_per_day_is_at_the_captured_prices(self):
+        product = factories.ProductFactory(price=Decimal("2.50"))
+        factories.OrderLineFactory(
+            order=factories.OrderFactory(), product=product, quantity=2
+        )
+
+        # Repriced later on, the revenue stays at the price it was sold at
+        product.price = Decimal("9.00")
+        product.save()
+
+        models.DailyProductSales.objects.add_sales(
+            timezone.localdate() - timedelta(days=60),
+            { product.id: (1, Decimal("3.00")) },
+        )
+
+        user_one = models.User.objects.create_superuser(
+            "user_one", "whatislove"
+        )
+        self.client.force_login(user_one)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                reverse("admin:revenue_per_day"), { "period": "30" }
+            )
+
+        self.assertFalse([
+            query for query in ctx.captured_queries
+            if '"main_order' in query["sql"]
+        ])
+        self.assertEqual(
+            response.context["labels"],
+            [timezone.localdate().strftime("%Y-%m-%d")],
+        )
+        self.assertEqual(response.context["values"], [5.0])
+        self.assertEqual(response.context["total"], Decimal("5.00"))
+
+        response = self.client.post(
+            reverse("admin:revenue_per_day"), { "period": "90" }
+        )
+
+        self.assertEqual(response.context["values"], [3.0, 5.0])
+        self.assertEqual(response.context["total"], Decimal("8.00"))
+
+    def test_sales_breakdown_slices_the_columnar_facts(self):
+        products = [
+            factories.ProductFactory(name=name, price=Decimal("2.00"))
+            for name in "AB"
+        ]
+        uk = factories.OrderFactory(shipping_country="uk")
+        fr = factories.OrderFactory(shipping_country="fr")
+
+        factories.OrderLineFactory(order=uk, product=products[0], quantity=3)
+        factories.OrderLineFactory(order=uk, product=products[1], quantity=1)
+        factories.OrderLineFactory(order=fr, product=products[1], quantity=2)
+        factories.OrderLineFactory(
+            order=fr,
+            product=products[0],
+            quantity=5,
+            status=models.OrderLine.CANCELLED,
+        )
+
+        user_one = models.User.objects.create_superuser(
+            "user_one", "whatislove"
+        )
+        self.client.force_login(user_one)
+
+        def report(**data):
+            response = self.client.post(
+                reverse("admin:sales_breakdown"), dict(period="30", **data)
+            )
+            self.assertEqual(response.status_code, 200)
+
+            return response.context
+
+        # A fresh instance, the facts of the process outlive the test db
+        with patch.object(analytics, "facts", analytics.LineFacts()):
+            context = report(by="country", value="amount")
+            self.assertEqual(context["labels"], ["fr", "uk"])
+            self.assertEqual(context["values"], [14.0, 8.0])
+
+            context = report(
+                by="product",
+                value="quantity",
+                statuses=[models.OrderLine.NEW],
+            )
+            self.assertEqual(context["rows"], [("A", 3), ("B", 3)])
+
+            context = report(by="day", value="lines")
+            self.assertEqual(
+                context["labels"],
+                [timezone.localdate().strftime("%Y-%m-%d")],
+            )
+            self.assertEqual(context["values"], [4.0])
+
+    def test_invoice_shows_the_order_totals(self):
+        product = factories.ProductFactory(price=Decimal("1.50"))
+        order = factories.OrderFactory()
+        factories.OrderLineFactory(order=order, product=product, quantity=2)
+        factories.OrderLineFactory(
+            order=order,
+            product=product,
+            status=models.OrderLine.CANCELLED,
+        )
+
+        product.price = Decimal("7.00")
+        product.save()
+
+        user_one = models.User.objects.create_superuser(
+            "user_one", "whatislove"
+        )
+        self.client.force_login(user_one)
+
+        response = self.client.get(
+            reverse("admin:invoice", kwargs={ "order_id": order.id })
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["order"].subtotal, Decimal("4.50"))
+        self.assertEqual(response.context["order"].total, Decimal("3.00"))
+        self.assertContains(response, "<td>4.50</td>")
+        self.assertNotContains(response, "7.00")
+
+    def test_orders_per_day_reads_the_daily_rollup(self):
+        user_one = models.User.objects.create_superuser(
+            "user_one", "whatislove"
+        )
+        self.client.force_login(user_one)
+
+        def report(orders):
+            for country in ("uk", "fr") * orders:
+                factories.OrderFactory(shipping_country=country)
+
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse("admin:orders_per_day"))
+
+            self.assertEqual(response.status_code, 200)
+
+            return response.context, len(ctx.captured_queries)
+
+        context, queries = report(1)
+        more_context, more_queries = report(10)
+
+        self.assertEqual(queries, more_queries)
+        self.assertEqual(
+            more_context["labels"], [timezone.localdate().strftime("%Y-%m-%d")]
+        )
+        self.assertEqual(more_context["values"], [22])
+        self.assertEqual(
+            more_context["by_status"],
+            [("New", [22]), ("Paid", [0]), ("Done", [0])],
+        )
+        self.assertEqual(more_context["by_country"], [("fr", 11), ("uk", 11)])
+
+    def test_reports_are_cached_until_the_orders_change(self):
+        factories.OrderFactory(shipping_country="uk")
+
+        user_one = models.User.objects.create_superuser(
+            "user_one", "whatislove"
+        )
+        self.client.force_login(user_one)
+
+        def report():
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse("admin:orders_per_day"))
+
+            computed = any(
+                "main_dailyorderstat" in query["sql"]
+                for query in ctx.captured_queries
+            )
+
+            return response, computed
+
+        response, computed = report()
+        computed_at = response.context["computed_at"]
+
+        self.assertTrue(computed)
+        self.assertContains(
+            response, "Computed at %s" % computed_at.strftime("%Y-%m-%d")
+        )
+
+        response, computed = report()
+
+        self.assertFalse(computed)
+        self.assertEqual(response.context["computed_at"], computed_at)
+        self.assertEqual(response.context["values"], [1])
+
+        # Any write to the orders bumps the version
+        factories.OrderFactory(shipping_country="fr")
+        response, computed = report()
+
+        self.assertTrue(computed)
+        self.assertGreater(response.context["computed_at"], computed_at)
+        self.assertEqual(response.context["values"], [2])
+
+        # Another day, another report (nothing changed in between)
+        tomorrow = timezone.localdate() + timedelta(days=1)
+
+        with patch.object(timezone, "localdate", return_value=tomorrow):
+            response, computed = report()
+
+        self.assertTrue(computed)
+
+    def test_product_search_uses_the_search_index(self):
+        match = factories.ProductFactory(
+            name="Django channels", slug="django-channels"
+        )
+        factories.ProductFactory(name="Flask", slug="flask")
+
+        user_one = models.User.objects.create_superuser(
+            "user_one", "whatislove"
+        )
+        self.client.force_login(user_one)
+
+        response = self.client.get(
+            reverse("admin:main_product_changelist"), { "q": "Channels" }
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(response.context["cl"].result_list), [match]
+        )
+
+    def test_product_tag_search_filters_by_name(self):
+        fiction = models.ProductTag.objects.create(name="Fiction", slug="fiction")
+        models.ProductTag.objects.create(name="Web", slug="web")
+
+        user_one = models.User.objects.create_superuser(
+            "user_one", "whatislove"
+        )
+        self.client.force_login(user_one)
+
+        response = self.client.get(
+            reverse("admin:main_producttag_changelist"), { "q": "fic" }
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(response.context["cl"].result_list), [fiction]
+        )
+
     def test_invoice_renders_exactly_as_expected(self):
         products = [
             factories.ProductFactory(name="A", active=True, price=Decimal("1.00")),
@@ -124,3 +456,68 @@ class TestAdminViews(TestCase):
                 expected_content = fixture.read()
 
             self.assertEqual(content, expected_content)
+
+
+class TestReportCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+
+    def compute(self, days):
+        self.calls.append(days)
+        return { "days": days, "call": len(self.calls) }
+
+    def report(self, days=7):
+        return caching.cached_report("test", self.compute, days=days)
+
+    def test_stale_result_is_served_while_it_is_computed_elsewhere(self):
+        data, computed_at = self.report()
+        self.assertEqual(self.report(), (data, computed_at))
+        self.assertEqual(self.report(days=30)[0], { "days": 30, "call": 2 })
+
+        caching.bump_reports_version()
+
+        # Another worker holds the lock -> the stale result, nothing computed
+        key = caching.report_key("test", { "days": 7 })
+        cache.add(caching.REPORT_LOCK_KEY % key, "another-worker")
+
+        self.assertEqual(self.report(), (data, computed_at))
+        self.assertEqual(len(self.calls), 2)
+
+        cache.delete(caching.REPORT_LOCK_KEY % key)
+
+        self.assertEqual(self.report()[0], { "days": 7, "call": 3 })
+
+    def test_a_report_is_computed_once_for_concurrent_requests(self):
+        def slow_compute(days):
+            time.sleep(0.2)
+            return self.compute(days)
+
+        results = []
+
+        def request():
+            results.append(
+                caching.cached_report("test", slow_compute, days=7)
+            )
+
+        threads = [threading.Thread(target=request) for i in range(4)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.calls, [7])
+        self.assertEqual(len(set(
+            (data["call"], computed_at) for data, computed_at in results
+        )), 1)
+
+    def test_missing_result_is_computed_if_the_worker_is_gone(self):
+        key = caching.report_key("test", { "days": 7 })
+        cache.add(caching.REPORT_LOCK_KEY % key, "crashed-worker")
+
+        with patch.object(caching, "REPORT_WAIT", 0.1):
+            data, computed_at = self.report()
+
+        self.assertEqual(data, { "days": 7, "call": 1 })
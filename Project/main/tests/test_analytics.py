@@ -0,0 +1,142 @@
+from decimal import Decimal
+from datetime import timedelta
+
+from django.db.models import DecimalField, F, Sum
+from django.test import TestCase
+from django.utils import timezone
+
+from main import analytics, factories, models
+
+NEW = models.OrderLine.NEW
+SENT = models.OrderLine.SENT
+CANCELLED = models.OrderLine.CANCELLED
+
+
+class TestLineFacts(TestCase):
+    def setUp(self):
+        self.products = [
+            factories.ProductFactory(price=Decimal(price))
+            for price in ("1.00", "2.50", "4.00")
+        ]
+        self.today = timezone.localdate()
+
+        # (country, days ago, [(product, quantity, status), ..])
+        for country, days_ago, lines in (
+            ("uk", 0, [(0, 2, NEW), (1, 1, SENT)]),
+            ("fr", 0, [(1, 3, NEW)]),
+            ("uk", 40, [(2, 5, NEW)]),
+            ("de", 1, [(0, 1, CANCELLED), (2, 1, NEW)]),
+        ):
+            order = factories.OrderFactory(shipping_country=country)
+            models.Order.objects \
+                .filter(pk=order.pk) \
+                .update(date_added=timezone.now() - timedelta(days=days_ago))
+
+            for product, quantity, status in lines:
+                factories.OrderLineFactory(
+                    order=order,
+                    product=self.products[product],
+                    quantity=quantity,
+                    status=status,
+                )
+
+        # Its own instance, the module one may hold another test's rows
+        self.facts = analytics.LineFacts()
+        self.facts.build()
+
+    def test_queries_match_the_orm(self):
+        self.assertEqual(len(self.facts), models.OrderLine.objects.count())
+
+        expected = dict(
+            models.OrderLine.objects
+                .values("product")
+                .annotate(units=Sum("quantity"))
+                .values_list("product", "units")
+        )
+        self.assertEqual(self.facts.group_by("product"), expected)
+
+        first = self.today - timedelta(days=29)
+        self.assertEqual(
+            self.facts.top("product", first=first, limit=2),
+            [(self.products[1].id, 4), (self.products[0].id, 3)],
+        )
+
+        revenue = models.OrderLine.objects \
+            .exclude(status=models.OrderLine.CANCELLED) \
+            .values("order__shipping_country") \
+            .annotate(revenue=Sum(
+                F("quantity") * F("unit_price"), output_field=DecimalField()
+            ))
+        self.assertEqual(
+            self.facts.group_by(
+                "country",
+                "amount",
+                status=[models.OrderLine.NEW, models.OrderLine.SENT],
+            ),
+            {
+                row["order__shipping_country"]: row["revenue"]
+                for row in revenue
+            },
+        )
+
+        self.assertEqual(
+            self.facts.group_by("day", "lines", country=["uk", "nope"]),
+            {
+                self.today - timedelta(days=40): 1,
+                self.today: 2,
+            },
+        )
+        self.assertEqual(
+            self.facts.group_by(
+                "day",
+                "lines",
+                first=self.today,
+                last=self.today,
+                country=["uk", "fr", "de"],
+            ),
+            { self.today: 3 },
+        )
+
+    def test_refresh_reads_the_changed_orders(self):
+        # Nothing changed (even within the overlap) -> the two watermark queries
+        self.facts.watermark = timezone.now() + self.facts.OVERLAP
+
+        with self.assertNumQueries(2):
+            self.assertEqual(self.facts.group_by("country", "lines")["fr"], 1)
+
+        # e.g. the admin
+        line = models.OrderLine.objects.get(order__shipping_country="fr")
+        line.status = models.OrderLine.PROCESSING
+        line.save()
+        factories.OrderLineFactory(
+            order=line.order, product=self.products[2], quantity=2
+        )
+
+        with self.assertNumQueries(3):
+            self.assertEqual(
+                self.facts.group_by(
+                    "country", "quantity", status=models.OrderLine.PROCESSING
+                ),
+                { "fr": 3 },
+            )
+
+        self.assertEqual(len(self.facts), models.OrderLine.objects.count())
+
+    def test_old_facts_are_loaded_again(self):
+        self.facts.loaded_at -= analytics.LineFacts.MAX_AGE * 2
+        models.Order.objects.filter(shipping_country="de").delete()
+
+        self.facts.refresh()
+
+        self.assertNotIn("de", self.facts.group_by("country", "lines"))
+        self.assertEqual(len(self.facts), models.OrderLine.objects.count())
+
+    def test_deleted_order_is_forgotten(self):
+        facts = analytics.facts
+        facts.build()
+        lines = len(facts)
+
+        models.Order.objects.get(shipping_country="de").delete()
+
+        self.assertNotIn("de", facts.group_by("country", "lines"))
+        self.assertEqual(len(facts), lines - 2)
@@ -0,0 +1,182 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from main import models
+
+
+class TestBenchmarks(TestCase):
+    """
+    Only making sure the scenarios run & clean up after themselves,
+    the numbers themselves are NOT asserted (machine dependent).
+    """
+
+    def run_scenario(self, name, *args):
+        out = StringIO()
+        call_command(
+            "benchmark", name, "--repeat", "1", *args, stdout=out
+        )
+
+        return [
+            line.split("\t")
+            for line in out.getvalue().splitlines()
+        ]
+
+    def test_unknown_scenario_fails(self):
+        with self.assertRaises(CommandError):
+            self.run_scenario("nope")
+
+    def test_checkout_scenario(self):
+        rows = self.run_scenario("checkout", "--sizes", "1", "5")
+
+        self.assertEqual(rows[0], ["units", "queries", "ms"])
+        self.assertEqual(rows[1][1], rows[2][1])
+
+        self.assertFalse(
+            models.Product.objects.filter(slug__startswith="bench-").exists()
+        )
+
+    def test_orderline_storage_scenario(self):
+        rows = self.run_scenario("orderline_storage", "--sizes", "2")
+
+        self.assertEqual(rows[0], ["orders", "layout", "rows", "report_ms"])
+        self.assertEqual(rows[1][:3], ["2", "per-unit", "40"])
+        self.assertEqual(rows[2][:3], ["2", "compact", "10"])
+
+    def test_basket_middleware_scenario(self):
+        rows = self.run_scenario("basket_middleware", "--sizes", "2")
+        basket_queries = { row[1]: row[4] for row in rows[1:] }
+
+        self.assertEqual(basket_queries["/about-us/"], "0")
+        self.assertEqual(basket_queries["/basket/summary/"], "1")
+        self.assertEqual(basket_queries["/api/orders/"], "0")
+
+    def test_basket_merge_scenario(self):
+        rows = self.run_scenario("basket_merge", "--sizes", "2", "10")
+
+        self.assertEqual(rows[0], ["lines", "queries", "ms"])
+        self.assertEqual(rows[1][1], rows[2][1])
+
+    def test_product_listing_scenario(self):
+        rows = self.run_scenario("product_listing", "--sizes", "1", "50")
+
+        self.assertEqual(rows[0], ["page", "mode", "queries", "ms"])
+
+        queries = { (row[0], row[1]): row[2] for row in rows[1:] }
+        self.assertEqual(queries["1", "keyset"], "1")
+        self.assertEqual(queries["50", "keyset"], "1")
+        self.assertEqual(queries["50", "offset"], "2")
+
+    def test_product_search_scenario(self):
+        rows = self.run_scenario("product_search", "--sizes", "5", "20")
+
+        self.assertEqual(rows[0], ["products", "mode", "found", "ms"])
+        self.assertEqual(
+            [row[:3] for row in rows[1:]],
+            [
+                ["5", "icontains", "1"],
+                ["5", "index", "1"],
+                ["20", "icontains", "1"],
+                ["20", "index", "1"],
+            ],
+        )
+
+    def test_tag_filter_scenario(self):
+        rows = self.run_scenario("tag_filter", "--sizes", "100", "300")
+
+        self.assertEqual(rows[0], ["products", "mode", "found", "ms"])
+
+        found = { (row[0], row[1]): row[2] for row in rows[1:] }
+        self.assertEqual(found["100", "bitmap-build"], "100")
+        self.assertEqual(found["300", "orm"], found["300", "bitmap"])
+        self.assertEqual(found["300", "bitmap"], "6")
+        self.assertEqual(found["300", "orm-page"], found["300", "bitmap-page"])
+
+    def test_page_cache_scenario(self):
+        rows = self.run_scenario("page_cache", "--sizes", "3")
+
+        self.assertEqual(
+            rows[0], ["requests", "url", "visitor", "status", "req_per_s"]
+        )
+        self.assertEqual(len(rows), 7)
+        self.assertEqual({ row[3] for row in rows[1:] }, { "200" })
+
+    def test_renditions_scenario(self):
+        rows = self.run_scenario("renditions", "--sizes", "400", "1000")
+
+        self.assertEqual(rows[0][:3], ["upload_px", "upload_kb", "mode"])
+        self.assertEqual(
+            [(row[0], row[2]) for row in rows[1:]],
+            [
+                ("400", "full-decode"), ("400", "draft"),
+                ("1000", "full-decode"), ("1000", "draft"),
+            ],
+        )
+
+    def test_orders_per_day_scenario(self):
+        rows = self.run_scenario("orders_per_day", "--sizes", "200", "20")
+
+        self.assertEqual(rows[0], ["orders", "mode", "rows", "ms"])
+        # 180 days * 3 statuses * 4 countries -> 180 rollup rows at most
+        self.assertEqual(
+            [row[:3] for row in rows[1:]],
+            [
+                ["20", "backfill", "20"],
+                ["20", "group-by", "20"],
+                ["20", "rollup", "20"],
+                ["200", "backfill", "180"],
+                ["200", "group-by", "200"],
+                ["200", "rollup", "180"],
+            ],
+        )
+        self.assertFalse(models.DailyOrderStat.objects.exists())
+
+    def test_most_bought_products_scenario(self):
+        rows = self.run_scenario("most_bought_products", "--sizes", "20")
+
+        self.assertEqual(rows[0], ["orders", "mode", "rows", "ms"])
+        self.assertEqual(
+            [row[1] for row in rows[1:]], ["backfill", "group-by", "rollup"]
+        )
+        self.assertEqual(rows[2][2], "80")
+        self.assertFalse(models.DailyProductSales.objects.exists())
+
+    def test_revenue_scenario(self):
+        rows = self.run_scenario("revenue", "--sizes", "20")
+
+        self.assertEqual(rows[0], ["orders", "mode", "rows", "ms"])
+        self.assertEqual(
+            [row[1:3] for row in rows[1:]],
+            [
+                ["backfill", "80"],
+                ["report-join", "80"],
+                ["report-rollup", "80"],
+                ["invoice-lines", "4"],
+                ["invoice-row", "1"],
+            ],
+        )
+        self.assertFalse(models.DailyProductSales.objects.exists())
+
+    def test_analytics_scenario(self):
+        rows = self.run_scenario("analytics", "--sizes", "20")
+
+        self.assertEqual(rows[0], ["lines", "mode", "query", "ms"])
+        self.assertEqual(
+            [row[1:3] for row in rows[1:4]],
+            [["build", "-"], ["refresh-idle", "-"], ["refresh-100", "-"]],
+        )
+        self.assertEqual(
+            [row[1] for row in rows[4:]], ["orm", "numpy"] * 3
+        )
+
+    def test_report_cache_scenario(self):
+        rows = self.run_scenario("report_cache", "--sizes", "3")
+
+        self.assertEqual(rows[0], ["requests", "mode", "queries", "ms"])
+        queries = { row[1]: int(row[2]) for row in rows[1:] }
+
+        self.assertEqual(set(queries), { "uncached", "cached", "stale-served" })
+        self.assertEqual(queries["cached"] * 3, queries["uncached"])
+        self.assertEqual(queries["stale-served"], 0)
@@ -0,0 +1,66 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.test import TestCase
+
+from main import bitmaps, models
+
+
+class TestTagBitmapIndex(TestCase):
+    def setUp(self):
+        self.tag = models.ProductTag.objects.create(name="Web", slug="web")
+        self.product = models.Product.objects.create(
+            name="Django", slug="django", price=Decimal("1.00")
+        )
+        self.product.tags.add(self.tag)
+
+        self.index = bitmaps.tag_index
+        self.index.ensure_fresh()
+
+    def tagged(self, index=None):
+        index = index or self.index
+        return index.ids(index.select(index.resolve(["web"])))
+
+    def test_bitmap_helpers(self):
+        self.assertEqual(bitmaps.from_ids([1, 2, 4]), 0b10110)
+        self.assertEqual(list(bitmaps.iter_ids(0b10110)), [1, 2, 4])
+        self.assertEqual(bitmaps.popcount(0b10110), 3)
+
+    def test_changes_are_applied_without_rebuild(self):
+        other = models.Product.objects.create(
+            name="Flask", slug="flask", price=Decimal("1.00")
+        )
+        other.tags.add(self.tag)
+
+        # Only the token is read, nothing is rebuilt
+        with self.assertNumQueries(1):
+            self.index.ensure_fresh()
+
+        self.assertEqual(self.tagged(), [self.product.id, other.id])
+
+        self.product.active = False
+        self.product.save()
+        self.assertEqual(self.tagged(), [other.id])
+
+    def test_rolled_back_change_is_not_kept(self):
+        try:
+            with transaction.atomic():
+                self.product.tags.clear()
+                self.assertEqual(self.tagged(), [])
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+
+        self.index.ensure_fresh()
+        self.assertEqual(self.tagged(), [self.product.id])
+
+    def test_change_by_another_process_is_seen(self):
+        # Another worker, with its own index
+        worker = bitmaps.TagBitmapIndex()
+        worker.ensure_fresh()
+
+        self.product.tags.remove(self.tag)
+        self.assertEqual(self.tagged(), [])
+
+        worker.ensure_fresh()
+        self.assertEqual(self.tagged(worker), [])
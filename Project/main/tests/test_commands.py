@@ -0,0 +1,128 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from main import checks
+from main import models
+from main import factories
+
+
+class TestCommands(TestCase):
+    def test_recount_baskets(self):
+        product_one = factories.ProductFactory()
+        product_two = factories.ProductFactory()
+
+        basket = models.Basket.objects.create()
+        empty = models.Basket.objects.create(item_count=7, line_count=2)
+
+        # Written behind the counters' back
+        models.BasketLine.objects.create(
+            basket=basket, product=product_one, quantity=2
+        )
+        models.BasketLine.objects.create(
+            basket=basket, product=product_two, quantity=3
+        )
+
+        out = StringIO()
+        call_command("recount_baskets", stdout=out)
+
+        self.assertEqual(out.getvalue(), "Baskets recounted=2\n")
+
+        basket.refresh_from_db()
+        empty.refresh_from_db()
+
+        self.assertEqual((basket.item_count, basket.line_count), (5, 2))
+        self.assertEqual((empty.item_count, empty.line_count), (0, 0))
+        self.assertTrue(empty.is_empty())
+
+    def test_recount_orders(self):
+        order = factories.OrderFactory()
+        sent = factories.OrderFactory()
+
+        # Written behind the counters' back (`bulk_create` skips the signals)
+        models.OrderLine.objects.bulk_create([
+            models.OrderLine(
+                order=order,
+                product=factories.ProductFactory(),
+                quantity=2,
+                unit_price=Decimal("1.25"),
+            ),
+            models.OrderLine(
+                order=order,
+                product=factories.ProductFactory(),
+                status=models.OrderLine.CANCELLED,
+                unit_price=Decimal("4.00"),
+            ),
+            models.OrderLine(
+                order=sent,
+                product=factories.ProductFactory(),
+                status=models.OrderLine.SENT,
+            ),
+        ])
+
+        out = StringIO()
+        call_command("recount_orders", "--mark-done", stdout=out)
+
+        self.assertEqual(
+            out.getvalue(),
+            "Orders recounted=2\nOrders marked as done=1\n",
+        )
+
+        order.refresh_from_db()
+        sent.refresh_from_db()
+
+        self.assertEqual(order.outstanding_lines, 1)
+        self.assertEqual(order.status, models.Order.NEW)
+        self.assertEqual(order.subtotal, Decimal("6.50"))
+        self.assertEqual(order.total, Decimal("2.50"))
+        self.assertEqual(sent.outstanding_lines, 0)
+        self.assertEqual(sent.status, models.Order.DONE)
+
+    def test_rollup_orders(self):
+        factories.OrderFactory(shipping_country="uk")
+
+        # Written behind the rollup's back (`bulk_create` skips the signals)
+        user = factories.UserFactory()
+        models.Order.objects.bulk_create([
+            models.Order(user=user, shipping_country="uk"),
+            models.Order(
+                user=user, shipping_country="fr", status=models.Order.PAID
+            ),
+        ])
+
+        out = StringIO()
+        call_command("rollup_orders", "--days", "7", stdout=out)
+
+        self.assertEqual(
+            out.getvalue(),
+            "Daily order rows written=2\n"
+            "Daily product sales rows written=0\n",
+        )
+        self.assertEqual(
+            dict(
+                models.DailyOrderStat.objects
+                    .values_list("shipping_country", "orders")
+            ),
+            { "uk": 2, "fr": 1 },
+        )
+
+    def test_check_warns_about_a_per_process_cache(self):
+        locmem = { "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        } }
+        shared = { "default": {
+            "BACKEND": "django.core.cache.backends.memcached.MemcachedCache",
+        } }
+
+        with override_settings(DEBUG=False, CACHES=locmem):
+            warnings = checks.check_shared_cache(None)
+
+        self.assertEqual([w.id for w in warnings], ["main.W001"])
+
+        with override_settings(DEBUG=True, CACHES=locmem):
+            self.assertEqual(checks.check_shared_cache(None), [])
+
+        with override_settings(DEBUG=False, CACHES=shared):
+            self.assertEqual(checks.check_shared_cache(None), [])
@@ -1,11 +1,19 @@
-from io import StringIO
+import os
+import shutil
 import tempfile
+from io import StringIO
 
 from django.conf import settings
 from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from main import caching, models
+from main.management.commands.import_data import read_rows
 
-from main import models
+SAMPLE_CSV = "main/fixtures/product-sample.csv"
+SAMPLE_IMAGES = "main/fixtures/product-sampleimages/"
 
 
 class TestImport(TestCase):
@@ -40,3 +48,238 @@ class TestImport(TestCase):
         self.assertEqual(models.Product.objects.count(), 3)
         # self.assertEqual(models.ProductTag.objects.count(), 6)
         self.assertEqual(models.ProductImage.objects.count(), 3)
+
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    def test_import_data_twice_reuses_products_and_tags(self):
+        args = [SAMPLE_CSV, SAMPLE_IMAGES, "--batch-size", "2"]
+
+        call_command("import_data", *args, stdout=StringIO())
+
+        out = StringIO()
+        call_command("import_data", *args, stdout=out)
+
+        self.assertIn("Products processed=3 (created=0)\n", out.getvalue())
+        self.assertEqual(models.Product.objects.count(), 3)
+        self.assertEqual(models.ProductTag.objects.count(), 6)
+        self.assertEqual(models.ProductImage.objects.count(), 6)
+
+        product = models.Product.objects.get(
+            slug="the-cathedral-and-the-bazaar"
+        )
+        self.assertEqual(
+            sorted(product.tags.values_list("slug", flat=True)),
+            ["open-source", "programming"],
+        )
+        self.assertEqual(product.productimage_set.count(), 2)
+
+        for image in models.ProductImage.objects.all():
+            image.image.delete(save=False)
+
+    @override_settings(MEDIA_ROOT=tempfile.gettempdir())
+    def test_import_data_queries_do_not_grow_with_rows(self):
+        def import_queries(csvfile):
+            with CaptureQueriesContext(connection) as ctx:
+                call_command(
+                    "import_data", csvfile, SAMPLE_IMAGES, stdout=StringIO()
+                )
+
+            return len(ctx.captured_queries)
+
+        # Created by the first import otherwise (not the second)
+        models.CatalogRevision.current()
+
+        with open(SAMPLE_CSV) as fi:
+            header, first_row = fi.readline(), fi.readline()
+
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as one_row:
+            one_row.write(header + first_row)
+            one_row.flush()
+
+            one = import_queries(one_row.name)
+
+        models.Product.objects.all().delete()
+        models.ProductTag.objects.all().delete()
+
+        # ONE batch either way
+        self.assertEqual(import_queries(SAMPLE_CSV), one)
+
+
+class TestStreamingImport(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.images = shutil.copytree(
+            SAMPLE_IMAGES, os.path.join(self.tmp, "images")
+        )
+        self.csvfile = os.path.join(self.tmp, "products.csv")
+
+        with open(SAMPLE_CSV) as fi, open(self.csvfile, "w") as fo:
+            fo.write(fi.read())
+            fo.write(
+                'Multi line,"First line\nSecond line",Manual,'
+                'multi-line.jpg,4.00\n'
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def call(self, *args):
+        out = StringIO()
+
+        with override_settings(MEDIA_ROOT=self.tmp):
+            call_command(
+                "import_data", self.csvfile, self.images,
+                "--batch-size", "2", *args,
+                stdout=out, stderr=StringIO(),
+            )
+
+        return out.getvalue()
+
+    def test_read_rows_gives_the_offset_after_every_row(self):
+        rows = list(read_rows(self.csvfile))
+
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[3][0]["description"], "First line\nSecond line")
+        self.assertEqual(rows[3][1], os.path.getsize(self.csvfile))
+
+        # From the middle of the file, the header is read all the same
+        resumed = list(read_rows(self.csvfile, rows[1][1]))
+        self.assertEqual(resumed, rows[2:])
+
+    def test_checkpoint_is_committed_with_every_batch(self):
+        shutil.copy(
+            os.path.join(self.images, "siddhartha.jpg"),
+            os.path.join(self.images, "multi-line.jpg"),
+        )
+        self.call()
+
+        checkpoint = models.ImportCheckpoint.objects.get()
+        self.assertEqual(checkpoint.source, os.path.abspath(self.csvfile))
+        self.assertEqual(checkpoint.row, 4)
+        self.assertEqual(checkpoint.offset, os.path.getsize(self.csvfile))
+        self.assertTrue(checkpoint.finished)
+
+    def test_import_resumes_after_a_failure(self):
+        # The image of the 4th row is missing -> the 2nd batch fails
+        with self.assertRaises(FileNotFoundError):
+            self.call()
+
+        checkpoint = models.ImportCheckpoint.objects.get()
+        self.assertEqual(checkpoint.row, 2)
+        self.assertFalse(checkpoint.finished)
+        self.assertEqual(models.Product.objects.count(), 2)
+
+        shutil.copy(
+            os.path.join(self.images, "siddhartha.jpg"),
+            os.path.join(self.images, "multi-line.jpg"),
+        )
+        out = self.call("--resume")
+
+        self.assertIn("Products processed=2 (created=2)\n", out)
+        self.assertEqual(models.Product.objects.count(), 4)
+        self.assertEqual(
+            models.Product.objects.get(name="Multi line").description,
+            "First line\nSecond line",
+        )
+
+        # Nothing left to do
+        out = self.call("--resume")
+        self.assertIn("Products processed=0 (created=0)\n", out)
+
+
+class TestDeltaImport(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.images = shutil.copytree(
+            SAMPLE_IMAGES, os.path.join(self.tmp, "images")
+        )
+        self.csvfile = os.path.join(self.tmp, "products.csv")
+        shutil.copy(SAMPLE_CSV, self.csvfile)
+
+        # Created by the first import otherwise (not the second)
+        models.CatalogRevision.current()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def call(self, *args):
+        out = StringIO()
+
+        with override_settings(MEDIA_ROOT=self.tmp):
+            call_command(
+                "import_data", self.csvfile, self.images,
+                "--batch-size", "2", *args,
+                stdout=out, stderr=StringIO(),
+            )
+
+        return out.getvalue()
+
+    def edit_csv(self, old, new):
+        with open(self.csvfile) as fi:
+            content = fi.read()
+
+        with open(self.csvfile, "w") as fo:
+            fo.write(content.replace(old, new))
+
+    def test_unchanged_feed_writes_nothing(self):
+        out = self.call("--delta")
+
+        self.assertIn("Products unchanged=0 updated=0 created=3\n", out)
+        self.assertIn("Images unchanged=0 updated=0 created=3\n", out)
+
+        revision = models.CatalogRevision.current()
+        version = caching.catalog_version()
+
+        with CaptureQueriesContext(connection) as ctx:
+            out = self.call("--delta")
+
+        self.assertIn("Products unchanged=3 updated=0 created=0\n", out)
+        self.assertIn("Images unchanged=3 updated=0 created=0\n", out)
+        self.assertEqual(models.ProductImage.objects.count(), 3)
+
+        writes = [
+            query["sql"] for query in ctx.captured_queries
+            if query["sql"].startswith(("INSERT", "UPDATE", "DELETE"))
+            and "main_product" in query["sql"]
+        ]
+        self.assertEqual(writes, [])
+
+        # Nothing to invalidate either
+        self.assertEqual(models.CatalogRevision.current(), revision)
+        self.assertEqual(caching.catalog_version(), version)
+
+    def test_a_full_import_is_followed_by_a_delta_one(self):
+        self.call()
+        out = self.call("--delta")
+
+        self.assertIn("Products unchanged=3 updated=0 created=0\n", out)
+        self.assertIn("Images unchanged=3 updated=0 created=0\n", out)
+
+    def test_only_the_changed_rows_and_images_are_written(self):
+        self.call("--delta")
+
+        image = models.ProductImage.objects.get(product__name="Siddhartha")
+        previous_hash = image.source_hash
+
+        self.edit_csv("Religion|Narrative,siddhartha.jpg,6.00",
+                      "Narrative|Classic,siddhartha.jpg,7.50")
+        shutil.copy(
+            os.path.join(self.images, "backgammon.jpg"),
+            os.path.join(self.images, "siddhartha.jpg"),
+        )
+        out = self.call("--delta")
+
+        self.assertIn("Products unchanged=2 updated=1 created=0\n", out)
+        self.assertIn("Images unchanged=2 updated=1 created=0\n", out)
+
+        product = models.Product.objects.get(slug="siddhartha")
+        self.assertEqual(str(product.price), "7.50")
+        self.assertEqual(
+            sorted(product.tags.values_list("name", flat=True)),
+            ["Classic", "Narrative"],
+        )
+
+        # Replaced, not duplicated
+        image = product.productimage_set.get()
+        self.assertNotEqual(image.source_hash, previous_hash)
+        self.assertFalse(image.thumbnail)
+        self.assertEqual(models.ProductImage.objects.count(), 3)
@@ -0,0 +1,153 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from main import middlewares, models
+
+
+class TestBasketMiddleware(TestCase):
+    def setUp(self):
+        self.basket = models.Basket.objects.create()
+
+        session = self.client.session
+        session["basket_id"] = self.basket.id
+        session.save()
+
+    def basket_queries(self, ctx):
+        return [
+            query for query in ctx.captured_queries
+            if 'FROM "main_basket"' in query["sql"]
+        ]
+
+    def test_basket_is_not_loaded_unless_used(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get("/api/orders/")
+
+        self.assertEqual(self.basket_queries(ctx), [])
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("main:basket_summary"))
+
+        self.assertEqual(len(self.basket_queries(ctx)), 1)
+        self.assertEqual(response.wsgi_request.basket, self.basket)
+
+    def test_basket_is_loaded_once_per_request(self):
+        request = RequestFactory().get("/")
+        request.session = self.client.session
+
+        middleware = middlewares.basket_middleware(lambda request: None)
+        middleware(request)
+
+        # the session (lazy as well) & the basket
+        with self.assertNumQueries(2):
+            self.assertEqual(request.basket.id, self.basket.id)
+            self.assertEqual(request.basket.count(), 0)
+
+    def test_deleted_basket_degrades_to_none(self):
+        self.basket.delete()
+
+        response = self.client.get(reverse("main:basket"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.wsgi_request.basket)
+        self.assertNotIn("basket_id", self.client.session)
+
+    def test_basket_page_loads_products_with_lines(self):
+        for i in range(3):
+            product = models.Product.objects.create(
+                name="product %d" % i,
+                slug="product-%d" % i,
+                price=Decimal("1.00"),
+            )
+            models.BasketLine.objects.create(
+                basket=self.basket, product=product
+            )
+        self.basket.recount()
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("main:basket"))
+
+        self.assertContains(response, "product 2")
+        self.assertFalse([
+            query for query in ctx.captured_queries
+            if query["sql"].startswith('SELECT "main_product"')
+        ])
+
+
+class TestPageCacheMiddleware(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        self.url = reverse("main:product", args=(self.product.slug,))
+
+    def test_anonymous_pages_are_served_without_queries(self):
+        for url in (reverse("main:about_us"), self.url):
+            first = self.client.get(url)
+            self.assertEqual(first["X-Page-Cache"], "miss")
+
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+
+            self.assertEqual(response["X-Page-Cache"], "hit")
+            self.assertEqual(response.content, first.content)
+            self.assertEqual(response.get("ETag"), first.get("ETag"))
+
+    def test_cached_page_keeps_the_security_headers(self):
+        url = reverse("main:products", args=("all",))
+        first = self.client.get(url)
+        self.assertEqual(first["X-Page-Cache"], "miss")
+        self.assertEqual(first["X-Frame-Options"], "SAMEORIGIN")
+
+        response = self.client.get(url)
+
+        self.assertEqual(response["X-Page-Cache"], "hit")
+        self.assertEqual(response["X-Frame-Options"], "SAMEORIGIN")
+        self.assertEqual(response["Vary"], "Cookie")
+        self.assertEqual(
+            response.get("Cache-Control"), first.get("Cache-Control")
+        )
+
+    def test_cached_page_answers_conditional_gets(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_session_cookie_bypasses_the_cache(self):
+        self.client.get(self.url)
+        self.client.get(
+            reverse("main:add_to_basket"), { "product_id": self.product.id }
+        )
+
+        response = self.client.get(self.url)
+
+        self.assertNotIn("X-Page-Cache", response)
+        self.assertEqual(response.status_code, 200)
+
+    def test_other_pages_are_not_cached(self):
+        response = self.client.get(reverse("main:basket_summary"))
+        self.assertNotIn("X-Page-Cache", response)
+
+        response = self.client.get(reverse("main:contact_us"))
+        self.assertNotIn("X-Page-Cache", response)
+
+    def test_catalog_change_invalidates_the_pages(self):
+        self.client.get(self.url)
+
+        self.product.name = "The new cathedral"
+        self.product.save()
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response["X-Page-Cache"], "miss")
+        self.assertContains(response, "The new cathedral")
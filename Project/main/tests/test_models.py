@@ -1,6 +1,13 @@
+import threading
+import uuid
 from decimal import Decimal
+from unittest import skipUnless
+from unittest.mock import patch
 
-from django.test import TestCase
+from django.db import connection, connections, transaction
+from django.db import DatabaseError, IntegrityError
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 
 from main import models
 from main import factories
@@ -67,4 +74,278 @@ class TestModel(TestCase):
         # same as the prev line, just break it down as a list
         lines = order.lines.all()
         self.assertEquals(lines[0].product, prod_one)
-        self.assertEquals(lines[1].product, prod_two)
\ No newline at end of file
+        self.assertEquals(lines[1].product, prod_two)
+
+    def test_create_order_query_count_does_not_grow(self):
+        """
+        `bulk_create` writes all the lines at once,
+        so a bigger basket shouldn't cost any extra query.
+        """
+
+        user_one = factories.UserFactory(email="checkout@site.com")
+        address = factories.AddressFactory(user=user_one)
+        products = factories.ProductFactory.create_batch(5)
+
+        small = models.Basket.objects.create(user=user_one)
+        models.BasketLine.objects.create(
+            basket=small, product=products[0]
+        )
+
+        big = models.Basket.objects.create(user=user_one)
+        for product in products:
+            models.BasketLine.objects.create(
+                basket=big, product=product, quantity=3
+            )
+
+        with CaptureQueriesContext(connection) as small_ctx:
+            small.create_order(address, address)
+
+        with CaptureQueriesContext(connection) as big_ctx:
+            order = big.create_order(address, address)
+
+        self.assertEqual(
+            len(small_ctx.captured_queries),
+            len(big_ctx.captured_queries),
+        )
+        # one row per product, carrying the quantity
+        self.assertEqual(order.lines.count(), 5)
+        self.assertEqual(
+            sorted(order.lines.values_list("quantity", flat=True)),
+            [3, 3, 3, 3, 3],
+        )
+
+    def test_create_order_adds_to_the_sales_rollup(self):
+        user_one = factories.UserFactory(email="checkout@site.com")
+        address = factories.AddressFactory(user=user_one)
+        product = factories.ProductFactory(price=Decimal("2.50"))
+
+        for quantity in (3, 1):
+            basket = models.Basket.objects.create(user=user_one)
+            models.BasketLine.objects.create(
+                basket=basket, product=product, quantity=quantity
+            )
+            order = basket.create_order(address, address)
+
+        sales = models.DailyProductSales.objects.get()
+
+        self.assertEqual(sales.day, order.added_on)
+        self.assertEqual(sales.product, product)
+        self.assertEqual((sales.units, sales.revenue), (4, Decimal("10.00")))
+
+    def test_create_order_captures_the_prices(self):
+        user_one = factories.UserFactory(email="prices@site.com")
+        address = factories.AddressFactory(user=user_one)
+        cheap = factories.ProductFactory(price=Decimal("1.00"))
+        dear = factories.ProductFactory(price=Decimal("2.50"))
+
+        basket = models.Basket.objects.create(user=user_one)
+        basket.add_products({ cheap.id: 2, dear.id: 3 })
+        order = basket.create_order(address, address)
+
+        cheap.price = dear.price = Decimal("9.99")
+        cheap.save()
+        dear.save()
+
+        order = models.Order.objects.get(pk=order.pk)
+
+        self.assertEqual(
+            sorted(order.lines.values_list("quantity", "unit_price")),
+            [(2, Decimal("1.00")), (3, Decimal("2.50"))],
+        )
+        self.assertEqual(order.subtotal, Decimal("9.50"))
+        self.assertEqual(order.total, Decimal("9.50"))
+
+    def test_create_order_is_atomic(self):
+        """
+        Nothing should be left behind if writing the lines fails.
+        """
+
+        user_one = factories.UserFactory(email="checkout@site.com")
+        address = factories.AddressFactory(user=user_one)
+
+        basket = models.Basket.objects.create(user=user_one)
+        models.BasketLine.objects.create(
+            basket=basket, product=factories.ProductFactory(), quantity=2
+        )
+
+        with patch.object(
+            models.OrderLine.objects, "bulk_create",
+            side_effect=DatabaseError("boom"),
+        ):
+            with self.assertRaises(DatabaseError):
+                basket.create_order(address, address)
+
+        basket.refresh_from_db()
+
+        self.assertEqual(basket.status, models.Basket.OPEN)
+        self.assertFalse(
+            models.Order.objects.filter(user=user_one).exists()
+        )
+
+    def test_create_order_twice_returns_the_same_order(self):
+        user_one = factories.UserFactory(email="checkout@site.com")
+        address = factories.AddressFactory(user=user_one)
+
+        basket = models.Basket.objects.create(user=user_one)
+        models.BasketLine.objects.create(
+            basket=basket, product=factories.ProductFactory()
+        )
+
+        key = uuid.uuid4()
+        first = basket.create_order(address, address, idempotency_key=key)
+
+        # e.g. another tab, holding a stale copy of the basket
+        stale = models.Basket.objects.get(pk=basket.pk)
+        stale.status = models.Basket.OPEN
+
+        with self.assertNumQueries(4):
+            second = stale.create_order(address, address)
+
+        self.assertEqual(first, second)
+        self.assertEqual(first.idempotency_key, key)
+        self.assertEqual(models.Order.objects.filter(user=user_one).count(), 1)
+        self.assertEqual(models.OrderLine.objects.filter(order=first).count(), 1)
+
+    def test_create_order_with_a_used_key_returns_that_order(self):
+        user_one = factories.UserFactory(email="resubmit@site.com")
+        address = factories.AddressFactory(user=user_one)
+        key = uuid.uuid4()
+
+        baskets = []
+
+        for i in range(2):
+            basket = models.Basket.objects.create(user=user_one)
+            models.BasketLine.objects.create(
+                basket=basket, product=factories.ProductFactory()
+            )
+            baskets.append(basket)
+
+        first = baskets[0].create_order(address, address, idempotency_key=key)
+
+        # e.g. the checkout form posted again, once a new basket was opened
+        second = baskets[1].create_order(address, address, idempotency_key=key)
+
+        self.assertEqual(first, second)
+        self.assertEqual(models.Order.objects.filter(user=user_one).count(), 1)
+
+        baskets[1].refresh_from_db()
+        self.assertEqual(baskets[1].status, models.Basket.OPEN)
+
+    def test_idempotency_key_is_unique_per_user(self):
+        """
+        The concurrent checkouts (`TestCheckoutConcurrency`) need row
+        locking, this is the constraint behind them, on any backend.
+        """
+
+        users = [
+            factories.UserFactory(email="one@site.com"),
+            factories.UserFactory(email="two@site.com"),
+        ]
+        address = factories.AddressFactory(user=users[0])
+        key = uuid.uuid4()
+
+        # Another user, the same key -> a different order
+        factories.OrderFactory(user=users[1], idempotency_key=key)
+
+        basket = models.Basket.objects.create(user=users[0])
+        models.BasketLine.objects.create(
+            basket=basket, product=factories.ProductFactory()
+        )
+        order = basket.create_order(address, address, idempotency_key=key)
+
+        self.assertEqual(order.user, users[0])
+        self.assertEqual(
+            models.Order.objects.filter(idempotency_key=key).count(), 2
+        )
+
+        # The same user, the same key (two checkouts racing)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            factories.OrderFactory(user=users[0], idempotency_key=key)
+
+        # No key at all, as many as needed
+        factories.OrderFactory.create_batch(2, user=users[0])
+
+    def test_basket_add_products_upserts(self):
+        prod_one, prod_two = factories.ProductFactory.create_batch(2)
+        basket = models.Basket.objects.create()
+
+        # savepoint, upsert, counters, release (+ counting the lines, SQLite)
+        with self.assertNumQueries(4 if connection.vendor == "postgresql" else 5):
+            new_lines = basket.add_products({ prod_one.id: 2 })
+
+        self.assertEqual(new_lines, 1)
+
+        new_lines = basket.add_products({ prod_one.id: 1, prod_two.id: 4 })
+        self.assertEqual(new_lines, 1)
+
+        self.assertEqual(
+            dict(basket.basketline_set.values_list("product", "quantity")),
+            { prod_one.id: 3, prod_two.id: 4 },
+        )
+
+        self.assertEqual((basket.item_count, basket.line_count), (7, 2))
+        basket.refresh_from_db()
+        self.assertEqual((basket.item_count, basket.line_count), (7, 2))
+
+
+@skipUnless(
+    connection.features.has_select_for_update,
+    "Row locking (SELECT ... FOR UPDATE) is not supported by the backend",
+)
+class TestCheckoutConcurrency(TransactionTestCase):
+    """
+    Many threads checking out the SAME basket at the same time,
+    each one with its own DB connection (just like parallel requests).
+    """
+
+    THREADS = 12
+
+    def test_concurrent_checkouts_create_one_order(self):
+        user_one = factories.UserFactory(email="checkout@site.com")
+        address = factories.AddressFactory(user=user_one)
+
+        basket = models.Basket.objects.create(user=user_one)
+        for product in factories.ProductFactory.create_batch(3):
+            models.BasketLine.objects.create(
+                basket=basket, product=product, quantity=2
+            )
+
+        barrier = threading.Barrier(self.THREADS)
+        orders = []
+        errors = []
+
+        def checkout():
+            try:
+                own_basket = models.Basket.objects.get(pk=basket.pk)
+                barrier.wait()
+
+                orders.append(
+                    own_basket.create_order(
+                        address, address, idempotency_key=uuid.uuid4()
+                    )
+                )
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=checkout)
+            for i in range(self.THREADS)
+        ]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(orders), self.THREADS)
+        self.assertEqual(len({order.id for order in orders}), 1)
+
+        self.assertEqual(
+            models.Order.objects.filter(user=user_one).count(), 1
+        )
+        self.assertEqual(
+            models.OrderLine.objects.filter(order__user=user_one).count(), 3
+        )
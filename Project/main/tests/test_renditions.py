@@ -0,0 +1,90 @@
+from io import BytesIO
+
+from django.test import SimpleTestCase
+
+from PIL import Image
+
+from main import renditions
+
+
+def make_upload(width, height, kind="JPEG", **options):
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    output = BytesIO()
+    image.save(output, kind, **options)
+
+    return output.getvalue()
+
+
+class TestRenditions(SimpleTestCase):
+    def test_target_widths_never_upscale(self):
+        self.assertEqual(renditions.target_widths(2000), [1280, 640, 320])
+        self.assertEqual(renditions.target_widths(1000), [1000, 640, 320])
+        self.assertEqual(renditions.target_widths(200), [200])
+
+    def test_every_width_in_both_formats(self):
+        result = renditions.render(make_upload(1600, 1200))
+
+        self.assertEqual(
+            [(width, kind) for width, kind, content in result["renditions"]],
+            [
+                (1280, "jpeg"), (1280, "webp"),
+                (640, "jpeg"), (640, "webp"),
+                (320, "jpeg"), (320, "webp"),
+            ],
+        )
+
+        for width, kind, content in result["renditions"]:
+            with Image.open(BytesIO(content)) as image:
+                self.assertEqual(image.format, kind.upper())
+                self.assertEqual(image.size, (width, width * 3 // 4))
+
+    def test_large_jpeg_is_decoded_reduced(self):
+        image = renditions.open_reduced(make_upload(4000, 3000), 640)
+
+        # 1/4 scale by the JPEG decoder itself, never 4000px wide
+        self.assertEqual(image.size, (1000, 750))
+
+    def test_other_formats_are_reduced_too(self):
+        image = renditions.open_reduced(make_upload(4000, 3000, "PNG"), 640)
+
+        self.assertEqual(image.size, (667, 500))
+
+    def test_rotated_photo_is_rendered_upright(self):
+        exif = Image.Exif()
+        exif[renditions.ORIENTATION] = 6
+
+        # Stored 800x600 & sideways, shown 600x800
+        image = renditions.open_reduced(make_upload(800, 600, exif=exif), 300)
+        self.assertEqual(image.size, (300, 400))
+
+        result = renditions.render(make_upload(800, 600, exif=exif))
+
+        self.assertEqual(
+            [(width, kind) for width, kind, content in result["renditions"]],
+            [(600, "jpeg"), (600, "webp"), (320, "jpeg"), (320, "webp")],
+        )
+
+        width, kind, content = result["renditions"][0]
+
+        with Image.open(BytesIO(content)) as image:
+            self.assertEqual(image.size, (600, 800))
+            self.assertNotIn(renditions.ORIENTATION, image.getexif())
+
+            # The (vertical) gradient was turned a quarter, left to right
+            left, right = image.getpixel((5, 400)), image.getpixel((594, 400))
+            top, bottom = image.getpixel((300, 5)), image.getpixel((300, 794))
+
+        self.assertGreater(abs(left[0] - right[0]), 200)
+        self.assertLess(abs(top[0] - bottom[0]), 20)
+
+    def test_metadata_is_stripped_and_jpeg_is_progressive(self):
+        exif = Image.Exif()
+        exif[0x010F] = "Camera maker"
+
+        result = renditions.render(make_upload(800, 600, exif=exif))
+        width, kind, content = result["renditions"][0]
+
+        with Image.open(BytesIO(content)) as image:
+            self.assertTrue(image.info.get("progressive"))
+            self.assertNotIn("exif", image.info)
+            self.assertNotIn("icc_profile", image.info)
@@ -1,9 +1,16 @@
 from decimal import Decimal
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.core.files.images import ImageFile
+from django.urls import reverse
+from django.utils import timezone
 
+from main import factories
 from main import models
+from main import reports
+from main import thumbnails
 
 
 class TestSignals(TestCase):
@@ -39,6 +46,12 @@ class TestSignals(TestCase):
                 image.save()
 
         self.assertGreaterEqual(len(cm.output), 1)
+
+        # Off the request, the worker runs the job once the data is committed
+        image.refresh_from_db()
+        self.assertFalse(image.thumbnail)
+        self.assertTrue(thumbnails.generate(image.id))
+
         image.refresh_from_db()
 
         with open("main/fixtures/the-cathedral-the-bazaar.thumb.jpg", "rb") as fi:
@@ -47,3 +60,377 @@ class TestSignals(TestCase):
 
         image.thumbnail.delete(save=False)
         image.image.delete(save=False)
+
+    def test_thumbnail_is_only_queued_for_a_new_image(self):
+        product = factories.ProductFactory()
+
+        with open("main/fixtures/the-cathedral-the-bazaar.jpg", "rb") as fi:
+            image = models.ProductImage.objects.create(
+                product=product, image=ImageFile(fi, name="tctb.jpg")
+            )
+        self.assertTrue(image._thumbnail_needed)
+
+        thumbnails.generate(image.id)
+        image = models.ProductImage.objects.get(pk=image.pk)
+        thumbnail = image.thumbnail.name
+
+        # Saving the other fields doesn't touch the thumbnail
+        image.save()
+        self.assertFalse(image._thumbnail_needed)
+        image.refresh_from_db()
+        self.assertEqual(image.thumbnail.name, thumbnail)
+
+        # Another image -> the old thumbnail is gone, a new one is queued
+        old_image = image.image.name
+        with open("main/fixtures/the-cathedral-the-bazaar.jpg", "rb") as fi:
+            image.image = ImageFile(fi, name="other.jpg")
+            image.save()
+        self.assertTrue(image._thumbnail_needed)
+        image.refresh_from_db()
+        self.assertFalse(image.thumbnail)
+
+        image.image.storage.delete(old_image)
+        image.image.storage.delete(thumbnail)
+        image.image.delete(save=False)
+
+    def test_login_merge_sums_same_products(self):
+        user = models.User.objects.create_user("merge@example.com", "pwd-merge")
+        prod_one = factories.ProductFactory(slug="product-one")
+        prod_two = factories.ProductFactory(slug="product-two")
+
+        loggedin = models.Basket.objects.create(user=user)
+        loggedin.add_products({ prod_one.id: 2 })
+
+        self.client.get(
+            reverse("main:add_to_basket"), { "product_id": prod_one.id }
+        )
+        self.client.get(
+            reverse("main:add_to_basket"), { "product_id": prod_two.id }
+        )
+        anonymous_id = self.client.session["basket_id"]
+
+        with self.assertLogs("main.signals", level="INFO"):
+            self.client.post(
+                reverse("main:login"),
+                { "email": "merge@example.com", "password": "pwd-merge" },
+            )
+
+        self.assertFalse(models.Basket.objects.filter(pk=anonymous_id).exists())
+        self.assertEqual(self.client.session["basket_id"], loggedin.id)
+
+        loggedin.refresh_from_db()
+        self.assertEqual(
+            dict(loggedin.basketline_set.values_list("product", "quantity")),
+            { prod_one.id: 3, prod_two.id: 1 },
+        )
+        self.assertEqual((loggedin.item_count, loggedin.line_count), (4, 2))
+
+    def test_basket_merge_cost_does_not_grow(self):
+        products = factories.ProductFactory.create_batch(20)
+
+        def merge(size):
+            loggedin = models.Basket.objects.create()
+            loggedin.add_products({ products[0].id: 1 })
+
+            anonymous = models.Basket.objects.create()
+            anonymous.add_products({
+                product.id: 1 for product in products[:size]
+            })
+
+            with CaptureQueriesContext(connection) as ctx:
+                loggedin.merge(anonymous)
+
+            self.assertEqual(loggedin.item_count, size + 1)
+            self.assertEqual(loggedin.line_count, size)
+
+            return len(ctx.captured_queries)
+
+        self.assertEqual(merge(2), merge(20))
+
+    def test_order_is_done_once_every_line_is_sent(self):
+        order = factories.OrderFactory()
+        factories.OrderLineFactory.create_batch(
+            3, order=order, product=factories.ProductFactory()
+        )
+
+        order.refresh_from_db()
+        self.assertEqual(order.outstanding_lines, 3)
+
+        for line in models.OrderLine.objects.filter(order=order)[:2]:
+            line.status = models.OrderLine.SENT
+            line.save()
+
+        order.refresh_from_db()
+        self.assertEqual(order.outstanding_lines, 1)
+        self.assertEqual(order.status, models.Order.NEW)
+
+        # Saving twice with the same status doesn't count twice
+        line.save()
+        order.refresh_from_db()
+        self.assertEqual(order.outstanding_lines, 1)
+
+        last = models.OrderLine.objects.get(
+            order=order, status=models.OrderLine.NEW
+        )
+        last.status = models.OrderLine.CANCELLED
+        last.save()
+
+        order.refresh_from_db()
+        self.assertEqual(order.outstanding_lines, 0)
+        self.assertEqual(order.status, models.Order.DONE)
+
+    def test_stale_line_does_not_count_its_change_twice(self):
+        order = factories.OrderFactory()
+        factories.OrderLineFactory.create_batch(
+            2, order=order, product=factories.ProductFactory()
+        )
+
+        line = models.OrderLine.objects.filter(order=order).first()
+
+        # Both loaded as NEW (e.g. two requests at once)
+        first = models.OrderLine.objects.get(pk=line.pk)
+        second = models.OrderLine.objects.get(pk=line.pk)
+
+        for copy in (first, second):
+            copy.status = models.OrderLine.SENT
+            copy.save()
+
+        order.refresh_from_db()
+        self.assertEqual(order.outstanding_lines, 1)
+        self.assertEqual(order.status, models.Order.NEW)
+
+    def test_orderline_status_change_cost_does_not_grow(self):
+        def send_one(size):
+            order = factories.OrderFactory()
+            factories.OrderLineFactory.create_batch(
+                size, order=order, product=factories.ProductFactory()
+            )
+
+            line = models.OrderLine.objects.filter(order=order).first()
+            line.status = models.OrderLine.SENT
+
+            with CaptureQueriesContext(connection) as ctx:
+                line.save()
+
+            return len(ctx.captured_queries)
+
+        self.assertEqual(send_one(2), send_one(30))
+
+    def test_daily_order_stats_follow_the_orders(self):
+        def stats():
+            return {
+                (stat.status, stat.shipping_country): stat.orders
+                for stat in models.DailyOrderStat.objects.filter(
+                    orders__gt=0, shipping_country__in=("uk", "fr")
+                )
+            }
+
+        uk = factories.OrderFactory(shipping_country="uk")
+        factories.OrderFactory(shipping_country="fr")
+        line = factories.OrderLineFactory(
+            order=uk, product=factories.ProductFactory()
+        )
+
+        self.assertEqual(
+            stats(), { (models.Order.NEW, "uk"): 1, (models.Order.NEW, "fr"): 1 }
+        )
+
+        # e.g. the admin
+        order = models.Order.objects.get(pk=uk.pk)
+        order.status = models.Order.PAID
+        order.save()
+
+        self.assertEqual(
+            stats(), { (models.Order.PAID, "uk"): 1, (models.Order.NEW, "fr"): 1 }
+        )
+
+        # An `UPDATE` (no signal) once every line is sent
+        line.status = models.OrderLine.SENT
+        line.save()
+
+        self.assertEqual(
+            stats(), { (models.Order.DONE, "uk"): 1, (models.Order.NEW, "fr"): 1 }
+        )
+
+        order.refresh_from_db()
+        order.delete()
+
+        self.assertEqual(stats(), { (models.Order.NEW, "fr"): 1 })
+
+    def test_stale_order_does_not_move_in_the_rollup_twice(self):
+        order = factories.OrderFactory(shipping_country="uk")
+
+        # Both loaded as NEW (e.g. two admins at once)
+        first = models.Order.objects.get(pk=order.pk)
+        second = models.Order.objects.get(pk=order.pk)
+
+        for copy in (first, second):
+            copy.status = models.Order.PAID
+            copy.save()
+
+        self.assertEqual(
+            {
+                stat.status: stat.orders
+                for stat in models.DailyOrderStat.objects.filter(
+                    shipping_country="uk"
+                )
+                if stat.orders
+            },
+            { models.Order.PAID: 1 },
+        )
+
+    def test_daily_product_sales_follow_the_lines(self):
+        product = factories.ProductFactory(price=Decimal("2.00"))
+        order = factories.OrderFactory()
+        line = factories.OrderLineFactory(
+            order=order, product=product, quantity=2
+        )
+
+        def sales():
+            stat = models.DailyProductSales.objects.get(product=product)
+            return stat.units, stat.revenue
+
+        self.assertEqual(sales(), (2, Decimal("4.00")))
+
+        # e.g. the admin
+        line = models.OrderLine.objects.get(pk=line.pk)
+        line.quantity = 5
+        line.save()
+        self.assertEqual(sales(), (5, Decimal("10.00")))
+
+        # Only the status, nothing to add
+        line.status = models.OrderLine.SENT
+        line.save()
+        self.assertEqual(sales(), (5, Decimal("10.00")))
+
+        order.delete()
+        self.assertEqual(sales(), (0, Decimal("0.00")))
+
+    def test_cancelled_line_leaves_the_sales_reports(self):
+        product = factories.ProductFactory(price=Decimal("10.00"))
+        order = factories.OrderFactory()
+        line = factories.OrderLineFactory(
+            order=order, product=product, quantity=3
+        )
+        today = timezone.localdate()
+
+        def sold():
+            revenue = reports.revenue_per_day(today, today)
+            top = reports.most_bought_products(today, today)
+            return revenue["total"], dict(zip(top["labels"], top["values"]))
+
+        self.assertEqual(sold(), (Decimal("30.00"), { product.name: 3 }))
+
+        # e.g. the admin
+        line = models.OrderLine.objects.get(pk=line.pk)
+        line.status = models.OrderLine.CANCELLED
+        line.save()
+
+        order.refresh_from_db()
+        self.assertEqual(order.total, Decimal("0.00"))
+        self.assertEqual(sold(), (0, { }))
+
+        # Same once rebuilt (e.g. './manage.py rollup_orders')
+        models.DailyProductSales.objects.rebuild(today, today)
+        self.assertEqual(sold(), (0, { }))
+
+        # Back again
+        line.status = models.OrderLine.NEW
+        line.save()
+        self.assertEqual(sold(), (Decimal("30.00"), { product.name: 3 }))
+
+    def test_daily_product_sales_follow_a_product_change(self):
+        old = factories.ProductFactory(price=Decimal("2.00"))
+        new = factories.ProductFactory(price=Decimal("3.00"))
+        line = factories.OrderLineFactory(
+            order=factories.OrderFactory(), product=old, quantity=2
+        )
+
+        def sales(product):
+            stat = models.DailyProductSales.objects.get(product=product)
+            return stat.units, stat.revenue
+
+        # e.g. the admin
+        line = models.OrderLine.objects.get(pk=line.pk)
+        line.product = new
+        line.save()
+
+        self.assertEqual(sales(old), (0, Decimal("0.00")))
+        self.assertEqual(sales(new), (2, Decimal("6.00")))
+
+        line.delete()
+        self.assertEqual(sales(new), (0, Decimal("0.00")))
+
+    def test_order_totals_follow_the_lines(self):
+        product = factories.ProductFactory(price=Decimal("2.00"))
+        order = factories.OrderFactory()
+        line = factories.OrderLineFactory(
+            order=order, product=product, quantity=2
+        )
+        factories.OrderLineFactory(
+            order=order, product=product, unit_price=Decimal("0.50")
+        )
+
+        def totals():
+            order.refresh_from_db()
+            return order.subtotal, order.total
+
+        # The price is captured when the line is written
+        self.assertEqual(line.unit_price, Decimal("2.00"))
+        self.assertEqual(totals(), (Decimal("4.50"), Decimal("4.50")))
+
+        product.price = Decimal("3.00")
+        product.save()
+
+        # e.g. the admin
+        line = models.OrderLine.objects.get(pk=line.pk)
+        line.quantity = 5
+
+        with CaptureQueriesContext(connection) as ctx:
+            line.save()
+
+        self.assertEqual(line.unit_price, Decimal("2.00"))
+        self.assertEqual(totals(), (Decimal("10.50"), Decimal("10.50")))
+        self.assertNotIn(
+            "SUM(", " ".join(query["sql"] for query in ctx.captured_queries)
+        )
+
+        # Still ordered, not paid for
+        line.status = models.OrderLine.CANCELLED
+        line.save()
+        self.assertEqual(totals(), (Decimal("10.50"), Decimal("0.50")))
+
+        line.delete()
+        self.assertEqual(totals(), (Decimal("0.50"), Decimal("0.50")))
+        self.assertEqual(
+            models.DailyProductSales.objects
+                .filter(product=product)
+                .values_list("units", "revenue")
+                .get(),
+            (1, Decimal("0.50")),
+        )
+
+    def test_line_moved_to_another_product_takes_its_price(self):
+        order = factories.OrderFactory()
+        line = factories.OrderLineFactory(
+            order=order,
+            product=factories.ProductFactory(price=Decimal("2.00")),
+            quantity=2,
+        )
+        other = factories.ProductFactory(price=Decimal("3.50"))
+
+        # e.g. the admin
+        line = models.OrderLine.objects.get(pk=line.pk)
+        line.product = other
+        line.save()
+
+        order.refresh_from_db()
+        self.assertEqual(line.unit_price, Decimal("3.50"))
+        self.assertEqual(order.subtotal, Decimal("7.00"))
+
+        # Same product, the snapshot stays
+        other.price = Decimal("9.00")
+        other.save()
+        line.quantity = 1
+        line.save()
+        self.assertEqual(line.unit_price, Decimal("3.50"))
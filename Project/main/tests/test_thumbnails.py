@@ -0,0 +1,102 @@
+from io import BytesIO
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.files.images import ImageFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from PIL import Image
+
+from main import models, renditions, thumbnails
+
+FIXTURE = "main/fixtures/the-cathedral-the-bazaar.jpg"
+
+
+def make_image(name="tctb.jpg"):
+    product = models.Product.objects.create(
+        name="The cathedral and the bazaar",
+        slug="cathedral-bazaar",
+        price=Decimal("10.00"),
+    )
+
+    with open(FIXTURE, "rb") as fi:
+        return models.ProductImage.objects.create(
+            product=product, image=ImageFile(fi, name=name)
+        )
+
+
+def delete_files(image):
+    image.refresh_from_db()
+
+    for rendition in image.renditions.all():
+        rendition.file.delete(save=False)
+
+    image.thumbnail.delete(save=False)
+    image.image.delete(save=False)
+
+
+class TestThumbnails(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_render_thumbnail_fits_the_size(self):
+        with open(FIXTURE, "rb") as fi:
+            content = renditions.render(fi.read())["thumbnail"]
+
+        with Image.open(BytesIO(content)) as thumbnail:
+            self.assertEqual(thumbnail.format, "JPEG")
+            self.assertLessEqual(thumbnail.size[0], 300)
+            self.assertLessEqual(thumbnail.size[1], 300)
+
+    def test_placeholder_until_the_thumbnail_is_ready(self):
+        image = make_image()
+        url = reverse("main:product", args=(image.product.slug,))
+
+        self.assertContains(self.client.get(url), thumbnails.PLACEHOLDER)
+
+        thumbnails.generate(image.id)
+        image.refresh_from_db()
+
+        response = self.client.get(url)
+        self.assertNotContains(response, thumbnails.PLACEHOLDER)
+        self.assertContains(response, image.thumbnail.url)
+
+        # The renditions come along, as `srcset`s for the `ImageBox`
+        srcsets = image.srcsets()
+        self.assertEqual(set(srcsets), { "jpeg", "webp" })
+        self.assertIn("w, ", srcsets["webp"])
+        self.assertContains(response, srcsets["jpeg"])
+
+        delete_files(image)
+
+    def test_stale_thumbnail_is_thrown_away(self):
+        image = make_image()
+
+        def replaced_meanwhile(data):
+            models.ProductImage.objects \
+                .filter(pk=image.pk) \
+                .update(image="product-images/another.jpg")
+            return renditions.render(data)
+
+        name = image.image.name
+        self.assertFalse(thumbnails.generate(image.id, replaced_meanwhile))
+
+        image.refresh_from_db()
+        self.assertFalse(image.thumbnail)
+        self.assertFalse(image.renditions.exists())
+        image.image.storage.delete(name)
+
+
+@override_settings(THUMBNAIL_WORKERS=1)
+class TestThumbnailWorker(TransactionTestCase):
+    def test_save_does_not_wait_for_the_thumbnail(self):
+        image = make_image()
+
+        thumbnails.worker.join()
+        image.refresh_from_db()
+
+        self.assertTrue(image.thumbnail)
+        self.assertTrue(image.thumbnail.name.startswith("product-thumbnails/"))
+
+        delete_files(image)
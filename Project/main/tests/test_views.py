@@ -1,16 +1,28 @@
 import sys
+import json
+import time
+import base64
 from decimal import Decimal
 from unittest.mock import patch
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.images import ImageFile
+from django.db import connection
+from django.test import TestCase, modify_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.http import http_date
 
 from django.contrib import auth
 
-from main import forms, models
+from main import bitmaps, caching, forms, models, pagination
 
 
 class TestPage(TestCase):
+    def setUp(self):
+        # The cache isn't rolled back along with the database
+        cache.clear()
+
     def test_home_page_works(self):
         """
         Frankly, these comments aren't necessary for me.
@@ -325,4 +337,620 @@ class TestPage(TestCase):
         # Assign the added products to the current user
         basket = models.Basket.objects.get(user=user_one)
 
-        self.assertEquals(basket.count(), 3)
\ No newline at end of file
+        self.assertEquals(basket.count(), 3)
+
+    def test_address_select_double_submit_creates_one_order(self):
+        user_one = models.User.objects.create_user(
+            "user_one@example.com", "thisisfun"
+        )
+        address = models.Address.objects.create(
+            user=user_one,
+            name="john snow",
+            address1="north land",
+            zip_code="888899",
+            city="tully",
+            country="uk",
+        )
+        product = models.Product.objects.create(
+            name="product One",
+            slug="product-one",
+            price=Decimal("1.00"),
+        )
+
+        self.client.force_login(user_one)
+        self.client.get(
+            reverse("main:add_to_basket"), { "product_id": product.id }
+        )
+
+        response = self.client.get(reverse("main:address_select"))
+        key = response.context["form"].initial["idempotency_key"]
+
+        post_data = {
+            "billing_address": address.id,
+            "shipping_address": address.id,
+            "idempotency_key": key,
+        }
+
+        for i in range(2):
+            response = self.client.post(
+                reverse("main:address_select"), post_data
+            )
+            self.assertRedirects(response, reverse("main:checkout_done"))
+
+        self.assertEqual(
+            models.Order.objects.filter(user=user_one).count(), 1
+        )
+        self.assertNotIn("basket_id", self.client.session)
+
+    def test_basket_counters_follow_add_and_update(self):
+        prod_one = models.Product.objects.create(
+            name="product One", slug="product-one", price=Decimal("1.00"),
+        )
+        prod_two = models.Product.objects.create(
+            name="product Two", slug="product-two", price=Decimal("2.00"),
+        )
+
+        for product in (prod_one, prod_one, prod_two):
+            self.client.get(
+                reverse("main:add_to_basket"), { "product_id": product.id }
+            )
+
+        basket = models.Basket.objects.get()
+        self.assertEqual((basket.item_count, basket.line_count), (3, 2))
+
+        lines = list(basket.basketline_set.order_by("id"))
+        response = self.client.post(reverse("main:basket"), {
+            "basketline_set-TOTAL_FORMS": 2,
+            "basketline_set-INITIAL_FORMS": 2,
+            "basketline_set-MIN_NUM_FORMS": 0,
+            "basketline_set-MAX_NUM_FORMS": 1000,
+            "basketline_set-0-id": lines[0].id,
+            "basketline_set-0-quantity": 5,
+            "basketline_set-1-id": lines[1].id,
+            "basketline_set-1-quantity": 1,
+            "basketline_set-1-DELETE": "on",
+        })
+        self.assertEqual(response.status_code, 200)
+
+        basket.refresh_from_db()
+        self.assertEqual((basket.item_count, basket.line_count), (5, 1))
+
+    def test_basket_widget_does_not_query_basket_lines(self):
+        product = models.Product.objects.create(
+            name="product One", slug="product-one", price=Decimal("1.00"),
+        )
+        self.client.get(
+            reverse("main:add_to_basket"), { "product_id": product.id }
+        )
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("main:basket_summary"))
+
+        self.assertEqual(response.json(), { "count": 1 })
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertFalse([
+            query for query in ctx.captured_queries
+            if "main_basketline" in query["sql"]
+        ])
+
+    def test_pages_do_not_load_the_basket(self):
+        product = models.Product.objects.create(
+            name="product One", slug="product-one", price=Decimal("1.00"),
+        )
+        self.client.get(
+            reverse("main:add_to_basket"), { "product_id": product.id }
+        )
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("main:about_us"))
+
+        self.assertContains(response, 'id="basket-widget"')
+        self.assertContains(response, reverse("main:basket_summary"))
+        self.assertFalse([
+            query for query in ctx.captured_queries
+            if 'FROM "main_basket"' in query["sql"]
+        ])
+
+    def test_basket_summary_without_a_basket(self):
+        response = self.client.get(reverse("main:basket_summary"))
+
+        self.assertEqual(response.json(), { "count": 0 })
+        self.assertNotIn("sessionid", response.cookies)
+
+    def test_add_many_to_basket_works(self):
+        prod_one = models.Product.objects.create(
+            name="product One", slug="product-one", price=Decimal("1.00"),
+        )
+        prod_two = models.Product.objects.create(
+            name="product Two", slug="product-two", price=Decimal("2.00"),
+        )
+
+        self.client.get(
+            reverse("main:add_to_basket"), { "product_id": prod_one.id }
+        )
+
+        response = self.client.post(
+            reverse("main:add_many_to_basket"),
+            {
+                "product_id": [prod_one.id, prod_two.id, prod_two.id],
+                "quantity": [2, 3],
+            },
+        )
+        self.assertRedirects(response, reverse("main:basket"))
+
+        basket = models.Basket.objects.get()
+        self.assertEqual(
+            dict(basket.basketline_set.values_list("product", "quantity")),
+            { prod_one.id: 3, prod_two.id: 4 },
+        )
+        self.assertEqual((basket.item_count, basket.line_count), (7, 2))
+
+    def test_add_many_to_basket_rejects_bad_input(self):
+        product = models.Product.objects.create(
+            name="product One", slug="product-one", price=Decimal("1.00"),
+        )
+        url = reverse("main:add_many_to_basket")
+
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.assertEqual(
+            self.client.post(
+                url, { "product_id": product.id, "quantity": 0 }
+            ).status_code,
+            400,
+        )
+        self.assertEqual(
+            self.client.post(url, { "product_id": "abc" }).status_code,
+            400,
+        )
+        self.assertEqual(
+            self.client.post(url, { "product_id": 10 ** 20 }).status_code,
+            400,
+        )
+
+        # Positive once summed up, not one by one
+        self.assertEqual(
+            self.client.post(
+                url,
+                {
+                    "product_id": [product.id, product.id],
+                    "quantity": [3, -2],
+                },
+            ).status_code,
+            400,
+        )
+        self.assertEqual(
+            self.client.post(
+                url, { "product_id": [product.id, product.id + 1] }
+            ).status_code,
+            404,
+        )
+        self.assertFalse(models.BasketLine.objects.exists())
+
+    # The listing cache on its own (no full-page cache in front of it)
+    @modify_settings(MIDDLEWARE={
+        "remove": "main.middlewares.page_cache_middleware",
+    })
+    def test_products_page_is_served_from_cache(self):
+        product = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        url = reverse("main:products", kwargs={ "tag": "all" })
+
+        self.client.get(url)
+
+        # No session (basket), no listing queries at all
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+
+        self.assertContains(response, "The cathedral and the bazaar")
+        self.assertEqual(
+            caching.listing_stats(),
+            { "hits": 1, "misses": 1, "version": caching.catalog_version() },
+        )
+
+        # A change to the catalog invalidates the page
+        product.name = "The cathedral & the bazaar"
+        product.save()
+
+        response = self.client.get(url)
+        self.assertContains(response, "The cathedral &amp; the bazaar")
+
+        # So does tagging a product (only the m2m table changes)
+        tag = models.ProductTag.objects.create(name="Open", slug="open")
+        url = reverse("main:products", kwargs={ "tag": "open" })
+
+        response = self.client.get(url)
+        self.assertNotContains(response, "bazaar")
+
+        product.tags.add(tag)
+
+        response = self.client.get(url)
+        self.assertContains(response, "bazaar")
+
+        self.assertEqual(caching.listing_stats()["hits"], 1)
+
+    def test_listing_cache_stats_is_staff_only(self):
+        url = reverse("main:listing_cache_stats")
+
+        user = models.User.objects.create_user("user1", "pw432joij")
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        user.is_staff = True
+        user.save()
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            set(response.json()), { "hits", "misses", "version" }
+        )
+
+    def test_products_page_keyset_pagination(self):
+        for i in range(10):
+            models.Product.objects.create(
+                # Same names, so the `id` breaks the ties
+                name="Book %d" % (i // 3),
+                slug="book-%d" % i,
+                price=Decimal("1.00"),
+            )
+
+        expected = list(
+            models.Product.objects.active().order_by("name", "id")
+        )
+        url = reverse("main:products", kwargs={ "tag": "all" })
+
+        seen = []
+        response = self.client.get(url)
+
+        while True:
+            page = response.context["page_obj"]
+            seen.extend(page.object_list)
+
+            self.assertIsNone(response.context["paginator"])
+            self.assertNotContains(response, "?page=")
+
+            if not page.has_next():
+                break
+
+            response = self.client.get(url, { "cursor": page.next_cursor() })
+
+        self.assertEqual(seen, expected)
+
+        # And back, from the last page
+        response = self.client.get(
+            url, { "cursor": page.previous_cursor() }
+        )
+        self.assertEqual(
+            list(response.context["page_obj"].object_list), expected[4:8]
+        )
+
+        response = self.client.get(url, { "cursor": "not-a-cursor" })
+        self.assertEqual(response.status_code, 400)
+
+        # Well-formed, but not what `encode_cursor` would write
+        for crafted in (
+            ["next", ["x", "abc"]],
+            ["next", [[1], {}]],
+            ["next", [None, None]],
+            ["next", [{ "a": 1 }, 1]],
+            ["next", ["x", True]],
+            ["next", ["x", 10 ** 20]],
+            ["previous", ["\x00", 1]],
+        ):
+            cursor = base64.urlsafe_b64encode(
+                json.dumps(crafted).encode()
+            ).decode()
+            response = self.client.get(url, { "cursor": cursor })
+            self.assertEqual(response.status_code, 400)
+
+        # Nothing left before/after it -> the first page (no broken links)
+        for crafted in (["previous", ["A", 1]], ["next", ["Z", 1]]):
+            cursor = base64.urlsafe_b64encode(
+                json.dumps(crafted).encode()
+            ).decode()
+            response = self.client.get(url, { "cursor": cursor })
+
+            page = response.context["page_obj"]
+            self.assertEqual(list(page.object_list), expected[:4])
+            self.assertFalse(page.has_previous())
+            self.assertIsNotNone(page.next_cursor())
+
+        # The numbered pages still work
+        response = self.client.get(url, { "page": 3 })
+        self.assertEqual(list(response.context["object_list"]), expected[8:])
+
+        # The products of a followed Next link are gone meanwhile
+        next_page = {
+            "cursor": pagination.encode_cursor(
+                "next", expected[3], ("name", "id")
+            ),
+        }
+        models.Product.objects.filter(
+            pk__in=[product.pk for product in expected[4:]]
+        ).update(active=False)
+        caching.bump_catalog_version()
+
+        response = self.client.get(url, next_page)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(response.context["page_obj"].object_list), expected[:4]
+        )
+
+    def test_product_search_ranks_and_follows_changes(self):
+        in_name = models.Product.objects.create(
+            name="Django channels", slug="django-channels",
+            price=Decimal("10.00"),
+        )
+        in_description = models.Product.objects.create(
+            name="Web book", slug="web-book", price=Decimal("10.00"),
+            description="Using channels with Django",
+        )
+        models.Product.objects.create(
+            name="Django inactive", slug="django-inactive",
+            price=Decimal("10.00"), active=False,
+        )
+        tagged = models.Product.objects.create(
+            name="Python book", slug="python-book", price=Decimal("10.00"),
+        )
+
+        url = reverse("main:product_search")
+
+        def found(query):
+            response = self.client.get(url, { "q": query })
+            self.assertEqual(response.status_code, 200)
+            return list(response.context["object_list"])
+
+        self.assertEqual(found("django channels"), [in_name, in_description])
+        self.assertEqual(found("nothing"), [])
+        self.assertEqual(found(""), [])
+
+        # Tags (& their renames) are searchable too
+        tag = models.ProductTag.objects.create(name="Reactive", slug="r")
+        tagged.tags.add(tag)
+        self.assertEqual(found("reactive"), [tagged])
+
+        tag.name = "Asynchronous"
+        tag.save()
+        self.assertEqual(found("reactive"), [])
+        self.assertEqual(found("asynchronous"), [tagged])
+
+        tag.delete()
+        self.assertEqual(found("asynchronous"), [])
+
+        in_name.name = "Flask channels"
+        in_name.save()
+        self.assertEqual(found("django channels"), [in_description])
+
+    def test_products_page_multi_tag_filters_and_facets(self):
+        python = models.ProductTag.objects.create(name="Python", slug="python")
+        web = models.ProductTag.objects.create(name="Web", slug="web")
+
+        def product(slug, *tags, active=True):
+            product = models.Product.objects.create(
+                name=slug, slug=slug, price=Decimal("1.00"), active=active
+            )
+            product.tags.add(*tags)
+            return product
+
+        django = product("django", python, web)
+        flask = product("flask", python, web)
+        numpy = product("numpy", python)
+        react = product("react", web)
+        product("old-django", python, web, active=False)
+
+        url = reverse("main:products", kwargs={ "tag": "all" })
+
+        def listing(**params):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            return response
+
+        response = listing(tags="python,web")
+        self.assertEqual(list(response.context["object_list"]), [django, flask])
+
+        response = listing(tags="python,web", match="any")
+        self.assertEqual(
+            list(response.context["object_list"]),
+            [django, flask, numpy, react],
+        )
+
+        # The facets are counted within the selection (active products only)
+        response = listing(tags="web")
+        self.assertEqual(
+            [
+                (facet["slug"], facet["count"], facet["selected"])
+                for facet in response.context["facets"]
+            ],
+            [("python", 2, False), ("web", 3, True)],
+        )
+
+        # The URL tag & the query string tags add up
+        response = self.client.get(
+            reverse("main:products", kwargs={ "tag": "python" }),
+            { "tags": "web" },
+        )
+        self.assertEqual(list(response.context["object_list"]), [django, flask])
+
+        # Follows the changes
+        numpy.tags.add(web)
+        web.product_set.remove(flask)
+
+        response = listing(tags="python,web")
+        self.assertEqual(list(response.context["object_list"]), [django, numpy])
+
+        response = self.client.get(url, { "tags": "python,nope" })
+        self.assertEqual(response.status_code, 404)
+
+    def test_large_tag_selection_is_sent_as_one_parameter(self):
+        python = models.ProductTag.objects.create(name="Python", slug="python")
+        web = models.ProductTag.objects.create(name="Web", slug="web")
+
+        products = []
+
+        for slug, tags in (
+            ("django", (python, web)),
+            ("flask", (python, web)),
+            ("numpy", (python,)),
+            ("react", (web,)),
+        ):
+            product = models.Product.objects.create(
+                name=slug, slug=slug, price=Decimal("1.00")
+            )
+            product.tags.add(*tags)
+            products.append(product)
+
+        django, flask, numpy, react = products
+        url = reverse("main:products", kwargs={ "tag": "all" })
+
+        for params, expected in (
+            ({ "tags": "python,web" }, [django, flask]),
+            ({ "tags": "python,web", "match": "any" }, products),
+        ):
+            with patch.object(bitmaps, "MAX_IDS_IN_QUERY", 1), \
+                    CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url, params)
+
+            [page] = [
+                query["sql"] for query in ctx.captured_queries
+                if '"main_product"."name"' in query["sql"]
+            ]
+
+            self.assertEqual(list(response.context["object_list"]), expected)
+            self.assertNotIn("main_product_tags", page)
+            # e.g. '{1,2}' (PostgreSQL) or '[1,2]' (SQLite), not `IN (1, 2)`
+            self.assertIn(
+                ",".join(str(product.id) for product in expected), page
+            )
+
+    def test_product_page_is_cached_until_changed(self):
+        product = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        product.tags.create(name="Open Source", slug="opensource")
+        url = reverse("main:product", args=(product.slug,))
+
+        # The product, its tags & its images
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+
+        self.assertContains(response, "Open Source")
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+
+        self.assertContains(response, "The cathedral and the bazaar")
+
+        # A tag rename shows up on the page
+        tag = product.tags.get()
+        tag.name = "Free software"
+        tag.save()
+
+        self.assertContains(self.client.get(url), "Free software")
+
+        # So does an image
+        with open("main/fixtures/the-cathedral-the-bazaar.jpg", "rb") as fi:
+            image = models.ProductImage.objects.create(
+                product=product, image=ImageFile(fi, name="tctb.jpg")
+            )
+
+        self.assertContains(self.client.get(url), image.image.url)
+
+        image.thumbnail.delete(save=False)
+        image.image.delete(save=False)
+
+        # A new slug doesn't leave the old page behind
+        product.slug = "cathedral"
+        product.save()
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertContains(
+            self.client.get(reverse("main:product", args=("cathedral",))),
+            "The cathedral and the bazaar",
+        )
+
+    def test_catalog_pages_answer_conditional_gets(self):
+        product = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+
+        for url in (
+            reverse("main:products", kwargs={ "tag": "all" }),
+            reverse("main:product", args=(product.slug,)),
+        ):
+            response = self.client.get(url)
+            etag = response["ETag"]
+
+            # Nothing rendered, nothing queried
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+            self.assertEqual(response.status_code, 304)
+
+        # The ETag only for a listing (its products come & go)
+        listing = reverse("main:products", kwargs={ "tag": "all" })
+        self.assertNotIn("Last-Modified", self.client.get(listing))
+
+        response = self.client.get(url)
+        self.assertIn("Last-Modified", response)
+
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # A tag is on the page, so it's a new version of it
+        url = reverse("main:product", args=(product.slug,))
+        product.tags.create(name="Open Source", slug="opensource")
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_listing_is_not_stale_for_if_modified_since(self):
+        products = [
+            models.Product.objects.create(
+                name="Book %d" % i, slug="book-%d" % i, price=Decimal("1.00")
+            )
+            for i in range(5)
+        ]
+        url = reverse("main:products", kwargs={ "tag": "all" })
+        since = http_date(time.time() + 60)
+
+        self.client.get(url)
+
+        # An older product moves onto the first page
+        products[0].active = False
+        products[0].save()
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Book 4")
+
+    def test_conditional_gets_are_shared_with_a_basket(self):
+        product = models.Product.objects.create(
+            name="The cathedral and the bazaar",
+            slug="cathedral-bazaar",
+            price=Decimal("10.00"),
+        )
+        url = reverse("main:product", args=(product.slug,))
+
+        shared = self.client.get(url)
+
+        self.client.get(
+            reverse("main:add_to_basket"), { "product_id": product.id }
+        )
+
+        # The basket isn't in the page, only in 'basket/summary/'
+        response = self.client.get(url)
+        self.assertEqual(response["ETag"], shared["ETag"])
+        self.assertEqual(response["Last-Modified"], shared["Last-Modified"])
+        self.assertNotIn("private", response.get("Cache-Control", ""))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=shared["ETag"])
+        self.assertEqual(response.status_code, 304)
\ No newline at end of file
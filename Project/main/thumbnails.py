@@ -0,0 +1,186 @@
+import queue
+import logging
+import posixpath
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.templatetags.static import static
+
+from . import caching, models, renditions
+
+EXTENSIONS = { renditions.JPEG: "jpg", renditions.WEBP: "webp" }
+
+# Shown by the product page until the worker is done
+PLACEHOLDER = "images/thumbnail-placeholder.svg"
+
+logger = logging.getLogger(__name__)
+
+
+def placeholder_url():
+    return static(PLACEHOLDER)
+
+
+def store(field, name, content):
+    """
+    -> the path actually used (the storage never overwrites a file)
+    """
+
+    return field.storage.save(
+        field.generate_filename(None, name), ContentFile(content)
+    )
+
+
+def generate(image_id, render=renditions.render):
+    """
+    The job itself, for ONE 'ProductImage' (by id),
+    its thumbnail & its renditions (see 'main/renditions.py').
+    -> True if they were stored
+
+    About the `image=name` in the `UPDATE`
+        The image may have been replaced while this job was running,
+        the stale files are thrown away then
+        (the new image has its own job).
+    """
+
+    image = models.ProductImage.objects.filter(pk=image_id).first()
+
+    if image is None or not image.image:
+        return False
+
+    name = image.image.name
+
+    with image.image.open("rb") as source:
+        result = render(source.read())
+
+    stem, ext = posixpath.splitext(posixpath.basename(name))
+    Rendition = models.ProductImageRendition
+    rendition_field = Rendition._meta.get_field("file")
+
+    path = store(
+        models.ProductImage._meta.get_field("thumbnail"),
+        stem + ext,
+        result["thumbnail"],
+    )
+    rows = [
+        Rendition(
+            image_id=image_id,
+            width=width,
+            format=kind,
+            size=len(content),
+            file=store(
+                rendition_field,
+                "%s-%d.%s" % (stem, width, EXTENSIONS[kind]),
+                content,
+            ),
+        )
+        for width, kind, content in result["renditions"]
+    ]
+
+    with transaction.atomic():
+        stored = models.ProductImage.objects \
+            .filter(pk=image_id, image=name) \
+            .update(thumbnail=path)
+
+        if stored:
+            previous = Rendition.objects.filter(image_id=image_id)
+            stale = [rendition.file.name for rendition in previous]
+            previous.delete()
+            Rendition.objects.bulk_create(rows)
+        else:
+            stale = [path] + [row.file.name for row in rows]
+
+    for stale_name in stale:
+        rendition_field.storage.delete(stale_name)
+
+    if not stored:
+        return False
+
+    # Same as saving the image (an `UPDATE` sends no signal)
+    from .signals import touch_products
+
+    touch_products([image.product_id])
+    caching.bump_catalog_version()
+
+    logger.info("Thumbnail ready for product %2d", image.product_id)
+
+    return True
+
+
+class ThumbnailWorker:
+    """
+    A local queue of image ids, consumed by a few threads,
+    each of them handing the Pillow work to a process pool.
+    || the request (admin, import ..) only pays for `queue.put`
+    || a thread waits on its process & writes the result (DB + storage)
+
+    Started on the first `submit`, with `THUMBNAIL_WORKERS` processes.
+    `THUMBNAIL_WORKERS = 0` -> no pool, `submit` does the job right away.
+
+    Usage
+    >> worker.submit(image.id)
+    >> worker.join()        # wait until the queue is empty (tests, commands)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pool = None
+        self._threads = []
+
+    @property
+    def processes(self):
+        return getattr(settings, "THUMBNAIL_WORKERS", 2)
+
+    def submit(self, image_id):
+        if not self.processes:
+            generate(image_id)
+            return
+
+        self.start()
+        self._queue.put(image_id)
+
+    def start(self, processes=None):
+        """
+        `processes` overrides the setting (e.g. 'import_data --workers'),
+        only the first call counts.
+        """
+
+        processes = processes or self.processes
+
+        with self._lock:
+            if self._pool is not None:
+                return
+
+            self._pool = ProcessPoolExecutor(max_workers=processes)
+
+            for i in range(processes):
+                thread = threading.Thread(
+                    target=self._run, name="thumbnails-%d" % i, daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def join(self):
+        self._queue.join()
+
+    def render(self, data):
+        return self._pool.submit(renditions.render, data).result()
+
+    def _run(self):
+        while True:
+            image_id = self._queue.get()
+
+            try:
+                generate(image_id, render=self.render)
+            except Exception:
+                logger.exception("Thumbnail failed for image %s", image_id)
+            finally:
+                # A thread of its own -> a connection of its own
+                connection.close()
+                self._queue.task_done()
+
+
+worker = ThumbnailWorker()
@@ -1,12 +1,11 @@
 from django.urls import path, include
 
 from django.views.generic import TemplateView
-from django.views.generic.detail import DetailView
 from django.contrib.auth import views as auth_views
 
 from rest_framework import routers
 
-from main import views, models, forms
+from main import views, forms
 from main import endpoints
 
 app_name = "main"
@@ -17,14 +16,20 @@ router.register(r"orders", endpoints.PaidOrderViewSet)
 
 urlpatterns = [
     path("product/<slug:slug>/",
-         DetailView.as_view(model=models.Product), name="product"),
+         views.ProductDetailView.as_view(), name="product"),
     path("products/<slug:tag>/",
          views.ProductListView.as_view(), name="products"),
+    path("search/",
+         views.ProductSearchView.as_view(), name="product_search"),
 
     path("add_to_basket/",
          views.add_to_basket, name="add_to_basket"),
+    path("add_to_basket/many/",
+         views.add_many_to_basket, name="add_many_to_basket"),
     path("basket/",
          views.manage_basket, name="basket"),
+    path("basket/summary/",
+         views.basket_summary, name="basket_summary"),
 
     path("order/done/",
          TemplateView.as_view(template_name="order_done.html"), name="checkout_done"),
@@ -59,6 +64,8 @@ urlpatterns = [
     path("about-us/",
          TemplateView.as_view(template_name="about_us.html"), name="about_us"),
 
+    path("api/cache-stats/",
+         endpoints.listing_cache_stats, name="listing_cache_stats"),
     path("api/", include(router.urls)),
 
     path("",
@@ -1,10 +1,27 @@
 import logging
+import uuid
+import calendar
+from collections import Counter
+from itertools import zip_longest
 
 from django.contrib import messages
 
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousOperation
 from django.shortcuts import get_object_or_404, render
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag, urlencode
+from django.utils.safestring import mark_safe
 from django.urls import reverse, reverse_lazy
-from django.http import HttpResponseRedirect
+from django.http import (
+    Http404,
+    HttpResponseBadRequest,
+    HttpResponseRedirect,
+    JsonResponse,
+)
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_POST
 
 from django.contrib.auth.mixins import (
     LoginRequiredMixin,
@@ -12,6 +29,7 @@ from django.contrib.auth.mixins import (
 )
 from django.contrib.auth import login, authenticate
 from django.views.generic.list import ListView
+from django.views.generic.detail import DetailView
 from django.views.generic.edit import (
     FormView,
     CreateView,
@@ -21,36 +39,310 @@ from django.views.generic.edit import (
 
 from django import forms as django_forms
 from django.db import models as django_models
+from django.db import transaction
 
 import django_filters
 from django_filters.views import FilterView
 
-from main import forms, models
+from main import bitmaps, caching, forms, models, pagination, search
+from main import thumbnails
 
 logger = logging.getLogger(__name__)
 
 
+def conditional_page(request, etag, last_modified, render):
+    """
+    Conditional GET (ETag/Last-Modified) for the catalog pages.
+    -> a 304 if the visitor's copy is still fine (`render` is never called)
+
+    About the validators
+        They describe the catalog part of the page ONLY,
+        the same for every visitor (the basket isn't in the page anymore,
+        see `basket_summary`).
+        || pending messages        -> no validators at all (a full page)
+    """
+
+    if len(messages.get_messages(request)):
+        return render()
+
+    etag = quote_etag(etag)
+    timestamp = None
+    if last_modified is not None:
+        timestamp = calendar.timegm(last_modified.utctimetuple())
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=timestamp
+    )
+
+    if response is None:
+        response = render()
+
+    response["ETag"] = etag
+    if timestamp is not None:
+        response["Last-Modified"] = http_date(timestamp)
+
+    patch_vary_headers(response, ("Cookie",))
+
+    return response
+
+
 class ProductListView(ListView):
+    """
+    About the cache
+        The listing itself (products + pagination) is rendered ONCE
+        per (catalog version, tags, page) & stored in the cache,
+        the rest of the page (basket, messages ..) is still per-request.
+        || hit  -> no query at all for the listing
+        || miss -> the usual tag + products queries, then stored
+        The version is bumped by the signals ('main/signals.py').
+
+    About the pagination
+        || ?cursor=..   keyset, ordered by (name, id), Previous/Next only
+        ||              (the default, no COUNT & no OFFSET at all)
+        || ?page=3      the old numbered pages, still served for old links
+
+    About the tags
+        || /products/opensource/                       one tag
+        || /products/all/?tags=python,web              ALL of them
+        || /products/all/?tags=python,web&match=any    ANY of them
+        Answered by the tag bitmap index ('main/bitmaps.py'),
+        so are the counts of the sidebar (no JOIN on the tags).
+    """
+
     template_name = "main/product_list.html"
+    listing_template_name = "includes/product_list_page.html"
     paginate_by = 4
+    keyset_ordering = ("name", "id")
+
+    def get(self, request, *args, **kwargs):
+        page = self.kwargs.get(self.page_kwarg) \
+            or request.GET.get(self.page_kwarg)
+        cursor = request.GET.get("cursor")
+
+        self.extra_tags = [
+            slug
+            for slug in dict.fromkeys(request.GET.get("tags", "").split(","))
+            if slug
+        ]
+        self.match = "any" if request.GET.get("match") == "any" else "all"
+
+        tags = caching.tags_token(
+            self.kwargs["tag"], self.extra_tags, self.match
+        )
+
+        # Only real pages/cursors, no need to cache '?page=whatever'
+        key = None
+        if page is None:
+            key = caching.listing_key(tags, caching.cursor_token(cursor))
+        elif str(page).isdigit():
+            key = caching.listing_key(tags, int(page))
+
+        listing = cache.get(key) if key else None
+
+        # Not loaded at all on a hit
+        self.object_list = None
+
+        if key:
+            caching.count_listing(hit=listing is not None)
+
+        if listing is None:
+            self.object_list = self.get_queryset()
+            context = self.get_context_data()
+            html = render_to_string(self.listing_template_name, context)
+
+            listing = {
+                "html": html,
+                "etag": caching.content_etag(html),
+            }
+
+            if key:
+                cache.set(key, listing, caching.LISTING_TIMEOUT)
+
+        # No `Last-Modified`, a product leaving the page (deactivated ..)
+        # brings an OLDER one in, only the ETag sees that the page changed
+        return conditional_page(
+            request,
+            listing["etag"],
+            None,
+            lambda: self.render_to_response(
+                {"listing": mark_safe(listing["html"])}
+            ),
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Same return value as the `ListView` one
+        -> (paginator, page, object_list, is_paginated)
+        with NO paginator in the keyset mode.
+        """
+
+        if self.kwargs.get(self.page_kwarg) \
+                or self.request.GET.get(self.page_kwarg):
+            return super().paginate_queryset(queryset, page_size)
+
+        try:
+            page = pagination.paginate_keyset(
+                queryset,
+                self.request.GET.get("cursor"),
+                page_size,
+                self.keyset_ordering,
+            )
+        except pagination.InvalidCursor:
+            # A 400, the cursor was never written by us
+            raise SuspiciousOperation("Invalid cursor")
+
+        return None, page, page.object_list, page.has_other_pages()
 
     def get_queryset(self):
         """
-        Ah, the two `tag`s here are NOT the same.
+        Ah, the `tag` (in the URL) & the `tags` (in the query string)
+        are simply added up.
         """
 
         tag = self.kwargs["tag"]
-        self.tag = None
+        slugs = ([] if tag == "all" else [tag]) + self.extra_tags
+
+        self.index = bitmaps.tag_index
+        self.index.ensure_fresh()
+        self.selection = self.index.active
+
+        products = models.Product.objects.active()
+
+        if slugs:
+            try:
+                tag_ids = self.index.resolve(slugs)
+            except KeyError:
+                raise Http404("No ProductTag matches the given query.")
+
+            self.selection = self.index.select(tag_ids, self.match)
+            products = self.index.narrow(products, self.selection)
+
+        return products.order_by(*self.keyset_ordering)
+
+    def get_context_data(self, **kwargs):
+        """
+        `filter_query` is kept by the pagination links,
+        every facet links to the current tags + its own.
+        """
+
+        context = super().get_context_data(**kwargs)
+
+        def query(tags):
+            params = { "tags": ",".join(tags) } if tags else { }
+            if tags and self.match == "any":
+                params["match"] = "any"
+            return urlencode(params)
+
+        context["filter_query"] = query(self.extra_tags)
+        context["facets"] = [
+            {
+                "slug": slug,
+                "name": name,
+                "count": count,
+                "selected": slug in self.extra_tags
+                            or slug == self.kwargs["tag"],
+                "query": query(self.extra_tags + [slug]),
+            }
+            for slug, name, count in self.index.facets(self.selection)
+        ]
+
+        return context
+
+
+class ProductDetailView(DetailView):
+    """
+    About the queries (on a miss)
+        || 1. the product
+        || 2. its tags      (`prefetch_related`)
+        || 3. its images    (`prefetch_related`)
+        || 4. their renditions (only if there are images)
+        No matter how many tags/images there are.
+
+    About the cache
+        The table & the images (for the `ImageBox`) are kept per product,
+        forgotten by the signals as soon as the product, one of its images
+        or one of its tags changes ('main/signals.py').
+        A hit doesn't touch the database at all.
+    """
+
+    model = models.Product
+    template_name = "main/product_detail.html"
+    queryset = models.Product.objects.prefetch_related(
+        "tags", "productimage_set__renditions"
+    )
+    detail_template_name = "includes/product_detail_table.html"
+
+    def get(self, request, *args, **kwargs):
+        fragment = caching.get_product_fragment(self.kwargs["slug"])
 
-        if tag != "all":
-            self.tag = get_object_or_404(models.ProductTag, slug=tag)
+        # Not loaded at all on a hit
+        self.object = None
 
-        if self.tag:
-            products = models.Product.objects.active().filter(tags=self.tag)
-        else:
-            products = models.Product.objects.active()
+        if fragment is None:
+            self.object = self.get_object()
+            fragment = self.render_fragment(self.object)
+            caching.set_product_fragment(fragment)
 
-        return products.order_by("name")
+        fragment["detail"] = mark_safe(fragment["detail"])
+
+        return conditional_page(
+            request,
+            fragment["etag"],
+            fragment["last_modified"],
+            lambda: self.render_to_response({ "product": fragment }),
+        )
+
+    def render_fragment(self, product):
+        detail = render_to_string(
+            self.detail_template_name, { "product": product }
+        )
+        # The renditions come with the thumbnail (the same job),
+        # a new image still in the queue has neither
+        images = [
+            {
+                "image": image.image.url,
+                "thumbnail": image.thumbnail.url
+                if image.thumbnail else thumbnails.placeholder_url(),
+                "srcset": image.srcsets() if image.thumbnail else { },
+            }
+            for image in product.productimage_set.all()
+        ]
+
+        return {
+            "id": product.id,
+            "slug": product.slug,
+            "detail": detail,
+            "images": images,
+            "etag": caching.content_etag(detail, images),
+            "last_modified": product.date_updated,
+        }
+
+
+class ProductSearchView(ListView):
+    """
+    >> /search/?q=django+channels
+
+    Every word must match (name, tag names or description),
+    the best matches come first, see 'main/search.py'.
+    """
+
+    template_name = "main/product_search.html"
+    paginate_by = 4
+
+    def get_queryset(self):
+        self.query = self.request.GET.get("q", "").strip()
+
+        if not self.query:
+            return models.Product.objects.none()
+
+        return search.search_products(
+            models.Product.objects.active(), self.query
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["query"] = self.query
+        return context
 
 
 class ContactUsView(FormView):
@@ -181,16 +473,61 @@ class AddressDeleteView(LoginRequiredMixin, DeleteView):
         return self.model.objects.filter(user=self.request.user)
 
 
-def add_to_basket(request):
+def get_or_create_basket(request):
+    """
+    Whether there is BASKET in the session storage
+    Yep -> Okay
+    Nah -> Create one (with the current user, or None)
+    """
+
+    if request.basket:
+        return request.basket
+
+    if request.user.is_authenticated:
+        user = request.user
+    else:
+        user = None
+
+    # Create a basket with current user (or None)
+    #   That means <You CAN "add products to basket" without logging in!>
+    basket = models.Basket.objects.create(user=user)
+
+    # Create a session storage in browser
+    request.session["basket_id"] = basket.id
+    request.basket = basket
+
+    return basket
+
+
+@never_cache
+def basket_summary(request):
     """
-    # TODO Review needed, but not now.
+    >> GET /basket/summary/
+    {"count": 3}
+
+    The basket widget of 'base.html' asks for it by itself (fetch),
+    so the pages don't depend on the visitor's basket at all
+    (and can be cached, see 'page_cache_middleware').
+    """
+
+    basket = request.basket
 
+    return JsonResponse({ "count": basket.count() if basket else 0 })
+
+
+def add_to_basket(request):
+    """
     The <middlewares> we've written helps us to get the "basket in session|cookie".
 
     Some results (might be bugs, or not)
     -- 1. You could buy the same product multiple times.
     -- 2. You could buy products without logging in (huh?).
     -- 3. ..
+
+    About the `add_products` (the upsert)
+        NO more 'get_or_create, then quantity += 1, then save'.
+        It's one `INSERT .. ON CONFLICT DO UPDATE`, the DB adds +1 by itself,
+        so two clicks at the same time can't lose an increment.
     """
 
     # Get ONE product at a time (every time you clicked the 'add_to_basket')
@@ -198,42 +535,8 @@ def add_to_basket(request):
         models.Product, pk=request.GET.get("product_id")
     )
 
-    # Whether there is BASKET in the session storage
-    # Yep -> Okay
-    # Nah -> None
-    basket = request.basket
-
-    # If the basket is NULL
-    if not request.basket:
-
-        if request.user.is_authenticated:
-            user = request.user
-        else:
-            user = None
-
-        # Create a basket with current user (or None)
-        #   That means <You CAN "add products to basket" without logging in!>
-        basket = models.Basket.objects.create(user=user)
-
-        # Create a session storage in browser
-        request.session["basket_id"] = basket.id
-
-    # Add the 'product' to the 'basket'
-    #   and the `created` arg is a boolean value (succeeded or not)
-    basketline, created = models.BasketLine.objects.get_or_create(
-        basket=basket, product=product
-    )
-
-    # True  ->  Equals to 'buy the product first time'
-    # False ->
-    #   Cuz the above (basket, product) is the same,
-    #   that means you can't create the objects again (which products 'False').
-    #   ---------- Ah, the logic is quite NOT intuitive, hell no! ----------
-    #   The 'False' resulted in you're NOT the first time to buy it
-    #   thus the quantity of the product in the basket should be increased.
-    if not created:
-        basketline.quantity += 1
-        basketline.save()
+    basket = get_or_create_basket(request)
+    basket.add_products({ product.id: 1 })
 
     # Pitfall
     #   Mixed 'args=(product.slug,)' with 'args=(product.slug)'  ( the ',' )
@@ -247,28 +550,83 @@ def add_to_basket(request):
     )
 
 
+@require_POST
+def add_many_to_basket(request):
+    """
+    Several products at once (e.g. "reorder" & bundle buttons)
+    >> POST product_id=3&quantity=2&product_id=7&quantity=1
+
+    A missing `quantity` means 1, the same product twice is summed up
+    (every quantity must be positive on its own, `3` & `-2` isn't `1`).
+    All the lines are written by ONE upsert statement.
+    """
+
+    product_ids = request.POST.getlist("product_id")
+    quantities = request.POST.getlist("quantity")
+
+    if not product_ids or len(quantities) > len(product_ids):
+        return HttpResponseBadRequest("Mismatched product_id/quantity")
+
+    wanted = Counter()
+
+    try:
+        for product_id, quantity in zip_longest(
+            product_ids, quantities, fillvalue=1
+        ):
+            product_id, quantity = int(product_id), int(quantity)
+
+            # Beyond a `bigint`, the lookup itself fails (`OverflowError`)
+            if product_id not in pagination.INTEGER_RANGE:
+                return HttpResponseBadRequest("Invalid product_id/quantity")
+
+            if quantity < 1:
+                return HttpResponseBadRequest("Quantities must be positive")
+
+            wanted[product_id] += quantity
+    except ValueError:
+        return HttpResponseBadRequest("Invalid product_id/quantity")
+
+    found = models.Product.objects \
+        .filter(pk__in=wanted) \
+        .values_list("pk", flat=True)
+
+    if len(found) != len(wanted):
+        raise Http404("Unknown product")
+
+    basket = get_or_create_basket(request)
+    basket.add_products(dict(wanted))
+
+    return HttpResponseRedirect(reverse("main:basket"))
+
+
 def manage_basket(request):
     """
+    The lines are loaded together with their products (`select_related`),
+    otherwise 'basket.html' queries every product name one by one.
     """
 
     # The user doesn't have a basket yet (just browsing)
     if not request.basket:
         return render(request, "basket.html", { "formset": None })
 
+    lines = models.BasketLine.objects.select_related("product")
+
     if request.method == "POST":
 
         # Post actions (deletion)
         formset = forms.BasketLineFormSet(
-            request.POST, instance=request.basket
+            request.POST, instance=request.basket, queryset=lines
         )
 
         if formset.is_valid():
-            formset.save()
+            with transaction.atomic():
+                formset.save()
+                request.basket.recount()
     else:
 
         # Method 'GET' (display the form only)
         formset = forms.BasketLineFormSet(
-            instance=request.basket
+            instance=request.basket, queryset=lines
         )
 
     # The user do has a basket, but with its amount of product is zero ?!
@@ -285,12 +643,23 @@ class AddressSelectionView(LoginRequiredMixin, FormView):
 
     About `get_from_kwargs`
         Extract the 'user' & then assign to the response
+
+    About the `idempotency_key`
+        A fresh one is rendered with every page (hidden field).
+        Double-submits post the same key, so the second one finds
+        the order already created instead of creating another one.
     """
 
     template_name = "address_select.html"
     form_class = forms.AddressSelectionForm
     success_url = reverse_lazy("main:checkout_done")
 
+    def get_initial(self):
+        initial = super().get_initial()
+        initial["idempotency_key"] = uuid.uuid4()
+
+        return initial
+
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
         kwargs["user"] = self.request.user
@@ -298,13 +667,30 @@ class AddressSelectionView(LoginRequiredMixin, FormView):
         return kwargs
 
     def form_valid(self, form):
-        del self.request.session["basket_id"]
-
+        idempotency_key = form.cleaned_data["idempotency_key"]
         basket = self.request.basket
-        basket.create_order(
-            form.cleaned_data["billing_address"],
-            form.cleaned_data["shipping_address"]
-        )
+
+        if basket:
+            basket.create_order(
+                form.cleaned_data["billing_address"],
+                form.cleaned_data["shipping_address"],
+                idempotency_key=idempotency_key,
+            )
+
+            # The key of an earlier order, this basket wasn't checked out
+            if basket.status != models.Basket.SUBMITTED:
+                return super().form_valid(form)
+
+        elif not (
+            idempotency_key
+            and models.Order.objects.filter(
+                user=self.request.user, idempotency_key=idempotency_key
+            ).exists()
+        ):
+            # No basket & no order from an earlier submit, nothing to do
+            return HttpResponseRedirect(reverse("main:basket"))
+
+        self.request.session.pop("basket_id", None)
 
         return super().form_valid(form)
 